@@ -24,6 +24,10 @@
 #
 
 from .connection import *
+from .pool import *
+from .async_connection import *
+from .compression import *
+from .stats import *
 from .descriptors import *
 from .exceptions import *
 from .functions import *
@@ -0,0 +1,666 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import ctypes
+import socket
+import asyncio
+import logging
+
+from .connection import *
+from .connection import _parse_url, _ssh_remote_command, _ssh_subprocess_command, _login_message, _checkCompressionLevel
+
+ASYNC_SUPPORTED_PROTOCOLS = ['tcp', 'tcp6', 'ssh', 'sshp']
+
+class AsyncConnection:
+    """
+    Implements an MDSip connection to an MDSplus server using asyncio.
+
+    This provides the same API as :class:`Connection`, but every method that talks to the server
+    is a coroutine. Any number of tasks can await requests on the same connection at once, the
+    requests are written back-to-back and the replies are matched to their requests using the
+    `message_id` of each message.
+
+    Example:
+    ```
+    async with AsyncConnection('server') as c:
+        await c.openTree('test', 123)
+        y, x = await asyncio.gather(
+            c.get('SIGNAL_NODE'),
+            c.get('dim_of(SIGNAL_NODE)'),
+        )
+    ```
+    """
+
+    def __init__(self,
+        url: str,
+        timeout: float = 60.0,
+        verbose: bool = False,
+        ssh_port: int = None,
+        sshp_host: str = 'localhost',
+        ssh_subprocess_args: list = None,
+        ssh_use_plink: bool = False,
+        compression_level: int = 0,
+        compression_policy: CompressionPolicy = None,
+    ):
+        """
+        Initialize an MDSplus connection to a given URL, the connection will be made when
+        `connect()` is awaited, or when used in an `async with` statement.
+
+        The URL will be parsed as `proto://username@host:port`, see :class:`Connection` for
+        more information.
+
+        Supported protocols:
+         * tcp:// - Connect directly to the MDSip server at `host:port` over IPv4.
+         * tcp6:// - Connect directly to the MDSip server at `host:port` over IPv6.
+         * ssh:// - Connect over SSH to `host:ssh_port` and then spawn `mdsip-server-ssh`.
+         * sshp:// - Connect over SSH to `host:ssh_port` and then spawn `nc $sshp_host $port`.
+
+        The SSH protocols always use an `ssh` subprocess, as paramiko does not support asyncio.
+
+        :param str url: The URL to connect to.
+        :param float timeout: The timeout for connecting and for each request in seconds,
+            defaults to 60s
+        :param bool verbose: Enable debug logging for this connection.
+        :param int ssh_port: The port to ssh to when using one of the SSH protocols.
+        :param str sshp_host: The host to netcat to when using `sshp://`, defaults to 'localhost'.
+        :param list ssh_subprocess_args: Additional arguments to pass to the ssh subprocess
+            command line when using one of the SSH protocols.
+        :param bool ssh_use_plink: Attempt to use `plink.exe -batch` instead of `ssh.exe`
+            for ssh:// and sshp:// connections.
+        :param int compression_level: The zlib compression level, from 0 to 9, to request from
+            the server when logging in. Defaults to 0, which disables compression.
+        :param CompressionPolicy compression_policy: Decides which requests to compress, and
+            how much, up to the negotiated level. Defaults to `CompressionPolicy()`.
+        :raises MdsException: if an unsupported protocol is specified, or if the compression
+            level is invalid.
+        """
+
+        logging.basicConfig()
+
+        self._logger = logging.getLogger(__name__)
+        if verbose:
+            self._logger.setLevel(logging.DEBUG)
+        else:
+            self._logger.setLevel(logging.WARNING)
+
+        self._reader = None
+        self._writer = None
+        self._ssh_subprocess = None
+        self._tasks = []
+        self._timeout = timeout
+        self._message_id = INVALID_MESSAGE_ID
+        self._server_api_version = None
+        self._server_version = None
+        self._compression_level = None
+
+        _checkCompressionLevel(compression_level)
+        self._requested_compression_level = compression_level
+        self._compression_policy = compression_policy if compression_policy is not None else CompressionPolicy()
+
+        # Futures for the replies we are waiting for, by message_id
+        self._waiters = {}
+
+        self._ssh_port = ssh_port
+        self._sshp_host = sshp_host
+        self._ssh_subprocess_args = ssh_subprocess_args
+        self._ssh_use_plink = ssh_use_plink
+
+        self._url = url
+        self._protocol, self._username, self._host, self._port = _parse_url(url, ASYNC_SUPPORTED_PROTOCOLS)
+
+        if self._port is not None:
+            if self._protocol == 'ssh' and self._ssh_port is None:
+                self._ssh_port = self._port
+        else:
+            # The MDSip default port
+            self._port = 8000
+
+    # Used for async with statement
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    # Used for async with statement
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.disconnect()
+
+    async def connect(self):
+        """
+        Open the stream and do the login handshake.
+
+        :raises TimeoutError: if the connection fails.
+        :raises socket.gaierror: if the hostname could not be resolved.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises MdsException: if the login fails.
+        """
+
+        # Created here so that they belong to the running event loop
+        self._send_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(MAX_MESSAGE_ID)
+
+        if self._protocol in ['tcp', 'tcp6']:
+
+            if self._protocol == 'tcp':
+                socket_family = socket.AF_INET
+            else:
+                socket_family = socket.AF_INET6
+
+            self._logger.debug(f'Connecting to {self._host}:{self._port}')
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port, family=socket_family),
+                self._timeout,
+            )
+
+            # See Connection.connect()
+            self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        elif self._protocol in ['ssh', 'sshp']:
+
+            import subprocess
+
+            command = _ssh_remote_command(self._protocol, self._sshp_host, self._port)
+            ssh_command = _ssh_subprocess_command(
+                self._username,
+                self._host,
+                command,
+                ssh_port=self._ssh_port,
+                ssh_subprocess_args=self._ssh_subprocess_args,
+                ssh_use_plink=self._ssh_use_plink,
+            )
+
+            ssh_command_print = [ f'"{v}"' if ' ' in v else v for v in ssh_command ]
+            self._logger.debug(f'Executing {" ".join(ssh_command_print)}')
+
+            self._ssh_subprocess = await asyncio.create_subprocess_exec(
+                *ssh_command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                # Do not pipe stderr>stdout or the first packet we recv could be the shell errors from ssh
+                stderr=subprocess.PIPE,
+            )
+
+            self._reader = self._ssh_subprocess.stdout
+            self._writer = self._ssh_subprocess.stdin
+
+            self._tasks.append(asyncio.ensure_future(self._log_stderr(self._ssh_subprocess.stderr)))
+
+        msg_login = _login_message(self._username, self._requested_compression_level)
+
+        self._logger.debug(f'Sending login request with username="{self._username}"')
+        self._writer.write(msg_login.pack())
+        await self._writer.drain()
+
+        # The login response packet is a copy of the login request packet, see Connection.connect()
+        try:
+            msg_login_buffer = await asyncio.wait_for(self._reader.readexactly(ctypes.sizeof(msg_login)), self._timeout)
+        except asyncio.IncompleteReadError:
+            raise BrokenPipeError('Connection closed before the login response was received')
+
+        msg_login = Message.from_buffer_copy(msg_login_buffer)
+
+        if STATUS_NOT_OK(msg_login.status):
+            raise MdsException('Failed to login')
+
+        self._compression_level = (msg_login.status & 0x1E) >> 1
+        self._client_type = msg_login.client_type
+
+        if msg_login.ndims > 0:
+            self._server_api_version = msg_login.dims[0]
+
+        self._logger.debug(f'Received login response with version={self._server_api_version} client_type={self._client_type} compression_level={self._compression_level}')
+
+        self._tasks.append(asyncio.ensure_future(self._read_replies()))
+
+    async def disconnect(self):
+        """Close the stream, and fail any requests that are still waiting for a reply."""
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+        self._fail_waiters(ConnectionAbortedError('The connection was closed'))
+
+        if self._writer is not None:
+            self._logger.debug('Disconnecting')
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+        if self._ssh_subprocess is not None:
+            if self._ssh_subprocess.returncode is None:
+                self._ssh_subprocess.terminate()
+            await self._ssh_subprocess.wait()
+            self._ssh_subprocess = None
+
+    async def reconnect(self):
+        """Await `disconnect()` and then `connect()`."""
+        await self.disconnect()
+        await self.connect()
+
+    async def _log_stderr(self, stderr):
+        while True:
+            line = await stderr.readline()
+            if len(line) == 0:
+                break
+            self._logger.warning(line.decode().rstrip())
+
+    def _fail_waiters(self, exception):
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_exception(exception)
+        self._waiters.clear()
+
+    async def _recv(self):
+
+        msg_buffer = await self._reader.readexactly(ctypes.sizeof(Message))
+        msg = Message.from_buffer_copy(msg_buffer)
+        data = Descriptor()
+
+        self._logger.debug(f'Received message with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
+
+        data_length = msg.msglen - ctypes.sizeof(msg)
+        if data_length > 0:
+            start = time.perf_counter()
+
+            if (msg.client_type & COMPRESSED) > 0:
+                prefix = await self._reader.readexactly(MessageDecompressor.PREFIX_SIZE)
+
+                # Decompress each chunk as soon as it arrives, instead of waiting for all of them
+                decompressor = MessageDecompressor(msg, prefix)
+
+                remaining = decompressor.compressed_length
+                while remaining > 0:
+                    chunk = await self._reader.read(min(remaining, RECV_CHUNK_SIZE))
+                    if len(chunk) == 0:
+                        raise asyncio.IncompleteReadError(chunk, remaining)
+
+                    decompressor.decompress(chunk)
+                    remaining -= len(chunk)
+
+                data_buffer = decompressor.finish()
+
+            else:
+                data_buffer = bytearray(await self._reader.readexactly(data_length))
+
+            self._compression_policy.recordTransfer(data_length, time.perf_counter() - start)
+
+            data = msg.unpack_data(data_buffer)
+
+        return msg, data
+
+    async def _read_replies(self):
+        try:
+            while True:
+                msg, data = await self._recv()
+
+                waiter = self._waiters.pop(msg.message_id, None)
+                if waiter is None:
+
+                    # With only one request outstanding there is no ambiguity, so tolerate
+                    # servers that do not echo the message_id back
+                    if len(self._waiters) != 1:
+                        raise MdsException(f'Received a reply with an unexpected message_id={msg.message_id}')
+
+                    _, waiter = self._waiters.popitem()
+
+                # The waiter could have been cancelled, but we still had to read its reply
+                if not waiter.done():
+                    waiter.set_result((msg, data))
+
+        except asyncio.CancelledError:
+            raise
+
+        except asyncio.IncompleteReadError:
+            self._fail_waiters(BrokenPipeError('Connection closed by the server'))
+
+        except Exception as e:
+            self._fail_waiters(e)
+
+    def _next_message_id(self):
+        # See Connection._next_message_id(), self._slots limits the number of requests in flight,
+        # but requests that timed out keep their message_id until their reply arrives
+        for _ in range(MAX_MESSAGE_ID):
+            self._message_id = (self._message_id % MAX_MESSAGE_ID) + 1
+            if self._message_id not in self._waiters:
+                return self._message_id
+
+        raise MdsException(f'Unable to allocate a message_id, there are already {MAX_MESSAGE_ID} requests in flight')
+
+    async def get(self, expr, *args, compression_level: int = None):
+        """
+        Evaluate an expression on the remote server and return the result. This works like
+        `mdsvalue()` in our other APIs.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param int compression_level: The compression level to send this request with,
+            overriding the compression policy. Use 0 to send it uncompressed.
+        :return: The result of executing the expression.
+        :rtype: :class:`Descriptor`
+        :raises TimeoutError: if the reply does not arrive within the timeout.
+        :raises BrokenPipeError: if the connection was closed.
+        :raises MdsException: if the result status indicates an error.
+        """
+
+        if compression_level is not None:
+            _checkCompressionLevel(compression_level)
+
+        if expr.strip() == '':
+            return Descriptor()
+
+        if self._writer is None:
+            raise MdsException('AsyncConnection is not connected, call connect() first.')
+
+        messages = [ Message(expr) ]
+        messages[0].nargs = 1 + len(args)
+
+        for i, arg in enumerate(args):
+            marg = Message(arg)
+            marg.nargs = messages[0].nargs
+            marg.descriptor_idx = i + 1
+            messages.append(marg)
+
+        for msg in messages:
+            level = compression_level
+            if level is None:
+                level = self._compression_policy.chooseLevel(msg.buffer, self._compression_level)
+
+            if level > 0:
+                msg.compress(level)
+
+        async with self._slots:
+            message_id = self._next_message_id()
+            for msg in messages:
+                msg.message_id = message_id
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[message_id] = waiter
+
+            try:
+                async with self._send_lock:
+                    for msg in messages:
+                        self._logger.debug(f'Sending packet with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
+                        self._writer.writelines(msg.pack_buffers())
+                    await self._writer.drain()
+
+            except:
+                self._waiters.pop(message_id, None)
+                raise
+
+            # If this times out, the waiter is cancelled but keeps its message_id until
+            # the reply arrives, so that the reply cannot be mistaken for a newer request
+            try:
+                manswer, data = await asyncio.wait_for(waiter, self._timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'No reply was received within {self._timeout}s')
+
+        if STATUS_NOT_OK(manswer.status):
+            raise getException(manswer.status)
+
+        return data
+
+    async def getObject(self, expr, *args):
+        """
+        Evaluate a `get()` expression, but the expression will be wrapped in 'SerializeOut'
+        and `deserialize()` will be called on the result. See :meth:`Connection.getObject()`.
+
+        The resulting objects are not tied to this connection, so things like the paths of
+        NIDs cannot be looked up lazily.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :return: The result of executing the expression.
+        :rtype: :class:`Descriptor`
+        :raises MdsException: if the result status indicates an error.
+        """
+        return (await self.get(f'SerializeOut(`({expr};))', *args)).deserialize()
+
+    async def put(self, path, expr, *args, compression_level: int = None):
+        """
+        Put an evaluated expression into a node in the last opened MDSplus tree.
+        See :meth:`Connection.put()`.
+
+        :param str path: The path to the node to write data into.
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param int compression_level: The compression level to send this request with,
+            overriding the compression policy. Use 0 to send it uncompressed.
+        :raises MdsException: if the result status indicates an error.
+        """
+        args = [path, expr] + list(args)
+        args_format = ','.join('$' * len(args))
+        status = (await self.get(f'TreePut({args_format})', *args, compression_level=compression_level)).data()
+
+        if STATUS_NOT_OK(status):
+            raise getException(status)
+
+    def getMany(self, **kwargs):
+        """
+        Return an :class:`AsyncGetMany` object tied to this connection.
+
+        :param **kwargs: Options for splitting large lists into batches, see :class:`AsyncGetMany`.
+        :return: :class:`AsyncGetMany(self, **kwargs)`
+        :rtype: :class:`AsyncGetMany`
+        """
+
+        return AsyncGetMany(self, **kwargs)
+
+    def putMany(self, **kwargs):
+        """
+        Return an :class:`AsyncPutMany` object tied to this connection.
+
+        :param **kwargs: Options for splitting large lists into batches, see :class:`AsyncPutMany`.
+        :return: :class:`AsyncPutMany(self, **kwargs)`
+        :rtype: :class:`AsyncPutMany`
+        """
+
+        return AsyncPutMany(self, **kwargs)
+
+    async def openTree(self, tree: str, shot: int, mode: str = 'NORMAL', path: str = None):
+        """
+        Open an MDSplus tree on a remote server. See :meth:`Connection.openTree()`.
+
+        :param str tree: The tree name to open.
+        :param int shot: The shot number to open.
+        :param str mode: The mode to open the tree in, either 'NORMAL', 'READONLY', or 'EDIT',
+            defaults to 'NORMAL'.
+        :param str path: The path to find the tree in, which overrides `{tree}_path` on the
+            server while the tree is being opened.
+        :raises TypeError: if the mode is invalid.
+        :raises MdsException: if the tree could not be opened.
+        """
+
+        mode = mode.upper()
+        if mode not in TREE_OPEN_EXPRESSIONS:
+            raise TypeError('Invalid mode specificed, must be "readonly", "normal", or "edit"')
+
+        try:
+            env_name = f'{tree.lower()}_path'
+            if path is not None:
+                old_path = await self.get(f'getenv("{env_name}")')
+                await self.get(f'setenv("{env_name}={path}")')
+
+            status = (await self.get(TREE_OPEN_EXPRESSIONS[mode], tree, shot)).data()
+
+            if STATUS_NOT_OK(status):
+                raise getException(status)
+
+        finally:
+            if path is not None:
+                await self.get(f'setenv("{env_name}={old_path}")')
+
+    async def closeTree(self, tree: str, shot: int):
+        """
+        Close an MDSplus tree on the remote server.
+
+        :param str tree: The tree name to close.
+        :param int shot: The shot number to close.
+        :raises MdsException: if the tree could not be closed.
+        """
+
+        status = (await self.get('TreeClose($,$)', tree, shot)).data()
+
+        if STATUS_NOT_OK(status):
+            raise getException(status)
+
+    async def closeAllTrees(self):
+        """
+        Close all open MDSplus trees.
+
+        :return: The number of trees closed.
+        :rtype: Descriptor
+        """
+
+        return await self.get("_i=0;WHILE(IAND(TreeClose(),1)) _i++;_i")
+
+    async def setDefault(self, path: str):
+        """
+        Change the current default tree location on the remote server
+
+        :param str path: The tree node path to be set as the new default location.
+        :raises MdsException: if the tree node could not be found, or the location
+            could not be changed.
+        """
+
+        status = (await self.get('TreeSetDefault($)', path)).data()
+
+        if STATUS_NOT_OK(status):
+            raise getException(status)
+
+    async def tcl(self, command: str):
+        """
+        Execute a mdstcl command and return the result.
+
+        :param str command: The mdstcl command to run.
+        :return: The command output from mdstcl.
+        :rtype: str
+        :raises MdsException: if there was a problem executing the command.
+        """
+        result = await self.get('Tcl($,_res);_res', command)
+        if result is None:
+            return ''
+        return result.data()
+
+    async def getServerVersion(self):
+        if self._server_version is None:
+            import re
+
+            show_version = await self.tcl('show version')
+            matches = re.search(r'MDSplus version: ([0-9]+)\.([0-9]+)\.([0-9]+)', show_version, re.MULTILINE)
+
+            self._server_version = (int(matches[1]), int(matches[2]), int(matches[3]))
+
+        return self._server_version
+
+class AsyncGetMany(GetMany):
+    """
+    A :class:`GetMany` tied to an :class:`AsyncConnection`, where `execute()` is a coroutine.
+
+    Example:
+    ```
+    gm = c.getMany()
+    gm.append('y', '\\IP')
+    gm.append('x', 'dim_of(\\IP)')
+    result = await gm.execute()
+    ```
+
+    The batches are always sent one after another, and the size of each reply can only be
+    estimated from the `reply_size` given to `append()`, so `dispatch` and `probe_sizes` are
+    not supported. `execute_iter()` and `submit()` are not supported either.
+
+    :param AsyncConnection connection: The connection to evaluate the expressions on.
+    :param **kwargs: Options for splitting large lists into batches, see :class:`GetMany`.
+    :raises MdsException: if `dispatch` or `probe_sizes` is given.
+    """
+
+    def __init__(self, connection, **kwargs):
+        if kwargs.get('probe_sizes', False):
+            raise MdsException('AsyncGetMany does not support probe_sizes, give the reply_size to append() instead')
+
+        if kwargs.get('dispatch', BATCH_DISPATCH_SEQUENTIAL) != BATCH_DISPATCH_SEQUENTIAL:
+            raise MdsException(f'AsyncGetMany only supports dispatch="{BATCH_DISPATCH_SEQUENTIAL}"')
+
+        super().__init__(connection, **kwargs)
+
+    async def execute(self, **parameters):
+        """
+        Execute all expressions in the list by calling `GetManyExecute()` on the remote
+        server, see :meth:`GetMany.execute()`.
+
+        :param **parameters: The values of the :class:`Parameter` arguments, by name.
+        :return: The Dictionary of results from the expressions.
+        :rtype: :class:`Dictionary`
+        :raises MdsException: if the result of GetManyExecute() is an error string, if
+            `get()` encounters an error, or if the parameters do not match.
+        """
+        # Large lists are split into batches, which are sent one after another
+        results = []
+        for batch in self._split(parameters):
+            results.append(await self._connection.get('GetManyExecute($)', batch))
+
+        return self._merge(results)
+
+    def execute_iter(self, deadline: float = None, **parameters):
+        raise MdsException('AsyncGetMany does not support execute_iter(), use execute() instead')
+
+    def submit(self, **parameters):
+        raise MdsException('AsyncGetMany does not support submit(), use execute() instead')
+
+class AsyncPutMany(PutMany):
+    """
+    A :class:`PutMany` tied to an :class:`AsyncConnection`, where `execute()` is a coroutine.
+    The batches are always sent one after another, so `dispatch` is not supported.
+
+    :param AsyncConnection connection: The connection to evaluate the expressions on.
+    :param **kwargs: Options for splitting large lists into batches, see :class:`PutMany`.
+    :raises MdsException: if `dispatch` is given.
+    """
+
+    def __init__(self, connection, **kwargs):
+        if kwargs.get('dispatch', BATCH_DISPATCH_SEQUENTIAL) != BATCH_DISPATCH_SEQUENTIAL:
+            raise MdsException(f'AsyncPutMany only supports dispatch="{BATCH_DISPATCH_SEQUENTIAL}"')
+
+        super().__init__(connection, **kwargs)
+
+    async def execute(self):
+        """
+        Execute and insert all expressions in the list by calling `PutManyExecute()`
+        on the remote server, see :meth:`PutMany.execute()`.
+
+        :return: The Dictionary of results from the expressions.
+        :rtype: :class:`Dictionary`
+        :raises MdsException: if the result of PutManyExecute() is an error string, or
+            if `get()` encounters an error.
+        """
+        # Large lists are split into batches, which are sent one after another
+        results = []
+        for batch in self._split():
+            results.append(await self._connection.get('PutManyExecute($)', batch))
+
+        return self._merge(results)
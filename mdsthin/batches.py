@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import re
+import time
+import ctypes
+import collections
+
+from .descriptors import *
+from .exceptions import *
+from .prepared import _pack_apd
+
+# GetMany and PutMany are split into batches whose requests, and estimated replies, fit within this size
+MAX_BATCH_SIZE = 256 * 1024 * 1024
+
+# How the batches of a GetMany or PutMany are sent to the server
+BATCH_DISPATCH_SEQUENTIAL = 'sequential'
+BATCH_DISPATCH_PIPELINED  = 'pipelined'
+BATCH_DISPATCH_POOL       = 'pool'
+
+# A TDI variable, and a TDI variable being assigned to
+_TDI_VARIABLE = re.compile(r'(?<![\w$])_\w+')
+_TDI_ASSIGNMENT = re.compile(r'(?<![\w$])(_\w+)\s*=(?!=)')
+
+class _Batches:
+    """
+    Splits the packed queries of a :class:`GetMany` or :class:`PutMany` into batches that fit
+    within the limits on their size, and sends them to the server.
+
+    :param Connection connection: The connection of the GetMany or PutMany.
+    :param int max_request_size: The largest serialized list of queries to send at once.
+    :param int max_reply_size: The largest estimated reply to ask for at once, or None.
+    :param int max_queries: The most queries to send at once, or None.
+    :param str dispatch: How to send the batches, one of the `BATCH_DISPATCH_*` modes.
+    :param ConnectionPool pool: The pool to lease connections from for `BATCH_DISPATCH_POOL`.
+    """
+
+    # The size of the name and the Dictionary around the value of each result, roughly
+    REPLY_OVERHEAD = 64
+
+    def __init__(self, connection, max_request_size: int, max_reply_size: int, max_queries: int, dispatch: str, pool):
+        if dispatch not in [ BATCH_DISPATCH_SEQUENTIAL, BATCH_DISPATCH_PIPELINED, BATCH_DISPATCH_POOL ]:
+            raise MdsException(f'Unknown dispatch mode "{dispatch}"')
+
+        if (dispatch == BATCH_DISPATCH_POOL) != (pool is not None):
+            raise MdsException(f'A ConnectionPool is required by, and only used by, dispatch="{BATCH_DISPATCH_POOL}"')
+
+        if max_queries is not None and max_queries < 1:
+            raise MdsException('max_queries must be at least 1')
+
+        self._connection = connection
+        self._max_request_size = max_request_size
+        self._max_reply_size = max_reply_size
+        self._max_queries = max_queries
+        self.dispatch = dispatch
+        self._pool = pool
+
+    def split(self, header: bytes, items: list, reply_sizes: list = None, expressions: list = None):
+        """
+        Split the packed queries into as few batches as fit within the limits. A query that
+        does not fit on its own is sent in a batch by itself.
+
+        :param bytes header: The packed `mdsdsc_a_t` of the List of queries.
+        :param list items: The packed queries.
+        :param list reply_sizes: The estimated size of the result of each query, or None.
+        :param list expressions: The expression of each query. If given, the expressions that
+            use a TDI variable are kept in the same batch as the expression that assigns it.
+        :return: The serialized batches.
+        :rtype: list of :class:`UInt8Array`
+        """
+
+        # Most lists fit in one batch
+        fits = (sum(map(len, items)) + len(items) * ctypes.sizeof(ctypes.c_uint32) <= self._max_request_size)
+        if reply_sizes is not None and self._max_reply_size is not None:
+            fits = fits and (sum(reply_sizes) + len(items) * self.REPLY_OVERHEAD <= self._max_reply_size)
+        if self._max_queries is not None:
+            fits = fits and (len(items) <= self._max_queries)
+
+        if fits:
+            return [ UInt8Array(_pack_apd(header, items)) ]
+
+        batches = []
+        start = 0
+        request_size = 0
+        reply_size = 0
+
+        for unit_start, unit_end in self._units(len(items), expressions):
+            unit_request_size = sum(len(items[i]) + ctypes.sizeof(ctypes.c_uint32) for i in range(unit_start, unit_end))
+
+            unit_reply_size = 0
+            if reply_sizes is not None:
+                unit_reply_size = sum(reply_sizes[i] + self.REPLY_OVERHEAD for i in range(unit_start, unit_end))
+
+            if unit_start > start:
+                too_large = (request_size + unit_request_size > self._max_request_size)
+                if self._max_reply_size is not None and reply_size + unit_reply_size > self._max_reply_size:
+                    too_large = True
+                if self._max_queries is not None and unit_end - start > self._max_queries:
+                    too_large = True
+
+                if too_large:
+                    batches.append((start, unit_start))
+                    start = unit_start
+                    request_size = 0
+                    reply_size = 0
+
+            request_size += unit_request_size
+            reply_size += unit_reply_size
+
+        batches.append((start, len(items)))
+
+        return [ UInt8Array(_pack_apd(header, items[ start : end ])) for start, end in batches ]
+
+    @staticmethod
+    def _units(count: int, expressions: list):
+        """
+        Return the ranges of queries that have to be sent in the same batch.
+        """
+
+        if expressions is None:
+            return [ (i, i + 1) for i in range(count) ]
+
+        units = []
+
+        # The index of the query that last assigned each variable
+        assigned = {}
+
+        for i, expression in enumerate(expressions):
+            start = i
+            for variable in _TDI_VARIABLE.findall(expression):
+                start = min(start, assigned.get(variable.upper(), i))
+
+            # Merge this query with every unit since the first query it depends on
+            while len(units) > 0 and units[-1][1] > start:
+                start = min(start, units.pop()[0])
+
+            units.append((start, i + 1))
+
+            for variable in _TDI_ASSIGNMENT.findall(expression):
+                assigned[variable.upper()] = i
+
+        return units
+
+    def execute(self, expr: str, batches: list, deadline: float = None, idempotent: bool = True):
+        """
+        Send each batch as the argument of `expr`, and return the result of each one.
+
+        :param str expr: The expression to evaluate with each batch, such as `GetManyExecute($)`.
+        :param list batches: The serialized batches, from `split()`.
+        :param float deadline: The number of seconds all of the batches may take, see `Connection.get()`.
+        :param bool idempotent: Whether the batches can safely be sent again after reconnecting.
+        :return: The result of each batch.
+        :rtype: list of :class:`Descriptor`
+        """
+
+        connection = self._connection
+
+        if len(batches) == 1 or self.dispatch == BATCH_DISPATCH_SEQUENTIAL:
+            with connection._deadline(deadline):
+                return [ connection.get(expr, batch, idempotent=idempotent) for batch in batches ]
+
+        if self.dispatch == BATCH_DISPATCH_PIPELINED:
+            with connection._deadline(deadline):
+                return self._executePipelined(expr, batches, idempotent)
+
+        import concurrent.futures
+
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+
+        # Each worker leases one connection, and sends batches on it until there are none left
+        pending = collections.deque(enumerate(batches))
+        results = [ None ] * len(batches)
+
+        max_workers = min(len(batches), self._pool._max_connections)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mdsthin-batch') as executor:
+            futures = [ executor.submit(self._executeLeased, expr, pending, results, deadline, idempotent) for _ in range(max_workers) ]
+            for future in futures:
+                future.result()
+
+        return results
+
+    def _executePipelined(self, expr: str, batches: list, idempotent: bool):
+        """
+        Send each batch before receiving the result of the one before it, so that the server can
+        evaluate one batch while we receive the result of the last. Only two are sent at a time,
+        so that neither side can stall writing a large message the other is not reading yet.
+        """
+
+        results = self._connection._pipeline([ (expr, (batch,)) for batch in batches ], 2, idempotent)
+
+        # All of the replies have been received, so the first error can be raised
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return results
+
+    def _executeLeased(self, expr: str, pending, results: list, deadline: float, idempotent: bool):
+        """
+        Lease a connection from the pool, open the same trees as our connection and set the same
+        default node once, then send batches from `pending` until it is empty. The trees are closed
+        again before the connection is returned to the pool. TDI variables are not copied, as they
+        cannot be listed, so they are only available within the batch that assigns them.
+        """
+
+        with self._pool.connection() as conn:
+            try:
+                for tree, shot, mode, path in self._connection._open_trees:
+                    conn.openTree(tree, shot, mode, path)
+
+                for path in self._connection._default_paths:
+                    conn.setDefault(path)
+
+                while True:
+                    try:
+                        i, batch = pending.popleft()
+                    except IndexError:
+                        break
+
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+
+                    results[i] = conn.get(expr, batch, idempotent=idempotent, deadline=remaining)
+
+            except OSError:
+                # The connection is discarded, along with its trees
+                raise
+
+            except:
+                if len(conn._open_trees) > 0:
+                    conn.closeAllTrees()
+                raise
+
+            if len(conn._open_trees) > 0:
+                conn.closeAllTrees()
@@ -0,0 +1,200 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import struct
+import threading
+
+from .exceptions import *
+
+# The start of every capture file, followed by the records
+CAPTURE_MAGIC = b'MDSTHIN-CAPTURE-1\n'
+
+# Each record is the direction, the number of seconds since the capture started, and the length of the data
+_RECORD_HEADER = struct.Struct('<cdI')
+
+CAPTURE_SENT = b'S'
+CAPTURE_RECEIVED = b'R'
+
+# Marks the start of each connection, as the capture continues across `reconnect()`
+CAPTURE_CONNECTED = b'C'
+
+def readCapture(path: str):
+    """
+    Read the records of a capture file written with `Connection(record=...)`.
+
+    :param str path: The path to the capture file.
+    :return: A generator of `(direction, seconds, data)`, where `direction` is `CAPTURE_SENT`,
+        `CAPTURE_RECEIVED`, or `CAPTURE_CONNECTED`, and `seconds` is the time since the
+        capture started.
+    :raises MdsException: if the file is not a capture file.
+    """
+
+    with open(path, 'rb') as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise MdsException(f'{path} is not an mdsthin capture file')
+
+        while True:
+            header = file.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+
+            direction, seconds, length = _RECORD_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+
+            yield direction, seconds, data
+
+class _CaptureWriter:
+    """
+    Writes the records of a capture file, for all of the connections of one `Connection`.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'wb')
+        self._file.write(CAPTURE_MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def write(self, direction: bytes, data):
+        data = memoryview(data).cast('B')
+        with self._lock:
+            self._file.write(_RECORD_HEADER.pack(direction, time.monotonic() - self._start, len(data)))
+            self._file.write(data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class _RecordingSocket:
+    """
+    Wraps a socket to write everything sent and received to a capture file.
+    """
+
+    def __init__(self, socket, writer: _CaptureWriter):
+        self._socket = socket
+        self._writer = writer
+        self._writer.write(CAPTURE_CONNECTED, b'')
+
+        # Only some sockets support changing their timeout, see `Connection._recv_into()`
+        if hasattr(socket, 'settimeout'):
+            self.settimeout = socket.settimeout
+
+        # Used by `Connection.cancel()` to interrupt a blocking read
+        if hasattr(socket, 'shutdown'):
+            self.shutdown = socket.shutdown
+
+    def recv_into(self, buffer, size, flags):
+        bytes_read = self._socket.recv_into(buffer, size, flags)
+        self._writer.write(CAPTURE_RECEIVED, memoryview(buffer).cast('B')[ : bytes_read ])
+        return bytes_read
+
+    def sendall(self, buffer):
+        self._socket.sendall(buffer)
+        self._writer.write(CAPTURE_SENT, buffer)
+
+    def close(self):
+        self._socket.close()
+        self._writer.flush()
+
+class _ReplaySocket:
+    """
+    Serves the data received by one of the connections in a capture file, in place of a socket.
+
+    Whatever is sent is discarded, but it moves us past the data that was sent at the same
+    point in the capture, so that with a `speed` the replies can be delayed by as long as the
+    server took to send them, divided by `speed`.
+    """
+
+    def __init__(self, path: str, session: int, speed: float = None):
+        self._speed = speed
+
+        # The records of the connection numbered `session`, from 0
+        self._records = []
+        connections = -1
+        for direction, seconds, data in readCapture(path):
+            if direction == CAPTURE_CONNECTED:
+                connections += 1
+            elif connections == session:
+                self._records.append([ direction, seconds, memoryview(data) ])
+
+        if connections < session:
+            raise ConnectionRefusedError(f'{path} only has {connections + 1} connections')
+
+        self._index = 0
+
+        # The time that something was last sent, in the capture and now
+        self._sent_seconds = 0.0
+        self._sent_time = time.monotonic()
+
+    def recv_into(self, buffer, size, flags):
+
+        # Skip what was sent but not by us, as we may not send exactly the same bytes
+        while self._index < len(self._records) and self._records[self._index][0] == CAPTURE_SENT:
+            self._index += 1
+
+        if self._index == len(self._records):
+            return 0
+
+        record = self._records[self._index]
+        _, seconds, data = record
+
+        if self._speed is not None:
+            delay = self._sent_time + (seconds - self._sent_seconds) / self._speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        bytes_read = min(size, len(data))
+        memoryview(buffer).cast('B')[ : bytes_read ] = data[ : bytes_read ]
+
+        record[2] = data[ bytes_read : ]
+        if len(record[2]) == 0:
+            self._index += 1
+
+        return bytes_read
+
+    def sendall(self, buffer):
+        remaining = len(memoryview(buffer).cast('B'))
+
+        while remaining > 0 and self._index < len(self._records) and self._records[self._index][0] == CAPTURE_SENT:
+            record = self._records[self._index]
+            self._sent_seconds = record[1]
+
+            taken = min(remaining, len(record[2]))
+            record[2] = record[2][ taken : ]
+            remaining -= taken
+
+            if len(record[2]) == 0:
+                self._index += 1
+
+        self._sent_time = time.monotonic()
+
+    def close(self):
+        self._records = []
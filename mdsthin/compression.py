@@ -0,0 +1,175 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+import zlib
+import threading
+
+# The highest compression level that can be negotiated in the status of the login message
+MAX_COMPRESSION_LEVEL = 9
+
+class CompressionPolicy:
+    """
+    Decides how much to compress each message sent to the server.
+
+    Compressing only pays off when the data shrinks enough, and when the time spent compressing
+    is less than the time saved on the network. This policy skips payloads smaller than
+    `min_size`, compresses a sample of larger payloads to skip those that will not shrink, and
+    picks a level from the throughput measured while receiving large replies.
+
+    Subclass this and override `chooseLevel()` to implement your own policy.
+
+    Example:
+    ```
+    # Over a VPN, request compression from the server and let the policy tune it
+    c = Connection('server', compression_level=6)
+
+    # On a fast network, never compress
+    c = Connection('server', compression_policy=CompressionPolicy(levels=[ (0, 0) ]))
+    ```
+
+    :param int min_size: Payloads smaller than this are never compressed, defaults to 1KiB.
+    :param int sample_size: The size of the sample to compress to estimate the compression
+        ratio of larger payloads, defaults to 16KiB.
+    :param float max_ratio: Payloads whose sample compresses to more than this fraction of
+        its size are not compressed, defaults to 0.9.
+    :param list levels: A list of `(min_throughput, level)` in descending order of throughput,
+        in bytes per second. The first level whose `min_throughput` is below the measured
+        throughput is used. The default turns compression off above 100MB/s.
+    """
+
+    DEFAULT_LEVELS = [
+        (100e6, 0),
+        (20e6, 1),
+        (5e6, 3),
+        (1e6, 6),
+        (0, 9),
+    ]
+
+    # The weight of each new measurement in the moving average of the throughput
+    THROUGHPUT_ALPHA = 0.25
+
+    # Replies smaller than this are dominated by latency and say little about the throughput
+    MIN_THROUGHPUT_SIZE = 64 * 1024
+
+    def __init__(self,
+        min_size: int = 1024,
+        sample_size: int = 16 * 1024,
+        max_ratio: float = 0.9,
+        levels: list = None,
+    ):
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+        self.levels = levels if levels is not None else self.DEFAULT_LEVELS
+
+        self._lock = threading.Lock()
+        self._throughput = None
+
+    @property
+    def throughput(self):
+        """
+        The moving average of the measured throughput in bytes per second, or None if nothing
+        has been measured yet.
+        """
+
+        return self._throughput
+
+    def recordTransfer(self, size: int, seconds: float):
+        """
+        Record the time taken to receive a payload, to estimate the throughput of the link.
+
+        :param int size: The number of bytes received.
+        :param float seconds: The time taken to receive them.
+        """
+
+        if size < self.MIN_THROUGHPUT_SIZE or seconds <= 0:
+            return
+
+        throughput = size / seconds
+        with self._lock:
+            if self._throughput is None:
+                self._throughput = throughput
+            else:
+                self._throughput += self.THROUGHPUT_ALPHA * (throughput - self._throughput)
+
+    def levelForThroughput(self, max_level: int):
+        """
+        Pick a compression level based on the measured throughput.
+
+        :param int max_level: The level negotiated with the server, which is used until the
+            throughput has been measured, and is never exceeded.
+        :return: The compression level, or 0 to disable compression.
+        :rtype: int
+        """
+
+        if self._throughput is None:
+            return max_level
+
+        for min_throughput, level in self.levels:
+            if self._throughput >= min_throughput:
+                return min(level, max_level)
+
+        return max_level
+
+    def isCompressible(self, buffer):
+        """
+        Estimate whether a payload is worth compressing, by compressing a sample of it.
+
+        :param buffer: The payload to check.
+        :return: False if the sample does not shrink enough.
+        :rtype: bool
+        """
+
+        view = memoryview(buffer).cast('B')
+
+        # Smaller payloads will be compressed and compared anyways, so sampling would only
+        # double the work
+        if len(view) <= self.sample_size:
+            return True
+
+        # Sample the middle of the payload, as the start is often padding or headers
+        start = (len(view) - self.sample_size) // 2
+        sample = view[ start : start + self.sample_size ]
+        return len(zlib.compress(sample, 1)) <= len(sample) * self.max_ratio
+
+    def chooseLevel(self, buffer, max_level: int):
+        """
+        Choose the compression level for a payload.
+
+        :param buffer: The payload to be sent.
+        :param int max_level: The compression level negotiated with the server.
+        :return: The compression level, or 0 to send the payload uncompressed.
+        :rtype: int
+        """
+
+        if max_level <= 0 or len(buffer) < self.min_size:
+            return 0
+
+        level = self.levelForThroughput(max_level)
+        if level <= 0 or not self.isCompressible(buffer):
+            return 0
+
+        return level
@@ -24,24 +24,767 @@
 #
 
 import os
+import atexit
 import sys
 import time
 import ctypes
 import socket
 import getpass
+import selectors
 import logging
+import threading
+import itertools
+import contextlib
+import collections
 
 from .message import *
 from .exceptions import *
 from .functions import *
+from .compression import *
+from .stats import *
+from .capture import *
+from .capture import _CaptureWriter, _RecordingSocket, _ReplaySocket
+from .prepared import *
+from .prepared import _pack_apd, _PreparedQueries
+from .batches import *
+from .batches import _Batches
+from .streaming import _StreamedResults
 
 INVALID_MESSAGE_ID = 0
 
+# message_id is a c_ubyte, and 0 is reserved for INVALID_MESSAGE_ID
+MAX_MESSAGE_ID = 255
+
 MDSIP_VERSION = 3
 
 SSH_BACKEND_SUBPROCESS = 'subprocess'
 SSH_BACKEND_PARAMIKO   = 'paramiko'
 
+SUPPORTED_PROTOCOLS = ['tcp', 'tcp6', 'ssh', 'sshp', 'replay']
+
+# Messages up to this size are joined into one buffer before being sent over SSH
+SMALL_SEND_SIZE = 64 * 1024
+
+# Compressed messages are received and decompressed in chunks of this size
+RECV_CHUNK_SIZE = 256 * 1024
+
+# How often a request waiting on the socket checks if it has been cancelled or passed its deadline
+CANCEL_POLL_INTERVAL = 0.1
+
+# The rest of a cancelled reply is read and thrown away if it is up to this size, otherwise we reconnect
+CANCEL_DRAIN_LIMIT = 16 * 1024 * 1024
+
+# Arrays too large for one message are sent and received in chunks of this size, see `getChunked()`
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+
+# The server-side variables that chunked arrays are assembled in, numbered to keep concurrent requests apart
+CHUNKED_VARIABLE = '_mdsthin_chunked{}'
+_chunked_variable_ids = itertools.count(1)
+
+# The most chunks joined by one `[a,b,...]`, below the limit of 255 arguments to a TDI function
+MAX_JOINED_CHUNKS = 250
+
+# The commands used by `Connection.openTree()` for each mode
+TREE_OPEN_EXPRESSIONS = {
+    'NORMAL': 'TreeOpen($,$)',
+    'READONLY': 'TreeOpen($,$,1)',
+    'EDIT': 'TreeOpenEdit($,$)',
+    # 'NEW': 'TreeOpenNew($,$)',
+}
+
+# The most open trees that will be reopened by `Connection.reconnect()`
+MAX_REPLAY_TREES = 16
+
+def _parse_url(url: str, supported_protocols: list):
+    """
+    Parse a URL in the form of `proto://username@host:port`.
+
+    Any part but the host can be omitted. The default protocol is tcp and the default
+    username is the current user. If no port is specified it will be `None`, as its
+    meaning depends on the protocol.
+
+    :return: The protocol, username, host and port.
+    :rtype: tuple(str, str, str, int or None)
+    :raises MdsException: if an unsupported protocol is specified.
+    """
+
+    host = url
+
+    if '://' in host:
+        protocol, host = host.split('://', maxsplit=1)
+    else:
+        protocol = 'tcp'
+
+    if protocol not in supported_protocols:
+        raise MdsException(f'Only the following protocols are supported: {", ".join(supported_protocols)}')
+
+    # The rest of a replay:// URL is the path to the capture file, which may contain anything
+    if protocol == 'replay':
+        return protocol, getpass.getuser(), host, None
+
+    if '@' in host:
+        # We use rsplit to allow usernames connection strings like:
+        # 'user@example.com@server:port'
+        username, host = host.rsplit('@', maxsplit=1)
+    else:
+        # The username used for the MDSip login packet, and SSH if the protocol is `ssh://` or `sshp://`
+        username = getpass.getuser()
+
+    port = None
+    if ':' in host:
+        host, port = host.split(':', maxsplit=1)
+        port = int(port)
+
+    return protocol, username, host, port
+
+def _ssh_remote_command(protocol: str, sshp_host: str, port: int):
+    """
+    Return the command to run on the remote server for ssh:// or sshp://.
+    """
+
+    if protocol == 'ssh':
+        return '/bin/sh -l -c mdsip-server-ssh'
+
+    return f'nc {sshp_host} {port}'
+
+def _ssh_subprocess_command(username: str, host: str, command: str, ssh_port: int = None, ssh_subprocess_args: list = None, ssh_use_plink: bool = False):
+    """
+    Build the command line used to spawn `ssh` or `plink` for the subprocess SSH backend.
+    If `command` is None, no remote command is added.
+
+    :return: The command line to pass to `subprocess.Popen()`.
+    :rtype: list
+    :raises Exception: if the ssh or plink executable cannot be found.
+    """
+
+    import shutil
+
+    if ssh_use_plink:
+        ssh = shutil.which('plink')
+        if ssh is None:
+            raise Exception('Unable to find plink.exe')
+    else:
+        ssh = shutil.which('ssh')
+        if ssh is None:
+            raise Exception('Unable to find ssh command')
+
+    ssh_command = [ssh]
+
+    if ssh_port is not None:
+        if ssh_use_plink:
+            ssh_command.append(f'-P{ssh_port}')
+        else:
+            ssh_command.append(f'-p{ssh_port}')
+
+    if ssh_use_plink:
+        ssh_command.append('-batch')
+
+    if ssh_subprocess_args is not None:
+        ssh_command.extend(ssh_subprocess_args)
+
+    ssh_command.append(f'{username}@{host}')
+
+    if command is not None:
+        ssh_command.append(command)
+
+    return ssh_command
+
+def _login_message(username: str, compression_level: int = 0):
+    """
+    Build the login request, which carries the username, our version of the MDSip protocol,
+    and the compression level we would like the server to use.
+    """
+
+    msg_login = Message(String(username))
+    msg_login.status = compression_level
+    msg_login.ndims = 1
+    msg_login.dims[0] = MDSIP_VERSION
+    return msg_login
+
+def _checkCompressionLevel(compression_level: int):
+    """
+    Raise an MdsException if a compression level cannot be used, or None if it can.
+    """
+
+    if not 0 <= compression_level <= MAX_COMPRESSION_LEVEL:
+        raise MdsException(f'The compression level must be between 0 and {MAX_COMPRESSION_LEVEL}')
+
+class _SubprocessSocket:
+    """
+    Wraps the pipes of an SSH subprocess to look like a socket.
+
+    The pipes are made non-blocking and waited on with `selectors`, which gives us real
+    timeouts, lets us read directly into the caller's buffer, and lets us log anything the
+    subprocess writes to stderr while we are waiting.
+    """
+
+    def __init__(self, proc, timeout: float, logger: logging.Logger):
+        self._proc = proc
+        self._timeout = timeout
+        self._logger = logger
+        self._stderr_line = b''
+        self._stderr_last = ''
+
+        for pipe in [ proc.stdin, proc.stdout, proc.stderr ]:
+            os.set_blocking(pipe.fileno(), False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(proc.stderr, selectors.EVENT_READ)
+
+    def _wait(self, pipe, event, deadline):
+        self._selector.register(pipe, event)
+        try:
+            while True:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f'The SSH subprocess did not respond within {self._timeout}s')
+
+                for key, _ in self._selector.select(remaining):
+                    if key.fileobj is self._proc.stderr:
+                        self._read_stderr()
+                    else:
+                        return
+
+        finally:
+            self._selector.unregister(pipe)
+
+    def _deadline(self):
+        if self._timeout is None:
+            return None
+        return time.monotonic() + self._timeout
+
+    def settimeout(self, timeout: float):
+        self._timeout = timeout
+
+    def _read_stderr(self):
+        if self._proc.stderr.closed:
+            return
+
+        data = self._proc.stderr.read()
+        if data is None:
+            return
+
+        if len(data) == 0:
+            # Stop waiting on stderr once it has been closed
+            self._selector.unregister(self._proc.stderr)
+            self._proc.stderr.close()
+            return
+
+        *lines, self._stderr_line = (self._stderr_line + data).split(b'\n')
+        for line in lines:
+            line = line.decode(errors='replace').rstrip()
+            if line:
+                self._stderr_last = line
+                self._logger.warning(line)
+
+    def recv_into(self, buffer, size, flags):
+        view = memoryview(buffer).cast('B')[ : size ]
+
+        deadline = self._deadline()
+        while True:
+            bytes_read = self._proc.stdout.readinto(view)
+            if bytes_read is not None:
+                break
+
+            self._wait(self._proc.stdout, selectors.EVENT_READ, deadline)
+
+        if bytes_read == 0:
+            import subprocess
+
+            # stdout is closed, so the subprocess should be exiting
+            try:
+                exit_code = self._proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                exit_code = None
+
+            # Log whatever the subprocess had to say before it exited
+            self._read_stderr()
+
+            if exit_code is not None:
+                raise BrokenPipeError(f'The SSH subprocess exited with code {exit_code}: {self._stderr_last}')
+
+        return bytes_read
+
+    def sendall(self, buffer):
+        view = memoryview(buffer).cast('B')
+
+        deadline = self._deadline()
+        while len(view) > 0:
+            try:
+                bytes_written = self._proc.stdin.write(view)
+            except BlockingIOError:
+                bytes_written = None
+
+            if bytes_written is None:
+                self._wait(self._proc.stdin, selectors.EVENT_WRITE, deadline)
+                continue
+
+            view = view[ bytes_written : ]
+
+    def close(self):
+        self._selector.close()
+        self._proc.terminate()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+        self._proc.wait()
+
+class _BlockingSubprocessSocket:
+    """
+    Wraps the pipes of an SSH subprocess to look like a socket, for platforms that cannot
+    wait on pipes with `selectors`. A timer terminates the subprocess if a read or write
+    takes longer than the timeout.
+    """
+
+    def __init__(self, proc, timeout: float):
+        self._proc = proc
+        self._timeout = timeout
+
+    @contextlib.contextmanager
+    def _timer(self):
+        timer = threading.Timer(interval=self._timeout, function=self._proc.terminate)
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def recv_into(self, buffer, size, flags):
+        view = memoryview(buffer).cast('B')[ : size ]
+        with self._timer():
+            return self._proc.stdout.readinto(view)
+
+    def sendall(self, buffer):
+        view = memoryview(buffer).cast('B')
+        with self._timer():
+            while len(view) > 0:
+                view = view[ self._proc.stdin.write(view) : ]
+
+    def close(self):
+        self._proc.terminate()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+        self._proc.wait()
+
+# OpenSSH control masters by user, host, and options, as (process, control path, number of connections using it)
+_ssh_control_masters = {}
+_ssh_control_masters_lock = threading.Lock()
+
+def _acquireSSHControlMaster(key, master_command: list, control_path: str, timeout: float, logger: logging.Logger):
+    """
+    Return the control path of the OpenSSH control master for `key`, or start `master_command`
+    and wait for it to create `control_path`. Each call must be matched by a call to
+    `_releaseSSHControlMaster()`.
+
+    :raises TimeoutError: if the control master takes longer than `timeout` to start.
+    :raises BrokenPipeError: if the control master exits before it is ready.
+    """
+
+    import subprocess
+
+    # Hold the lock while starting, so that many connections started at once only start one master
+    with _ssh_control_masters_lock:
+        if key in _ssh_control_masters:
+            proc, path, count = _ssh_control_masters[key]
+
+            if proc.poll() is None:
+                _ssh_control_masters[key] = (proc, path, count + 1)
+                return path
+
+            logger.debug(f'SSH control master exited with code {proc.returncode}, restarting it')
+            _closeSSHControlMaster(proc, path)
+            del _ssh_control_masters[key]
+
+        os.makedirs(os.path.dirname(control_path), mode=0o700, exist_ok=True)
+
+        master_command_print = [ f'"{v}"' if ' ' in v else v for v in master_command ]
+        logger.debug(f'Executing {" ".join(master_command_print)}')
+
+        proc = subprocess.Popen(
+            master_command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+        # The master is ready once it has authenticated and is listening on the control path
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not os.path.exists(control_path):
+            if proc.poll() is not None:
+                stderr = proc.stderr.read().decode(errors='replace').strip()
+                _closeSSHControlMaster(proc, control_path)
+                raise BrokenPipeError(f'The SSH control master exited with code {proc.returncode}: {stderr}')
+
+            if deadline is not None and time.monotonic() > deadline:
+                _closeSSHControlMaster(proc, control_path)
+                raise TimeoutError('Timed out waiting for the SSH control master to start')
+
+            time.sleep(0.01)
+
+        _ssh_control_masters[key] = (proc, control_path, 1)
+        return control_path
+
+def _releaseSSHControlMaster(key):
+    """
+    Release an OpenSSH control master, and stop it once it is unused.
+    """
+
+    with _ssh_control_masters_lock:
+        if key not in _ssh_control_masters:
+            return
+
+        proc, path, count = _ssh_control_masters[key]
+        if count > 1:
+            _ssh_control_masters[key] = (proc, path, count - 1)
+            return
+
+        del _ssh_control_masters[key]
+
+    _closeSSHControlMaster(proc, path)
+
+def _closeSSHControlMaster(proc, control_path: str):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=1)
+        except Exception:
+            proc.kill()
+            proc.wait()
+
+    proc.stderr.close()
+
+    # The control path is inside a directory that we created for it
+    for path in [ control_path, os.path.dirname(control_path) ]:
+        try:
+            if path == control_path:
+                os.unlink(path)
+            else:
+                os.rmdir(path)
+        except OSError:
+            pass
+
+@atexit.register
+def _closeAllSSHControlMasters():
+    with _ssh_control_masters_lock:
+        masters = list(_ssh_control_masters.values())
+        _ssh_control_masters.clear()
+
+    for proc, path, _ in masters:
+        _closeSSHControlMaster(proc, path)
+
+# Shared paramiko clients by host and options, with the number of connections using each
+_shared_ssh_clients = {}
+_shared_ssh_clients_lock = threading.Lock()
+
+def _acquireSharedSSHClient(key, connect):
+    """
+    Return the shared paramiko client for `key`, or call `connect()` to create it.
+    Each call must be matched by a call to `_releaseSSHClient()`.
+    """
+
+    # Hold the lock while connecting, so that many connections started at once only do one handshake
+    with _shared_ssh_clients_lock:
+        if key in _shared_ssh_clients:
+            client, count = _shared_ssh_clients[key]
+
+            transport = client.get_transport()
+            if transport is not None and transport.is_active():
+                _shared_ssh_clients[key] = (client, count + 1)
+                return client
+
+        client = connect()
+        _shared_ssh_clients[key] = (client, 1)
+        return client
+
+def _releaseSSHClient(key, client):
+    """
+    Close a paramiko client, or release it if it is shared and close it once it is unused.
+    """
+
+    with _shared_ssh_clients_lock:
+        if key is not None and key in _shared_ssh_clients:
+            shared_client, count = _shared_ssh_clients[key]
+
+            if shared_client is client:
+                if count > 1:
+                    _shared_ssh_clients[key] = (client, count - 1)
+                    return
+
+                del _shared_ssh_clients[key]
+
+    client.close()
+
+class _ParamikoSocket:
+    """
+    Wraps the channel of a paramiko `exec_command()` to look like a socket.
+    """
+
+    # paramiko needs bytes, so large buffers are sent in chunks of this size to limit copying
+    SEND_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, client, client_key, channel, timeout: float, logger: logging.Logger):
+        self._client = client
+        self._client_key = client_key
+        self._channel = channel
+        self._logger = logger
+        self._stderr_last = ''
+
+        self._channel.settimeout(timeout)
+
+    def _read_stderr(self):
+        while self._channel.recv_stderr_ready():
+            for line in self._channel.recv_stderr(4096).decode(errors='replace').splitlines():
+                line = line.rstrip()
+                if line:
+                    self._stderr_last = line
+                    self._logger.warning(line)
+
+    def settimeout(self, timeout: float):
+        self._channel.settimeout(timeout)
+
+    def recv_into(self, buffer, size, flags):
+        self._read_stderr()
+
+        data = self._channel.recv(size)
+        memoryview(buffer).cast('B')[ : len(data) ] = data
+
+        if len(data) == 0:
+            self._read_stderr()
+            if self._channel.exit_status_ready():
+                raise BrokenPipeError(f'The SSH command exited with code {self._channel.recv_exit_status()}: {self._stderr_last}')
+
+        return len(data)
+
+    def sendall(self, buffer):
+        if isinstance(buffer, bytes):
+            self._channel.sendall(buffer)
+            return
+
+        view = memoryview(buffer).cast('B')
+        for offset in range(0, len(view), self.SEND_CHUNK_SIZE):
+            self._channel.sendall(bytes(view[ offset : offset + self.SEND_CHUNK_SIZE ]))
+
+    def close(self):
+        self._channel.close()
+        _releaseSSHClient(self._client_key, self._client)
+
+class InterceptedRequest(collections.namedtuple('InterceptedRequest', [ 'connection', 'expr', 'args', 'idempotent', 'compression_level' ])):
+    """
+    A call to `Connection.get()`, as seen by the interceptors added with `addInterceptor()`.
+    Use `_replace()` to make a copy with a different `expr` or `args`.
+
+    :param Connection connection: The connection the request is made on.
+    :param str expr: The TDI expression to be evaluated.
+    :param tuple args: The arguments for the placeholders in the expression.
+    :param bool idempotent: False if the expression writes data or has other side effects,
+        so it must not be retried or cached.
+    :param int compression_level: The compression level to send the request with, or None
+        to use the compression policy.
+    """
+
+    __slots__ = ()
+
+class RequestCancelled(MdsException):
+    """
+    Raised by a request that was cancelled with `Connection.cancel()`.
+    """
+
+class DeadlineExceeded(RequestCancelled):
+    """
+    Raised by a request that did not complete before the `deadline` passed to it.
+    """
+
+class _CallState(threading.local):
+    """
+    The request being made by the current thread, which decides whether it can be interrupted.
+    """
+
+    # The value of `Connection._cancel_generation` when the request was made, or None outside of a request
+    generation = None
+
+    # The time.monotonic() by which the request must complete
+    deadline = None
+
+    # The message_id of the request once it has been sent
+    message_id = None
+
+class _NoLock:
+    """
+    Stands in for the locks of a `Connection` that was not created with `thread_safe=True`.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+    def notify_all(self):
+        pass
+
+    def wait(self, timeout=None):
+        # Only reachable if another thread is in the middle of receiving a reply
+        raise MdsException('Connection is being used from more than one thread, use thread_safe=True')
+
+class _ReplyStream:
+    """
+    Receives the data of a reply a chunk at a time, so that it can be used before all of it has
+    arrived, see `Connection._openStream()`. While it is open, the thread that opened it keeps
+    the turn to read from the socket, and any other threads wait for it to be closed. Closing it
+    early throws away the rest of the reply, like cancelling a request.
+
+    :param Connection connection: The connection the reply is being received from.
+    :param int message_id: The message_id of the request.
+    :param Message msg: The header of the reply, which has already been received.
+    :param int generation: The cancel generation of the request, see `Connection.cancel()`.
+    :param float deadline: The time by which the reply must be received, from `time.monotonic()`.
+    """
+
+    def __init__(self, connection, message_id: int, msg: Message, generation: int, deadline: float):
+        self._connection = connection
+        self._message_id = message_id
+        self._generation = generation
+        self._deadline = deadline
+        self._closed = False
+
+        self.msg = msg
+        self._msglen = msg.msglen
+
+        # The number of bytes of the message data still on the socket
+        self._remaining = msg.msglen - ctypes.sizeof(Message)
+
+        self._decompressor = None
+        self._buffer = None
+        self._received = 0
+
+        if (msg.client_type & COMPRESSED) == 0:
+            self._buffer = msg.allocate_data_buffer()
+            self._view = memoryview(self._buffer).cast('B')
+
+        with connection._recv_condition:
+            connection._streaming_thread = threading.get_ident()
+            connection._timings.pop(message_id, None)
+
+    @staticmethod
+    def canStream(msg: Message):
+        """
+        Whether the reply is a successful array of bytes, which can be streamed.
+        """
+        return STATUS_OK(msg.status) and msg.dtype_id == DTYPE_BU and msg.ndims == 1 and msg.msglen > ctypes.sizeof(Message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    @property
+    def buffer(self):
+        """The buffer the data is being received into, which is None until the first `receive()`."""
+        if self._decompressor is not None:
+            return self._decompressor.buffer
+        return self._buffer
+
+    @property
+    def received(self):
+        """The number of bytes at the start of `buffer` that have been received so far."""
+        if self._decompressor is not None:
+            return self._decompressor.received
+        return self._received
+
+    @contextlib.contextmanager
+    def _callState(self):
+        """
+        Allow `cancel()` and the deadline to interrupt the current thread while it receives.
+        """
+
+        state = self._connection._call_state
+        previous_state = (state.generation, state.deadline, state.message_id)
+
+        state.generation = self._generation
+        state.deadline = self._deadline
+        state.message_id = self._message_id
+
+        try:
+            yield
+
+        finally:
+            state.generation, state.deadline, state.message_id = previous_state
+
+    def receive(self):
+        """
+        Receive the next chunk of the data, whatever has arrived up to `RECV_CHUNK_SIZE`.
+
+        :return: False once all of the data has been received, otherwise True.
+        :rtype: bool
+        :raises ConnectionResetError: if the connection is closed by the server.
+        :raises DeadlineExceeded: if the deadline passes before the data is received.
+        :raises RequestCancelled: if the request is cancelled with `Connection.cancel()`.
+        :raises MdsException: if the compressed data is invalid.
+        """
+
+        if self._closed:
+            raise MdsException('The reply has already been closed')
+
+        connection = self._connection
+        with self._callState():
+            if (self.msg.client_type & COMPRESSED) > 0 and self._decompressor is None:
+                prefix = bytearray(MessageDecompressor.PREFIX_SIZE)
+                connection._recv_exactly(memoryview(prefix))
+                self._remaining -= len(prefix)
+
+                self._decompressor = MessageDecompressor(self.msg, prefix)
+                self._view = memoryview(bytearray(min(self._decompressor.compressed_length, RECV_CHUNK_SIZE)))
+
+            if self._decompressor is not None:
+                view = self._view[ : min(self._remaining, len(self._view)) ]
+            else:
+                view = self._view[ self._received : self._received + RECV_CHUNK_SIZE ]
+
+            bytes_read = connection._recv_into(view)
+            if bytes_read == 0:
+                raise ConnectionResetError('Connection closed by the server')
+
+            connection._stream_remaining -= bytes_read
+            self._remaining -= bytes_read
+
+            if self._decompressor is not None:
+                self._decompressor.decompress(view[ : bytes_read ])
+            else:
+                self._received += bytes_read
+
+            if self._remaining > 0:
+                return True
+
+            if self._decompressor is not None:
+                self._decompressor.finish()
+
+        connection._stats.recordReceived(self._msglen, self.msg.msglen)
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Give the turn to read from the socket to the next thread. If the data has not all been
+        received, the rest of it is thrown away before the next reply is received.
+        """
+
+        if self._closed:
+            return
+
+        self._closed = True
+
+        connection = self._connection
+        with connection._recv_condition:
+            connection._reading_id = None
+            connection._in_flight.discard(self._message_id)
+            connection._streaming_thread = None
+            connection._receiving = False
+            connection._recv_condition.notify_all()
+
 class Connection:
     """Implements an MDSip connection to an MDSplus server."""
 
@@ -55,6 +798,16 @@ class Connection:
         ssh_subprocess_args: list = None,
         ssh_paramiko_options: dict = None,
         ssh_use_plink: bool = False,
+        ssh_share_connection: bool = False,
+        compression_level: int = 0,
+        compression_policy: CompressionPolicy = None,
+        auto_reconnect: bool = False,
+        thread_safe: bool = False,
+        timing_callback = None,
+        slow_query_log: SlowQueryLog = None,
+        interceptors: list = None,
+        record: str = None,
+        replay_speed: float = None,
     ):
         """
         Initialize an MDSplus connection to a given URL.
@@ -73,6 +826,8 @@ class Connection:
          * tcp6:// - Connect directly to the MDSip server at `host:port` over IPv6.
          * ssh:// - Connect over SSH to `host:ssh_port` and then spawn `mdsip-server-ssh`.
          * sshp:// - Connect over SSH to `host:ssh_port` and then spawn `nc $sshp_host $port`.
+         * replay:// - Serve back a capture file written with `record=`, without a server.
+           The rest of the URL is the path to the file.
 
         :param str url: The URL to connect to.
         :param float timeout: The timeout for all socket operations in seconds, defaults to 60s
@@ -88,12 +843,47 @@ class Connection:
         :param bool ssh_use_plink: Attempt to use `plink.exe -batch` instead of `ssh.exe`
             for ssh:// and sshp:// connections. Remember to use `ssh_subprocess_args` to pass any
             necessary arguments.
+        :param bool ssh_share_connection: Share one SSH connection between all connections to
+            the same host with the same options, so only the first one has to do the SSH handshake.
+            With `SSH_BACKEND_SUBPROCESS`, this starts an OpenSSH control master which is stopped
+            when the last connection using it is closed, and is not supported with plink or on
+            Windows. With `SSH_BACKEND_PARAMIKO`, each connection opens its own channel on a
+            shared transport. Defaults to False.
+        :param int compression_level: The zlib compression level, from 0 to 9, to request from
+            the server when logging in. The server uses the negotiated level to compress its
+            replies, and we use it as the highest level to compress our requests with.
+            Defaults to 0, which disables compression.
+        :param CompressionPolicy compression_policy: Decides which requests to compress, and
+            how much, up to the negotiated level. Defaults to `CompressionPolicy()`.
+        :param bool auto_reconnect: If a request fails because the connection was lost, call
+            `reconnect()` to restore the session, and then retry the request if it is
+            idempotent. A request that fails with `TimeoutError` is not retried, as the
+            server may just be slow. Defaults to False.
+        :param bool thread_safe: Allow the connection to be shared by many threads. Requests
+            from each thread are sent as soon as they are made, and whichever thread is reading
+            from the socket hands each reply to the thread waiting for it. The open trees, the
+            default node, and TDI variables are shared by all threads. Defaults to False.
+        :param timing_callback: A function to call with a :class:`RequestTiming` once the reply
+            to each request has been decoded, breaking down where the time was spent. It is
+            called on the thread that made the request, or on the receiver thread for
+            `submit()`. Defaults to None.
+        :param SlowQueryLog slow_query_log: A :class:`SlowQueryLog` to record the requests that
+            take longer than its threshold. One log can be shared by many connections.
+            Defaults to None.
+        :param list interceptors: Functions to wrap around every call to `get()`, see
+            `addInterceptor()`. Defaults to None.
+        :param str record: The path of a file to capture everything sent and received into,
+            which can be served back later with a `replay://` URL. The file is kept open across
+            `reconnect()`, and closed by `disconnect()`. Defaults to None.
+        :param float replay_speed: For `replay://` URLs, delay each reply by the time the server
+            took to send it, divided by this. Defaults to None, which replays as fast as possible.
         :raises TimeoutError: if the connection fails.
         :raises BrokenPipeError: if the SSH subprocess fails.
         :raises OSError: if the paramiko socket wrapper fails.
         :raises paramiko.ssh_exception.*: if the paramiko client fails.
         :raises socket.gaierror: if `host` could not be resolved to an IP.
-        :raises MdsException: if an unsupported protocol is specified, or if the login fails.
+        :raises MdsException: if an unsupported protocol is specified, if the compression
+            level is invalid, or if the login fails.
         """
 
         logging.basicConfig()
@@ -105,47 +895,99 @@ class Connection:
             self._logger.setLevel(logging.WARNING)
 
         self._socket = None
+        self._ssh_control_key = None
+        self._stats = ConnectionStats()
+        # Created last, once everything that `disconnect()` needs exists, as it can fail
+        self._capture_writer = None
+        self._replay_speed = replay_speed
+        self._interceptors = list(interceptors) if interceptors is not None else []
+        self._timing_callbacks = [ callback for callback in [ timing_callback, slow_query_log ] if callback is not None ]
         self._timeout = timeout
         self._message_id = INVALID_MESSAGE_ID
+
+        # The message_ids of requests that have been sent, but whose replies have not been returned yet
+        self._in_flight = set()
+
+        # Replies that arrived while we were waiting for a different message_id
+        self._pending = {}
+
+        # The arrays to receive the data of replies into, by message_id, see `getInto()`
+        self._out_buffers = {}
+
+        # The timings of requests in flight, by message_id, see `timing_callback`
+        self._timings = {}
+
+        # Cancelling a request part way through leaves the rest of its reply on the wire. Replies
+        # that have not arrived yet are dropped as they arrive, the rest of a reply that was being
+        # received is thrown away before the next, and if the stream cannot be recovered we reconnect
+        self._call_state = _CallState()
+        self._cancel_generation = 0
+        self._abandoned = set()
+        self._reading_id = None
+        self._stream_remaining = 0
+        self._stream_broken = False
+
+        # Whether a thread is blocked in a plain recv_into() that `cancel()` has to interrupt
+        self._blocking_recv = False
+
+        # The thread reading a reply a chunk at a time with `_openStream()`, which keeps the turn to
+        # read from the socket until it is done, see `GetMany.execute_iter()`
+        self._streaming_thread = None
+
+        # Only one thread at a time sends a request or reads from the socket, and the others
+        # wait on _recv_condition for their reply to be put in _pending
+        self._thread_safe = thread_safe
+        if thread_safe:
+            self._send_lock = threading.Lock()
+            self._recv_condition = threading.Condition()
+            self._reconnect_lock = threading.Lock()
+        else:
+            self._send_lock = _NoLock()
+            self._recv_condition = _NoLock()
+            self._reconnect_lock = _NoLock()
+
+        self._receiving = False
+
+        # The thread that receives the replies for `submit()`, created when it is first used
+        self._receiver = None
+
+        # Incremented by each successful connect(), so threads can tell if another already reconnected
+        self._connection_count = 0
         self._server_api_version = None
         self._compression_level = None
 
+        _checkCompressionLevel(compression_level)
+        self._requested_compression_level = compression_level
+        self._compression_policy = compression_policy if compression_policy is not None else CompressionPolicy()
+
+        # The state of the session on the server, which is restored by `reconnect()`
+        self._auto_reconnect = auto_reconnect
+        self._replaying = False
+        self._open_trees = []
+        self._default_paths = []
+        self._helpers = {}
+
         self._ssh_backend = ssh_backend
         self._ssh_port = ssh_port
         self._sshp_host = sshp_host
         self._ssh_subprocess_args = ssh_subprocess_args
         self._ssh_paramiko_options = ssh_paramiko_options
         self._ssh_use_plink = ssh_use_plink
+        self._ssh_share_connection = ssh_share_connection
 
         self._url = url
-        self._host = url
-
-        if '://' in self._host:
-            self._protocol, self._host = self._host.split('://', maxsplit=1)
-        else:
-            self._protocol = 'tcp'
-
-        SUPPORTED_PROTOCOLS = ['tcp', 'tcp6', 'ssh', 'sshp']
-        if self._protocol not in SUPPORTED_PROTOCOLS:
-            raise MdsException(f'Only the following protocols are supported: {", ".join(SUPPORTED_PROTOCOLS)}')
-
-        if '@' in self._host:
-            # We use rsplit to allow usernames connection strings like:
-            # 'user@example.com@server:port'
-            self._username, self._host = self._host.rsplit('@', maxsplit=1)
-        else:
-            # The username used for the MDSip login packet, and SSH if the protocol is `ssh://` or `sshp://`
-            self._username = getpass.getuser()
-
-        if ':' in self._host:
-            self._host, self._port = self._host.split(':', maxsplit=1)
-            self._port = int(self._port)
+        self._protocol, self._username, self._host, self._port = _parse_url(url, SUPPORTED_PROTOCOLS)
 
+        if self._port is not None:
             if self._protocol == 'ssh' and self._ssh_port is None:
                 self._ssh_port = self._port
         else:
             # The MDSip default port
             self._port = 8000
+
+        if record is not None:
+            self._capture_writer = _CaptureWriter(record)
+
         self.connect()
 
     def __del__(self):
@@ -201,41 +1043,44 @@ class Connection:
 
         elif self._protocol in ['ssh', 'sshp']:
 
-            if self._protocol == 'ssh':
-                command = '/bin/sh -l -c mdsip-server-ssh'
-            elif self._protocol == 'sshp':
-                command = f'nc {self._sshp_host} {self._port}'
+            command = _ssh_remote_command(self._protocol, self._sshp_host, self._port)
 
             if self._ssh_backend == SSH_BACKEND_SUBPROCESS:
 
-                import shutil
                 import subprocess
 
-                if self._ssh_use_plink:
-                    ssh = shutil.which('plink')
-                    if ssh is None:
-                        raise Exception('Unable to find plink.exe')
-                else:
-                    ssh = shutil.which('ssh')
-                    if ssh is None:
-                        raise Exception('Unable to find ssh command')
-
-                ssh_command = [ssh]
-
-                if self._ssh_port is not None:
-                    if self._ssh_use_plink:
-                        ssh_command.append(f'-P{self._ssh_port}')
-                    else:
-                        ssh_command.append(f'-p{self._ssh_port}')
-
-                if self._ssh_use_plink:
-                    ssh_command.append('-batch')
-
-                if self._ssh_subprocess_args is not None:
-                    ssh_command.extend(self._ssh_subprocess_args)
-                
-                ssh_command.append(f'{self._username}@{self._host}')
-                ssh_command.append(command)
+                ssh_subprocess_args = self._ssh_subprocess_args
+
+                # plink and Windows OpenSSH do not support connection sharing
+                if self._ssh_share_connection and not self._ssh_use_plink and sys.platform != 'win32':
+                    import tempfile
+                    import hashlib
+
+                    self._ssh_control_key = (self._username, self._host, self._ssh_port, tuple(ssh_subprocess_args or []))
+
+                    # Unix socket paths are limited to ~100 characters, so keep the name short
+                    key_hash = hashlib.sha1(repr(self._ssh_control_key).encode()).hexdigest()[ : 12 ]
+                    control_path = os.path.join(tempfile.gettempdir(), f'mdsthin-{os.getpid()}-{key_hash}', 'ssh')
+
+                    master_command = _ssh_subprocess_command(
+                        self._username,
+                        self._host,
+                        None,
+                        ssh_port=self._ssh_port,
+                        ssh_subprocess_args=list(ssh_subprocess_args or []) + [ '-M', '-S', control_path, '-N', '-o', 'ControlPersist=no' ],
+                    )
+
+                    control_path = _acquireSSHControlMaster(self._ssh_control_key, master_command, control_path, self._timeout, self._logger)
+                    ssh_subprocess_args = list(ssh_subprocess_args or []) + [ '-S', control_path, '-o', 'ControlMaster=no' ]
+
+                ssh_command = _ssh_subprocess_command(
+                    self._username,
+                    self._host,
+                    command,
+                    ssh_port=self._ssh_port,
+                    ssh_subprocess_args=ssh_subprocess_args,
+                    ssh_use_plink=self._ssh_use_plink,
+                )
 
                 ssh_command_print = [ f'"{v}"' if ' ' in v else v for v in ssh_command ]
                 self._logger.debug(f'Executing {" ".join(ssh_command_print)}')
@@ -246,67 +1091,15 @@ class Connection:
                     stdout=subprocess.PIPE,
                     # Do not pipe stderr>stdout or the first packet we recv could be the shell errors from ssh
                     stderr=subprocess.PIPE,
+                    # Unbuffered, so that we can read directly into our own buffers
+                    bufsize=0,
                 )
 
-                import threading
-
-                # Why is adding a timeout so hard
-                class SubprocessTimeout:
-                    def __init__(self, proc, timeout):
-                        self._proc = proc
-                        self._timer = threading.Timer(interval=timeout, function=self.do_timeout)
-
-                    def __enter__(self):
-                        self._timer.start()
-                        return self
-
-                    def __exit__(self, exc_type, exc_value, exc_traceback):
-                        self._timer.cancel()
-                        del self._timer
-                    
-                    def do_timeout(self):
-                        self._proc.terminate()
-
-                class SubprocessSocket:
-                    def __init__(self, proc: subprocess.Popen, timeout: float):
-                        self._proc = proc
-                        self._timeout = timeout
-
-                    def recv(self, size, flags):
-                        with SubprocessTimeout(self._proc, self._timeout):
-                            return self._proc.stdout.read(size)
-                        
-                    def recv_into(self, buffer, size, flags):
-                        buffer[ : size] = self.recv(size, flags)
-                        return size
-
-                    def sendall(self, buffer):
-                        with SubprocessTimeout(self._proc, self._timeout):
-                            self._proc.stdin.write(buffer)
-                            self._proc.stdin.flush()
-
-                    def close(self):
-                        self._proc.terminate()
-                        self._proc.stdin.close()
-                        self._proc.stdout.close()
-                        self._proc.stderr.close()
-                        self._proc.wait()
-
-                # If stderr is blocking, then we can't check it without locking the whole program up
-                try:
-                    os.set_blocking(self._ssh_subprocess.stderr.fileno(), False)
-
-                    time.sleep(0.5) # Give the subprocess time to connect
-
-                    for line in self._ssh_subprocess.stderr.readlines():
-                        self._logger.warning(line.decode().rstrip())
-
-                except:
-                    self._logger.debug('Unable to change SSH subprocess stderr to non-blocking')
-
-                # TODO: Support timeouts
-
-                self._socket = SubprocessSocket(self._ssh_subprocess, self._timeout)
+                if sys.platform == 'win32':
+                    # Windows does not support select() on pipes
+                    self._socket = _BlockingSubprocessSocket(self._ssh_subprocess, self._timeout)
+                else:
+                    self._socket = _SubprocessSocket(self._ssh_subprocess, self._timeout, self._logger)
 
             elif self._ssh_backend == SSH_BACKEND_PARAMIKO:
 
@@ -328,60 +1121,46 @@ class Connection:
                     paramiko_options.update(self._ssh_paramiko_options)
 
                 paramiko_options_print = [ f"{k}={repr(v)}" for k,v in paramiko_options.items() ]
-                self._logger.debug(f'Calling paramiko.client.SSHClient.connect("{self._host}", {", ".join(paramiko_options_print)})')
-
-                self._ssh_client = paramiko.client.SSHClient()
-                self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                self._ssh_client.connect(self._host, **paramiko_options)
-
-                class ParamikoSocket:
-                    def __init__(self, client, stdin, stdout, stderr):
-                        self._client = client
-                        self._stdin = stdin
-                        self._stdout = stdout
-                        self._stderr = stderr
-
-                    def recv(self, size, flags):
-                        return self._stdout.read(size)
-                        
-                    def recv_into(self, buffer, size, flags):
-                        buffer[ : size] = self.recv(size, flags)
-                        return size
-
-                    def sendall(self, buffer):
-                        self._stdin.write(buffer)
-                        self._stdin.flush()
-
-                    def close(self):
-                        self._stdin.close()
-                        self._stdout.close()
-                        self._stderr.close()
-                        self._client.close()
-
-                self._logger.debug(f'Calling paramiko.client.SSHClient.exec_command("{command}")')
-                stdin, stdout, stderr = self._ssh_client.exec_command(command)
-
-                # If stderr is blocking, then we can't check it without locking the whole program up
-                try:
-                    stderr.channel.settimeout(0.5) # Give the subprocess time to connect
 
-                    for line in stderr.readlines():
-                        self._logger.warning(line.rstrip())
+                def connect_ssh_client():
+                    self._logger.debug(f'Calling paramiko.client.SSHClient.connect("{self._host}", {", ".join(paramiko_options_print)})')
 
-                except:
-                    self._logger.debug('Unable to change SSH subprocess stderr to non-blocking')
+                    ssh_client = paramiko.client.SSHClient()
+                    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                    ssh_client.connect(self._host, **paramiko_options)
+                    return ssh_client
 
-                stdin.channel.settimeout(self._timeout)
-                stdout.channel.settimeout(self._timeout)
+                if self._ssh_share_connection:
+                    # Connections with the same options can open their own channel on the same transport
+                    client_key = (self._host, tuple(sorted(paramiko_options_print)))
+                    client = _acquireSharedSSHClient(client_key, connect_ssh_client)
+                else:
+                    client_key = None
+                    client = connect_ssh_client()
 
-                self._socket = ParamikoSocket(self._ssh_client, stdin, stdout, stderr)
+                try:
+                    self._logger.debug(f'Calling paramiko.client.SSHClient.exec_command("{command}")')
+                    _, stdout, _ = client.exec_command(command)
 
-        msg_login = Message(String(self._username))
-        msg_login.ndims = 1
-        msg_login.dims[0] = MDSIP_VERSION
+                except:
+                    _releaseSSHClient(client_key, client)
+                    raise
 
-        self._logger.debug(f'Sending login request with username="{self._username}"')
-        self._send(msg_login)
+                self._socket = _ParamikoSocket(client, client_key, stdout.channel, self._timeout, self._logger)
+
+        elif self._protocol == 'replay':
+
+            # Each connection, and reconnection, replays the next connection in the capture
+            self._logger.debug(f'Replaying connection {self._connection_count} from {self._host}')
+            self._socket = _ReplaySocket(self._host, self._connection_count, self._replay_speed)
+
+        if self._capture_writer is not None:
+            self._socket = _RecordingSocket(self._socket, self._capture_writer)
+
+        msg_login = _login_message(self._username, self._requested_compression_level)
+
+        self._logger.debug(f'Sending login request with username="{self._username}"')
+        self._send(msg_login)
 
         # The login response packet is a copy of the login request packet with a few fields changed,
         # so if we process it with self._recv it will wait for data that will never come
@@ -389,166 +1168,1503 @@ class Connection:
         msg_login_view = memoryview(msg_login_buffer)
         while len(msg_login_view) > 0:
             bytes_read = self._socket.recv_into(msg_login_view, len(msg_login_view), 0)
+            if bytes_read == 0:
+                raise ConnectionResetError('Connection closed before the login response was received')
+
             msg_login_view = msg_login_view[bytes_read : ]
         
         msg_login = Message.from_buffer_copy(msg_login_buffer)
 
-        if STATUS_NOT_OK(msg_login.status):
-            raise MdsException('Failed to login')
+        if STATUS_NOT_OK(msg_login.status):
+            raise MdsException('Failed to login')
+
+        self._server_version = None
+        self._compression_level = (msg_login.status & 0x1E) >> 1
+        self._client_type = msg_login.client_type
+
+        if msg_login.ndims > 0:
+            self._server_api_version = msg_login.dims[0]
+
+        self._connection_count += 1
+
+        self._logger.debug(f'Received login response with version={self._server_api_version} client_type={self._client_type} compression_level={self._compression_level}')
+
+    def disconnect(self):
+        """Close the socket, and the capture file if the connection is being recorded."""
+
+        self._disconnect()
+
+        # The capture continues across `reconnect()`, so it is only closed here
+        if self._capture_writer is not None:
+            self._capture_writer.close()
+            self._capture_writer = None
+
+    def _disconnect(self):
+
+        if self._socket:
+            self._logger.debug('Disconnecting')
+            self._socket.close()
+            self._socket = None
+
+        if self._ssh_control_key is not None:
+            _releaseSSHControlMaster(self._ssh_control_key)
+            self._ssh_control_key = None
+
+        # Any replies still on the wire are lost with the socket, so wake up anyone waiting for them
+        with self._recv_condition:
+            self._in_flight.clear()
+            self._pending.clear()
+            self._out_buffers.clear()
+            self._timings.clear()
+            self._abandoned.clear()
+            self._reading_id = None
+            self._stream_remaining = 0
+            self._stream_broken = False
+            self._streaming_thread = None
+            self._recv_condition.notify_all()
+
+            # The receiver thread will fail any futures it has left, and then exit
+            if self._receiver is not None:
+                self._receiver.shutdown(wait=False)
+                self._receiver = None
+
+    def reconnect(self):
+        """
+        Call `disconnect()` and then `connect()`, and then restore the session by reopening
+        the trees opened with `openTree()`, repeating `setDefault()`, and redefining the
+        helpers from `registerHelper()`. TDI variables are not restored.
+
+        :raises TimeoutError: if the connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises MdsException: if the login fails, or the session could not be restored.
+        """
+
+        # Keep other threads from sending or receiving until we have logged in again
+        with self._send_lock:
+            with self._recv_condition:
+                while self._receiving:
+                    self._recv_condition.wait()
+
+                self._receiving = True
+
+            try:
+                self._disconnect()
+                self.connect()
+                self._stats.recordReconnect()
+
+            finally:
+                with self._recv_condition:
+                    self._receiving = False
+                    self._recv_condition.notify_all()
+
+        self._replaySession()
+
+    def _replaySession(self):
+
+        self._replaying = True
+        try:
+            for source in self._helpers.values():
+                self._defineHelper(source)
+
+            for tree, shot, mode, path in self._open_trees:
+                self._openTree(tree, shot, mode, path)
+
+            for path in self._default_paths:
+                self._setDefault(path)
+
+        finally:
+            self._replaying = False
+
+    def _send(self, *msgs: Message):
+
+        if self._socket is None:
+            raise ConnectionError('Connection is not connected, call connect() first.')
+
+        buffers = []
+        for msg in msgs:
+            self._logger.debug(f'Sending packet with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
+            buffers.extend(msg.pack_buffers())
+            self._stats.recordSent(msg.msglen, msg.uncompressed_msglen)
+
+        # sendmsg() is only available on real sockets, and not on Windows
+        if isinstance(self._socket, socket.socket) and hasattr(self._socket, 'sendmsg'):
+            views = [ memoryview(buffer).cast('B') for buffer in buffers ]
+            while len(views) > 0:
+                bytes_sent = self._socket.sendmsg(views)
+
+                # Drop everything that has been sent, and send the rest again
+                while len(views) > 0 and bytes_sent >= len(views[0]):
+                    bytes_sent -= len(views[0])
+                    views.pop(0)
+
+                if len(views) > 0:
+                    views[0] = views[0][bytes_sent : ]
+
+        else:
+            # Join small buffers to avoid writing lots of tiny packets
+            total_length = sum(len(buffer) for buffer in buffers)
+            if total_length <= SMALL_SEND_SIZE:
+                buffers = [ b''.join(buffers) ]
+
+            for buffer in buffers:
+                self._socket.sendall(buffer)
+
+    def _recv_exactly(self, view):
+
+        total_length = len(view)
+        while len(view) > 0:
+            bytes_read = self._recv_into(view)
+            if bytes_read == 0:
+                raise ConnectionResetError('Connection closed by the server')
+
+            view = view[bytes_read : ]
+            self._stream_remaining -= bytes_read
+
+            self._logger.debug(f'Received data packet of {bytes_read} bytes, {total_length - len(view)}/{total_length}')
+
+    def _recv_into(self, view):
+        """
+        Receive some data into `view`. If this thread's request can be interrupted and has a
+        deadline, the socket is polled every `CANCEL_POLL_INTERVAL` to check if it has been
+        cancelled or passed its deadline, while still raising TimeoutError if nothing arrives
+        within `timeout`. Without a deadline, this blocks in a plain `recv_into()`, which
+        `cancel()` interrupts by shutting down the socket.
+        """
+
+        state = self._call_state
+        if state.generation is None or not self._interruptible():
+            return self._socket.recv_into(view, len(view), 0)
+
+        if state.deadline is None and hasattr(self._socket, 'shutdown'):
+            with self._recv_condition:
+                self._checkCancelled()
+                self._blocking_recv = True
+
+            try:
+                bytes_read = self._socket.recv_into(view, len(view), 0)
+            finally:
+                with self._recv_condition:
+                    self._blocking_recv = False
+
+            # The socket was shut down by `cancel()`
+            if bytes_read == 0:
+                self._checkCancelled()
+
+            return bytes_read
+
+        settimeout = getattr(self._socket, 'settimeout', None)
+        if settimeout is None:
+            # Without timeouts, we can only check between reads
+            self._checkCancelled()
+            return self._socket.recv_into(view, len(view), 0)
+
+        idle_start = time.monotonic()
+        try:
+            while True:
+                self._checkCancelled()
+
+                now = time.monotonic()
+                poll_interval = CANCEL_POLL_INTERVAL
+
+                if self._call_state.deadline is not None:
+                    poll_interval = min(poll_interval, self._call_state.deadline - now)
+
+                if self._timeout is not None:
+                    idle_remaining = self._timeout - (now - idle_start)
+                    if idle_remaining <= 0:
+                        raise TimeoutError(f'No data was received within {self._timeout}s')
+
+                    poll_interval = min(poll_interval, idle_remaining)
+
+                settimeout(max(poll_interval, 0.001))
+                try:
+                    return self._socket.recv_into(view, len(view), 0)
+
+                # socket.timeout is only an alias of TimeoutError since python 3.10
+                except (socket.timeout, TimeoutError):
+                    pass
+
+        finally:
+            settimeout(self._timeout)
+
+    def _interruptible(self):
+        """
+        Whether the current thread can stop receiving. This is only safe between replies,
+        or in the middle of a reply that nobody else is waiting for.
+        """
+        reading_id = self._reading_id
+        return reading_id is None or reading_id == self._call_state.message_id or reading_id in self._abandoned
+
+    def _checkCancelled(self):
+        """
+        Raise if the request being made by the current thread has been cancelled, or has
+        passed its deadline.
+        """
+
+        state = self._call_state
+        if state.generation is None:
+            return
+
+        if state.generation != self._cancel_generation:
+            raise RequestCancelled('The request was cancelled')
+
+        if state.deadline is not None and time.monotonic() >= state.deadline:
+            raise DeadlineExceeded('The request did not complete before its deadline')
+
+    def _pollInterval(self):
+        """
+        How long to wait on `_recv_condition` before checking `_checkCancelled()` again.
+        Without a deadline there is no need to poll, as `cancel()` notifies every waiter.
+        """
+        if self._call_state.generation is None or self._call_state.deadline is None:
+            return None
+        return CANCEL_POLL_INTERVAL
+
+    def _drain(self):
+        """
+        Read and throw away the rest of a reply that was cancelled while it was being received.
+        """
+
+        if self._stream_remaining <= 0:
+            return
+
+        self._logger.debug(f'Discarding the remaining {self._stream_remaining} bytes of a cancelled reply')
+
+        discard = bytearray(min(self._stream_remaining, RECV_CHUNK_SIZE))
+        while self._stream_remaining > 0:
+            self._recv_exactly(memoryview(discard)[ : min(self._stream_remaining, len(discard)) ])
+
+    def _recv_header(self):
+
+        if self._socket is None:
+            raise ConnectionError('Connection is not connected, call connect() first.')
+
+        self._drain()
+
+        msg_buffer = bytearray(ctypes.sizeof(Message))
+        msg_view = memoryview(msg_buffer)
+        try:
+            while len(msg_view) > 0:
+                bytes_read = self._recv_into(msg_view)
+                if bytes_read == 0:
+                    raise ConnectionResetError('Connection closed by the server')
+
+                msg_view = msg_view[bytes_read : ]
+
+        except (RequestCancelled, KeyboardInterrupt):
+            # Without the whole header we cannot tell where the next reply starts
+            if len(msg_view) < len(msg_buffer):
+                self._stream_broken = True
+            raise
+
+        msg = Message.from_buffer_copy(msg_buffer)
+        self._stream_remaining = msg.msglen - len(msg_buffer)
+
+        self._logger.debug(f'Received message with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
+
+        return msg
+
+    def _recv_data(self, msg, out=None, timing=None):
+
+        data = Descriptor()
+
+        # Decompressing the data changes the msglen to the uncompressed size
+        msglen = msg.msglen
+
+        data_length = msg.msglen - ctypes.sizeof(msg)
+        if data_length > 0:
+            start = time.perf_counter()
+            decompress_time = 0.0
+
+            if (msg.client_type & COMPRESSED) > 0:
+                prefix = bytearray(MessageDecompressor.PREFIX_SIZE)
+                self._recv_exactly(memoryview(prefix))
+
+                # Decompress each chunk as soon as it arrives, instead of waiting for all of them
+                decompressor = MessageDecompressor(msg, prefix, out=out)
+                chunk = bytearray(min(decompressor.compressed_length, RECV_CHUNK_SIZE))
+
+                remaining = decompressor.compressed_length
+                while remaining > 0:
+                    chunk_view = memoryview(chunk)[ : min(remaining, len(chunk)) ]
+                    self._recv_exactly(chunk_view)
+
+                    decompress_start = time.perf_counter()
+                    decompressor.decompress(chunk_view)
+                    decompress_time += time.perf_counter() - decompress_start
+
+                    remaining -= len(chunk_view)
+
+                decompress_start = time.perf_counter()
+                data_buffer = decompressor.finish()
+                decompress_time += time.perf_counter() - decompress_start
+
+            else:
+                data_buffer = msg.allocate_data_buffer(out)
+                self._recv_exactly(memoryview(data_buffer).cast('B'))
+
+            received = time.perf_counter()
+
+            # Large replies tell us how fast the link is, so the policy can pick a compression level
+            self._compression_policy.recordTransfer(data_length, received - start)
+
+            data = msg.unpack_data(data_buffer, out=out)
+
+            if timing is not None:
+                timing.receive = received - start - decompress_time
+                timing.decompress = decompress_time
+                timing.decode = time.perf_counter() - received
+
+        if timing is not None:
+            timing.bytes_received = msglen
+
+        self._stats.recordReceived(msglen, msg.msglen)
+
+        return data
+
+    def _recv(self, out=None):
+        msg = self._recv_header()
+        return msg, self._recv_data(msg, out=out)
+
+    def _next_message_id(self):
+        # The message_id wraps around after MAX_MESSAGE_ID, skipping INVALID_MESSAGE_ID and
+        # any ids that are still waiting for a reply
+        for _ in range(MAX_MESSAGE_ID):
+            self._message_id = (self._message_id % MAX_MESSAGE_ID) + 1
+            if self._message_id not in self._in_flight:
+                return self._message_id
+
+        raise MdsException(f'Unable to allocate a message_id, there are already {MAX_MESSAGE_ID} requests in flight')
+
+    def _compress(self, msg: Message, compression_level: int = None):
+        """
+        Compress a message at the given level, or at the level chosen by the compression policy.
+        """
+
+        if compression_level is None:
+            compression_level = self._compression_policy.chooseLevel(msg.buffer, self._compression_level)
+
+        if compression_level > 0:
+            msg.compress(compression_level)
+
+    def _send_request(self, expr, *args, out=None, compression_level: int = None):
+        """
+        Send an expression and its arguments to the server without waiting for the reply.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param numpy.ndarray out: An optional array to receive the data of the reply into,
+            see `getInto()`.
+        :param int compression_level: The compression level to use for this request instead
+            of the one chosen by the compression policy, 0 disables compression.
+        :return: The message_id to pass to `_recv_response()` to retrieve the reply.
+        :rtype: int
+        """
+
+        # An interceptor may have changed the compression level since `get()` checked it
+        if compression_level is not None:
+            _checkCompressionLevel(compression_level)
+
+        if self._stream_broken or len(self._abandoned) > 0 or self._stream_remaining > CANCEL_DRAIN_LIMIT:
+            self._recover()
+
+        timing = None
+        if len(self._timing_callbacks) > 0:
+            timing = RequestTiming(expr)
+
+        mget = Message(expr)
+        mget.nargs = 1 + len(args)
+
+        messages = [ mget ]
+        for i, arg in enumerate(args):
+            marg = Message(arg)
+            marg.nargs = mget.nargs
+            marg.descriptor_idx = i + 1
+
+            messages.append(marg)
+
+        if timing is not None:
+            timing.serialize = time.perf_counter() - timing.start
+            timing.arg_sizes = [ len(msg.buffer) for msg in messages[ 1 : ] ]
+
+        for msg in messages:
+            self._compress(msg, compression_level)
+
+        if timing is not None:
+            timing.compress = time.perf_counter() - timing.start - timing.serialize
+
+        with self._send_lock:
+            while True:
+                with self._recv_condition:
+                    # When sharing the connection between threads, wait for a message_id to be freed
+                    # instead of failing, and read replies while waiting if no other thread is
+                    if not self._thread_safe or len(self._in_flight) < MAX_MESSAGE_ID:
+                        message_id = self._next_message_id()
+                        self._in_flight.add(message_id)
+
+                        if out is not None:
+                            self._out_buffers[message_id] = out
+
+                        if timing is not None:
+                            self._timings[message_id] = timing
+
+                        break
+
+                    if self._receiving:
+                        self._recv_condition.wait(self._pollInterval())
+                        self._checkCancelled()
+                        continue
+
+                    # If every reply has been received, only the threads waiting to send can free a message_id
+                    if len(self._in_flight - self._pending.keys()) == 0:
+                        raise MdsException(f'Unable to allocate a message_id, there are already {MAX_MESSAGE_ID} requests in flight')
+
+                    self._receiving = True
+
+                self._recv_turn()
+
+            for msg in messages:
+                msg.message_id = message_id
+
+            # Send the expression and all of its arguments at once
+            try:
+                if timing is not None:
+                    send_start = time.perf_counter()
+
+                self._send(*messages)
+                self._stats.recordRequest()
+
+                if timing is not None:
+                    timing.sent = time.perf_counter()
+                    timing.send = timing.sent - send_start
+                    timing.bytes_sent = sum(msg.msglen for msg in messages)
+
+            except:
+                with self._recv_condition:
+                    self._in_flight.discard(message_id)
+                    self._out_buffers.pop(message_id, None)
+                    self._timings.pop(message_id, None)
+                raise
+
+        return message_id
+
+    def _recv_response(self, message_id):
+        """
+        Wait for the reply to a request sent with `_send_request()`. Replies to other requests
+        that arrive first are held until they are asked for. With `thread_safe=True`, only one
+        thread reads from the socket at a time, and the others wait for it to hand them their
+        reply.
+
+        :param int message_id: The message_id returned by `_send_request()`.
+        :return: The reply message header and data.
+        :rtype: tuple(:class:`Message`, :class:`Descriptor`)
+        :raises ConnectionResetError: if the connection was closed before the reply arrived.
+        :raises MdsException: if a reply cannot be matched to any request in flight.
+        """
+
+        try:
+            while True:
+                with self._recv_condition:
+                    while True:
+                        if message_id in self._pending:
+                            self._in_flight.discard(message_id)
+                            self._out_buffers.pop(message_id, None)
+                            timing = self._timings.pop(message_id, None)
+                            reply = self._pending.pop(message_id)
+                            break
+
+                        if message_id not in self._in_flight:
+                            raise ConnectionResetError('The connection was closed before the reply was received')
+
+                        if not self._receiving:
+                            reply = None
+                            break
+
+                        if self._streaming_thread == threading.get_ident():
+                            raise MdsException('Cannot make a request while iterating over the results of GetMany.execute_iter()')
+
+                        self._recv_condition.wait(self._pollInterval())
+                        self._checkCancelled()
+
+                    if reply is None:
+                        self._receiving = True
+
+                if reply is not None:
+                    if timing is not None:
+                        timing.total = time.perf_counter() - timing.start
+                        for callback in self._timing_callbacks:
+                            callback(timing)
+
+                    return reply
+
+                self._recv_turn()
+
+        except (RequestCancelled, KeyboardInterrupt):
+            self._abandon(message_id)
+            raise
+
+    def _abandon(self, message_id):
+        """
+        Stop waiting for the reply to a request, so that it is thrown away when it arrives.
+        """
+
+        with self._recv_condition:
+            if message_id in self._pending:
+                self._pending.pop(message_id)
+                self._in_flight.discard(message_id)
+
+            elif message_id in self._in_flight:
+                self._abandoned.add(message_id)
+
+            self._out_buffers.pop(message_id, None)
+            self._timings.pop(message_id, None)
+
+    def _recover(self):
+        """
+        Reconnect if cancelled requests have left the connection in a state that would take
+        too long to recover from, or that cannot be recovered from at all. This is the case
+        if there is too much of a cancelled reply left to drain, or if there are replies that
+        have not arrived yet, which could take any amount of time, and no other requests are
+        waiting for replies on this connection.
+        """
+
+        with self._reconnect_lock:
+            with self._recv_condition:
+                waiting = self._in_flight - self._abandoned
+                if not self._stream_broken:
+                    if len(waiting) > 0 or (len(self._abandoned) == 0 and self._stream_remaining <= CANCEL_DRAIN_LIMIT):
+                        return
+
+            self._logger.info('Reconnecting to discard the replies to cancelled requests')
+            self.reconnect()
+
+    def _recv_turn(self, stream_id=None):
+        """
+        Receive the next reply after setting `_receiving`, and then let the next thread have a turn.
+        If the reply is to `stream_id`, the turn is kept and the header is returned, see `_recv_reply()`.
+        """
+
+        msg = None
+        try:
+            msg = self._recv_reply(stream_id)
+            return msg
+
+        finally:
+            if msg is None:
+                with self._recv_condition:
+                    self._receiving = False
+                    self._recv_condition.notify_all()
+
+    def _recv_reply(self, stream_id=None):
+        """
+        Receive the next reply from the socket and put it in `_pending`. If it is the reply to
+        `stream_id`, and is an array of bytes, only the header is received and returned, and the
+        data is left on the socket for a :class:`_ReplyStream`.
+        """
+
+        msg = self._recv_header()
+        header_received = time.perf_counter()
+
+        with self._recv_condition:
+            reply_id = msg.message_id
+            if reply_id not in self._in_flight or reply_id in self._pending:
+
+                # With only one request outstanding there is no ambiguity, so tolerate
+                # servers that do not echo the message_id back
+                outstanding = self._in_flight - self._pending.keys()
+                if len(outstanding) != 1:
+                    raise MdsException(f'Received a reply with an unexpected message_id={reply_id}')
+
+                reply_id = next(iter(outstanding))
+
+            if reply_id in self._abandoned:
+                self._abandoned.discard(reply_id)
+                self._in_flight.discard(reply_id)
+                reply_id = None
+
+            out = self._out_buffers.get(reply_id)
+            timing = self._timings.get(reply_id)
+            self._reading_id = reply_id
+
+        # Nobody is waiting for this reply anymore
+        if reply_id is None:
+            self._drain()
+            return None
+
+        if reply_id == stream_id and out is None and _ReplyStream.canStream(msg):
+            return msg
+
+        if timing is not None:
+            timing.wait = header_received - (timing.sent or header_received)
+
+        try:
+            data = self._recv_data(msg, out=out, timing=timing)
+
+        except (RequestCancelled, KeyboardInterrupt):
+            # The rest of this reply will be drained before the next one is received
+            with self._recv_condition:
+                self._reading_id = None
+                self._in_flight.discard(reply_id)
+                self._abandoned.discard(reply_id)
+                self._out_buffers.pop(reply_id, None)
+                self._timings.pop(reply_id, None)
+            raise
+
+        with self._recv_condition:
+            self._reading_id = None
+            if reply_id in self._abandoned:
+                self._abandoned.discard(reply_id)
+                self._in_flight.discard(reply_id)
+            else:
+                self._pending[reply_id] = (msg, data)
+
+        return None
+
+    def _request(self, expr, *args, out=None, compression_level: int = None, idempotent: bool = True):
+        """
+        Send a request and wait for its reply. If the connection is lost and `auto_reconnect`
+        is enabled, reconnect and restore the session, and then send the request again if it
+        is idempotent. Otherwise the error is raised, as the request may or may not have
+        been executed.
+        """
+
+        connection_count = self._connection_count
+
+        with self._cancellable() as state:
+            try:
+                message_id = self._send_request(expr, *args, out=out, compression_level=compression_level)
+                state.message_id = message_id
+                return self._recv_response(message_id)
+
+            # Only a connection that has been reset, closed, or broken is reconnected, not one
+            # that timed out waiting for a slow reply
+            except (ConnectionError, EOFError) as e:
+                self._reconnectOrRaise(e, connection_count, idempotent)
+
+            message_id = self._send_request(expr, *args, out=out, compression_level=compression_level)
+            state.message_id = message_id
+            return self._recv_response(message_id)
+
+    def _pipeline(self, requests: list, max_in_flight: int, idempotent: bool = True):
+        """
+        Make a list of `(expr, args)` requests, sending up to `max_in_flight` of them before
+        waiting for the first reply, and return the result of each in order, or the exception
+        that `get()` would have raised for it.
+
+        Like `_request()`, the requests that have no reply yet are sent again after `auto_reconnect`,
+        and `cancel()` and the deadline interrupt them between replies. Interceptors only wrap
+        one request at a time, so if there are any, the requests go through `get()` one after
+        another instead.
+        """
+
+        results = [ None ] * len(requests)
+
+        if len(self._interceptors) > 0:
+            for i, (expr, args) in enumerate(requests):
+                try:
+                    results[i] = self.get(expr, *args, idempotent=idempotent)
+                except RequestCancelled:
+                    raise
+                except MdsException as e:
+                    results[i] = e
+
+            return results
+
+        remaining = list(range(len(requests)))
+        retried = False
+
+        with self._cancellable() as state:
+            while True:
+                connection_count = self._connection_count
+                waiting = collections.deque()
+
+                try:
+                    for i in remaining:
+                        if len(waiting) >= max_in_flight:
+                            self._pipelineReceive(state, waiting, results)
+
+                        expr, args = requests[i]
+                        waiting.append((i, self._send_request(expr, *args)))
+
+                    while len(waiting) > 0:
+                        self._pipelineReceive(state, waiting, results)
+
+                    return results
+
+                except (ConnectionError, EOFError) as e:
+                    if retried:
+                        raise
+
+                    self._reconnectOrRaise(e, connection_count, idempotent)
+
+                    # Send the requests that did not get a reply again
+                    remaining = [ i for i in remaining if results[i] is None ]
+                    retried = True
+
+                except (RequestCancelled, KeyboardInterrupt):
+                    for _, message_id in waiting:
+                        self._abandon(message_id)
+                    raise
+
+    def _pipelineReceive(self, state, waiting, results):
+        """
+        Receive the reply to the oldest request of `_pipeline()`.
+        """
+
+        i, message_id = waiting[0]
+        state.message_id = message_id
+        manswer, data = self._recv_response(message_id)
+        waiting.popleft()
+
+        if STATUS_NOT_OK(manswer.status):
+            results[i] = getException(manswer.status)
+        else:
+            results[i] = data
+
+    @contextlib.contextmanager
+    def _cancellable(self):
+        """
+        Allow `cancel()` and the deadline to interrupt the requests made by the current thread
+        inside the with statement, while they wait for their replies.
+        """
+
+        state = self._call_state
+        previous_state = (state.generation, state.message_id)
+        if state.generation is None:
+            state.generation = self._cancel_generation
+
+        try:
+            yield state
+
+        finally:
+            state.generation, state.message_id = previous_state
+
+    def _reconnectOrRaise(self, error, connection_count, idempotent):
+        """
+        Handle a request that failed because the connection was lost. If `auto_reconnect` is
+        enabled, reconnect unless another thread already has since `connection_count`, and
+        return if the request can be sent again. Otherwise `error` is raised.
+        """
+
+        if not self._auto_reconnect or self._replaying:
+            raise error
+
+        # When sharing the connection between threads, only the first to notice reconnects
+        with self._reconnect_lock:
+            if self._connection_count == connection_count:
+                self._logger.warning(f'Lost connection to {self._url} ({error!r}), reconnecting')
+                self.reconnect()
+
+        if not idempotent:
+            raise error
+
+    def _openStream(self, expr, *args, deadline: float = None):
+        """
+        Send a request, and return a :class:`_ReplyStream` to receive the data of its reply a
+        chunk at a time. If the reply is not an array of bytes, or another thread has already
+        received it, the data is returned whole instead. The streamed reply must be closed
+        before the connection can be used again.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the expression.
+        :param float deadline: The number of seconds the whole request may take, including
+            receiving all of the data of the reply, see `get()`.
+        :return: The reply message header, and either the data or a :class:`_ReplyStream`.
+        :rtype: tuple(:class:`Message`, :class:`Descriptor` or :class:`_ReplyStream`)
+        """
+
+        state = self._call_state
+        previous_state = (state.generation, state.deadline, state.message_id)
+
+        generation = state.generation
+        if generation is None:
+            generation = self._cancel_generation
+
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+            if state.deadline is not None:
+                deadline = min(deadline, state.deadline)
+        else:
+            deadline = state.deadline
+
+        state.generation = generation
+        state.deadline = deadline
+
+        try:
+            message_id = self._send_request(expr, *args)
+            state.message_id = message_id
+
+            try:
+                while True:
+                    with self._recv_condition:
+                        while True:
+                            if message_id in self._pending:
+                                self._in_flight.discard(message_id)
+                                self._timings.pop(message_id, None)
+                                return self._pending.pop(message_id)
+
+                            if message_id not in self._in_flight:
+                                raise ConnectionResetError('The connection was closed before the reply was received')
+
+                            if not self._receiving:
+                                break
+
+                            if self._streaming_thread == threading.get_ident():
+                                raise MdsException('Cannot make a request while iterating over the results of GetMany.execute_iter()')
+
+                            self._recv_condition.wait(self._pollInterval())
+                            self._checkCancelled()
+
+                        self._receiving = True
+
+                    msg = self._recv_turn(stream_id=message_id)
+                    if msg is not None:
+                        return msg, _ReplyStream(self, message_id, msg, generation, deadline)
+
+            except (RequestCancelled, KeyboardInterrupt):
+                self._abandon(message_id)
+                raise
+
+        finally:
+            state.generation, state.deadline, state.message_id = previous_state
+
+    @contextlib.contextmanager
+    def _deadline(self, deadline: float):
+        """
+        Limit the requests made by the current thread inside the with statement to `deadline`
+        seconds, or to the deadline of an enclosing call if that is sooner.
+        """
+
+        state = self._call_state
+        previous_deadline = state.deadline
+
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+            if previous_deadline is not None:
+                deadline = min(deadline, previous_deadline)
+
+            state.deadline = deadline
+
+        try:
+            yield
+
+        finally:
+            state.deadline = previous_deadline
+
+    def cancel(self):
+        """
+        Cancel every request that is currently waiting for a reply on this connection, which
+        will raise :class:`RequestCancelled`. This is meant to be called from another thread,
+        such as the UI thread of an interactive tool, and the connection can still be used
+        afterwards. Pressing Ctrl+C during a request also leaves the connection usable.
+
+        The reply to a cancelled request is thrown away when it arrives. If it was already
+        being received, the rest of it is read and thrown away first if it is smaller than
+        `CANCEL_DRAIN_LIMIT`, otherwise the next request will reconnect and restore the
+        session like `reconnect()`. The same is done if no other requests are waiting for
+        replies, as the server may take any amount of time to finish a cancelled request.
+        """
+
+        with self._recv_condition:
+            self._cancel_generation += 1
+            self._recv_condition.notify_all()
+
+            # A plain recv_into() cannot be interrupted, so shut the socket down under it. The
+            # rest of the stream is lost with it, so the next request reconnects.
+            if self._blocking_recv:
+                self._stream_broken = True
+                try:
+                    self._socket.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+
+    def get(self, expr, *args, compression_level: int = None, idempotent: bool = True, deadline: float = None):
+        """
+        Evaluate an expression on the remote server and return the result. This works like
+        `mdsvalue()` in our other APIs.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param int compression_level: The compression level to send this request with, from 0
+            to `MAX_COMPRESSION_LEVEL`, overriding the compression policy. Use 0 to send it uncompressed.
+        :param bool idempotent: Whether the expression can safely be evaluated twice, which
+            allows it to be retried with `auto_reconnect`. Pass False for expressions that
+            write data or have other side effects. Defaults to True.
+        :param float deadline: The number of seconds the whole request may take, including
+            receiving the reply, after which it is cancelled, see `cancel()`. Unlike `timeout`,
+            this also limits replies that keep arriving slowly. Sending the request is not
+            interrupted.
+        :return: The result of executing the expression.
+        :rtype: :class:`Descriptor`
+        :raises TimeoutError: if the connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before the reply is received.
+        :raises RequestCancelled: if the request is cancelled with `cancel()`.
+        :raises MdsException: if the result status indicates an error.
+        """
+
+        if compression_level is not None:
+            _checkCompressionLevel(compression_level)
+
+        with self._stats.operation('get'), self._deadline(deadline):
+            if expr.strip() == '':
+                return Descriptor()
+
+            request = InterceptedRequest(self, expr, args, idempotent, compression_level)
+
+            # Copy the list, in case another thread changes it while we are working through it
+            interceptors = tuple(self._interceptors)
+            if len(interceptors) == 0:
+                return self._execute(request)
+
+            def proceed(request, index=0):
+                if index == len(interceptors):
+                    return self._execute(request)
+
+                return interceptors[index](request, lambda request: proceed(request, index + 1))
+
+            return proceed(request)
+
+    def _execute(self, request):
+        """
+        Send an :class:`InterceptedRequest` and return the result, at the end of the chain of interceptors.
+        """
+
+        manswer, data = self._request(
+            request.expr,
+            *request.args,
+            compression_level=request.compression_level,
+            idempotent=request.idempotent,
+        )
+
+        if STATUS_NOT_OK(manswer.status):
+            raise getException(manswer.status)
+
+        return data
+
+    def addInterceptor(self, interceptor):
+        """
+        Add an interceptor around every call to `get()`, and so also to `getObject()`, `put()`,
+        `openTree()`, `tcl()`, `submit()`, `Pipeline`, `GetMany` and `PutMany`, which are built
+        on it. Requests that would otherwise be pipelined are made one at a time. Interceptors are
+        called as `interceptor(request, proceed)` with an :class:`InterceptedRequest`, and must
+        return the result of calling `proceed(request)`, or a result of their own. They can
+        rewrite the request with `request._replace()`, and they see the result or the exception
+        raised by `proceed()`. The first interceptor added is the outermost.
+
+        Example:
+        ```
+        def log_requests(request, proceed):
+            start = time.time()
+            try:
+                return proceed(request)
+            finally:
+                print(request.expr, time.time() - start)
+
+        c.addInterceptor(log_requests)
+        ```
+
+        :param interceptor: The function to call with each request.
+        """
+        self._interceptors.append(interceptor)
+
+    def removeInterceptor(self, interceptor):
+        """
+        Remove an interceptor added by `addInterceptor()`.
+
+        :param interceptor: The function to remove.
+        :raises ValueError: if the interceptor was not added.
+        """
+        self._interceptors.remove(interceptor)
+
+    def getObject(self, expr, *args, deadline: float = None):
+        """
+        Evaluate a `get()` expression, but the expression will be wrapped in 'SerializeOut'
+        and `deserialize()` will be called on the result. This allows you to retrieve data
+        with CLASS_R or CLASS_APD, that otherwise cannot be retrieved with a regular `get()`.
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param float deadline: The number of seconds the whole request may take, see `get()`.
+        :return: The result of executing the expression.
+        :rtype: :class:`Descriptor`
+        :raises TimeoutError: if the connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before the reply is received.
+        :raises RequestCancelled: if the request is cancelled with `cancel()`.
+        :raises MdsException: if the result status indicates an error.
+        """
+        with self._stats.operation('getObject'):
+            return self.get(f'SerializeOut(`({expr};))', *args, deadline=deadline).deserialize(conn=self)
+
+    def getInto(self, expr, *args, out, deadline: float = None):
+        """
+        Evaluate a `get()` expression that returns a numeric array, and receive the array
+        directly into `out` instead of allocating a new one. This avoids an allocation and a
+        copy per request when reading the same shape of data repeatedly.
+
+        Example:
+        ```
+        out = numpy.empty(1000, dtype=numpy.float32)
+        for shot in shots:
+            c.openTree('tree', shot)
+            c.getInto('SIGNAL', out=out)
+        ```
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param numpy.ndarray out: A writable, C-contiguous array with the same dtype and
+            number of bytes as the result. Arrays too large for one message are read in
+            chunks with `getChunked()`.
+        :param float deadline: The number of seconds the whole request may take, see `get()`.
+            If it passes, part of the result may already have been written into `out`.
+        :return: The result of executing the expression, sharing memory with `out`.
+        :rtype: :class:`DescriptorA`
+        :raises TimeoutError: if the connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before the reply is received.
+        :raises RequestCancelled: if the request is cancelled with `cancel()`.
+        :raises MdsException: if the result status indicates an error, or if the result
+            does not fit into `out`.
+        """
+
+        with self._stats.operation('getInto'), self._deadline(deadline):
+            if expr.strip() == '':
+                return Descriptor()
+
+            # The reply could not fit in one message, so it has to be read in chunks
+            if out.nbytes > MAX_MSGLEN - ctypes.sizeof(Message):
+                return self.getChunked(expr, *args, out=out)
+
+            manswer, data = self._request(expr, *args, out=out)
+
+            if STATUS_NOT_OK(manswer.status):
+                raise getException(manswer.status)
+
+            if not isinstance(data, DescriptorA) or not numpy.may_share_memory(data.data(), out):
+                raise MdsException(f'Unable to receive the result into an array of {out.dtype} with shape {out.shape}, got {data!r}')
+
+            return data
+
+    def getChunked(self, expr, *args, chunk_size: int = MAX_CHUNK_SIZE, out=None, deadline: float = None):
+        """
+        Evaluate a `get()` expression that returns an array, and receive it in chunks of up
+        to `chunk_size` bytes. A single message is limited to 2 GiB, so this is needed to
+        read larger arrays.
+
+        The result is evaluated once into a variable on the server, and then read with
+        subscripts into one preallocated array, which is reshaped to match the result.
+
+        Example:
+        ```
+        data = c.getChunked('BIG_SIGNAL').data()
+        ```
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param int chunk_size: The largest number of bytes to receive in each request,
+            defaults to `MAX_CHUNK_SIZE`.
+        :param numpy.ndarray out: An optional writable, C-contiguous array with the same
+            dtype and number of elements as the result, to receive the chunks into, see
+            `getInto()`. Numeric arrays are otherwise received into a new array.
+        :param float deadline: The number of seconds all of the requests may take, see `get()`.
+        :return: The result of executing the expression.
+        :rtype: :class:`Descriptor`
+        :raises TimeoutError: if the connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before the last chunk is received.
+        :raises RequestCancelled: if the request is cancelled with `cancel()`.
+        :raises MdsException: if the result status indicates an error, or if the result
+            does not fit into `out`.
+        """
+
+        if out is not None and not out.flags.c_contiguous:
+            raise MdsException('Unable to receive the result into an array that is not C-contiguous')
+
+        with self._stats.operation('getChunked'), self._deadline(deadline), self._chunkedVariables() as variables:
+            variable = CHUNKED_VARIABLE.format(next(_chunked_variable_ids))
+            shape_variable = f'{variable}_shape'
+            variables.extend([variable, shape_variable])
+
+            # Evaluate the result once, and flatten it so that it can be read with one subscript
+            shape = self.get(f'{variable}=data(({expr}));{shape_variable}=shape({variable});{variable}=set_range(size({variable}),{variable});{shape_variable}', *args).data()
+
+            # TDI lists the dimensions fastest first, and numpy slowest first, and scalars have none
+            shape = tuple(int(dim) for dim in reversed(numpy.atleast_1d(shape))) if shape is not None else ()
+            if len(shape) == 0:
+                return self.get(f'{variable}[0]')
+
+            total = int(numpy.prod(shape))
+
+            # The element size is not known yet, so the first chunk assumes the largest
+            count = min(total, max(1, chunk_size // 16))
+            first = self.get(f'{variable}[$1:$2]', 0, count - 1)
+
+            first_data = numpy.atleast_1d(first.data())
+            if not isinstance(first, DescriptorA) or first_data.dtype.kind not in 'biufc':
+                # Strings and other arrays cannot be received in place, so they are joined at the end
+                chunks = [first_data]
+                step = count
+                for start in range(count, total, step):
+                    end = min(start + step, total)
+                    chunks.append(numpy.atleast_1d(self.get(f'{variable}[$1:$2]', start, end - 1).data()))
+
+                return Descriptor.from_data(numpy.concatenate(chunks).reshape(shape))
+
+            if out is None:
+                out = numpy.empty(shape, dtype=first_data.dtype)
+
+            elif out.dtype != first_data.dtype or out.size != total:
+                raise MdsException(f'Unable to receive the result into an array of {out.dtype} with shape {out.shape}, expected {first_data.dtype} with shape {shape}')
+
+            flat = out.reshape(-1)
+            flat[ : count ] = first_data
+
+            step = max(1, chunk_size // flat.itemsize)
+            for start in range(count, total, step):
+                end = min(start + step, total)
+                self.getInto(f'{variable}[$1:$2]', start, end - 1, out=flat[start : end])
+
+            return type(first).from_numpy(out.reshape(shape), conn=self)
+
+    @contextlib.contextmanager
+    def _chunkedVariables(self):
+        """
+        Yield a list for the names of the variables on the server used for a chunked transfer,
+        which are freed afterwards. If the transfer fails, any error freeing them is ignored in
+        favor of the one already being raised. The variables are lost if `auto_reconnect` restores
+        the connection part way through, so that is raised instead of the error it leads to.
+        """
+
+        variables = []
+        connection_count = self._connection_count
+
+        try:
+            yield variables
+
+        except Exception as e:
+            if len(variables) > 0 and self._connection_count != connection_count:
+                raise MdsException('The connection was lost during a chunked transfer, along with the data on the server') from e
+
+            try:
+                self._deallocate(variables)
+            except Exception:
+                pass
+            raise
+
+        self._deallocate(variables)
+
+    def _deallocate(self, variables):
+        # The variables are freed along with the session if the connection is lost, so this can be sent again
+        if len(variables) > 0:
+            self.get(';'.join(f'deallocate("{variable}")' for variable in variables))
+
+    def submit(self, expr, *args, compression_level: int = None):
+        """
+        Send an expression to the remote server without waiting for the reply, and return
+        a future for the result. The replies are received and decoded by a background thread,
+        so this requires the connection to be created with `thread_safe=True`.
+
+        Example:
+        ```
+        futures = [ c.submit('getnci($, "LENGTH")', node) for node in nodes ]
+        lengths = [ future.result() for future in futures ]
+        ```
+
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        :param int compression_level: The compression level to use for this request instead
+            of the one chosen by the compression policy, 0 disables compression.
+        :return: A future that resolves to what `get()` would have returned, or raises
+            what it would have raised. Requests are not retried by `auto_reconnect`.
+        :rtype: :class:`concurrent.futures.Future`
+        :raises TimeoutError: if the network connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises MdsException: if the connection is not thread safe.
+        """
+        return self._submit(expr, *args, compression_level=compression_level)
+
+    def map(self, exprs):
+        """
+        Submit many expressions with `submit()`, and return their results in order. All of
+        the requests are sent before waiting for the first reply.
+
+        Example:
+        ```
+        for length in c.map(('getnci($, "LENGTH")', node) for node in nodes):
+            print(length)
+        ```
+
+        :param exprs: An iterable of TDI expressions, or tuples of `(expr, *args)`.
+        :return: A generator of the results, in the same order as `exprs`.
+        :raises MdsException: if the connection is not thread safe, or if the evaluation
+            of an expression on the server failed.
+        """
+
+        futures = []
+        for expr in exprs:
+            if isinstance(expr, str):
+                futures.append(self._submit(expr))
+            else:
+                futures.append(self._submit(*expr))
+
+        def results():
+            try:
+                for future in futures:
+                    yield future.result()
+
+            finally:
+                # If the caller stops early, do not decode the remaining results for nothing
+                for future in futures:
+                    future.cancel()
+
+        return results()
 
-        self._server_version = None
-        self._compression_level = (msg_login.status & 0x1E) >> 1
-        self._client_type = msg_login.client_type
+    def _submit(self, expr, *args, compression_level: int = None, resolve=None):
+        """
+        Send a request, and have the receiver thread complete a future with its reply. If
+        `resolve` is given, it is called by the receiver thread on the result of the request,
+        and the future resolves to what it returns instead.
+        """
 
-        if msg_login.ndims > 0:
-            self._server_api_version = msg_login.dims[0]
+        import concurrent.futures
 
-        self._logger.debug(f'Received login response with version={self._server_api_version} client_type={self._client_type} compression_level={self._compression_level}')
+        if not self._thread_safe:
+            raise MdsException('submit() requires a Connection created with thread_safe=True')
 
-    def disconnect(self):
-        """Close the socket."""
+        if compression_level is not None:
+            _checkCompressionLevel(compression_level)
 
-        if self._socket:
-            self._logger.debug('Disconnecting')
-            self._socket.close()
-            self._socket = None
+        future = concurrent.futures.Future()
 
-    def reconnect(self):
-        """Call `disconnect()` and then `connect()`."""
-        self.disconnect()
-        self.connect()
+        # Interceptors wrap the whole of a request, so the receiver thread makes it with `get()`
+        intercepted = (len(self._interceptors) > 0)
+        if not intercepted:
+            message_id = self._send_request(expr, *args, compression_level=compression_level)
 
-    def _send(self, msg: Message):
+        with self._recv_condition:
+            if self._receiver is None:
+                self._receiver = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='mdsthin-receiver')
 
-        buffer = msg.pack()
+            # The replies arrive in the order the requests were sent, so one thread can receive them all in turn
+            if intercepted:
+                self._receiver.submit(self._resolve_intercepted, future, expr, args, compression_level, resolve)
+            else:
+                self._receiver.submit(self._resolve_future, future, message_id, resolve)
 
-        self._logger.debug(f'Sending packet with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
-        self._socket.sendall(buffer)
+        return future
 
-    def _recv(self):
+    def _resolve_intercepted(self, future, expr, args, compression_level, resolve):
 
-        msg = Message()
-        data = Descriptor()
+        if not future.set_running_or_notify_cancel():
+            return
 
-        msg_buffer = bytearray(ctypes.sizeof(msg))
-        msg_view = memoryview(msg_buffer)
-        while len(msg_view) > 0:
-            bytes_read = self._socket.recv_into(msg_view, len(msg_view), 0)
-            msg_view = msg_view[bytes_read : ]
+        try:
+            data = self.get(expr, *args, compression_level=compression_level)
+            if resolve is not None:
+                data = resolve(data)
 
-        msg = Message.from_buffer_copy(msg_buffer)
+        except BaseException as e:
+            future.set_exception(e)
+            return
 
-        self._logger.debug(f'Received message with msglen={msg.msglen} dtype_id={dtype_to_string(msg.dtype_id)} length={msg.length} dimct={msg.ndims} dims={list(msg.dims)}')
+        future.set_result(data)
 
-        data_length = msg.msglen - ctypes.sizeof(msg)
-        if data_length > 0:
-            data_buffer = bytearray(data_length)
-            data_view = memoryview(data_buffer)
-            while len(data_view) > 0:
-                bytes_read = self._socket.recv_into(data_view, len(data_view), 0)
-                data_view = data_view[bytes_read : ]
+    def _resolve_future(self, future, message_id, resolve):
+
+        # The reply must be received even if the future was cancelled, to free the message_id
+        running = future.set_running_or_notify_cancel()
+
+        try:
+            manswer, data = self._recv_response(message_id)
+            if not running:
+                return
+
+            if STATUS_NOT_OK(manswer.status):
+                raise getException(manswer.status)
 
-                self._logger.debug(f'Received data packet of {bytes_read} bytes, {data_length - len(data_view)}/{data_length}')
+            if resolve is not None:
+                data = resolve(data)
 
-            data = msg.unpack_data(data_buffer)
+        except BaseException as e:
+            if running:
+                future.set_exception(e)
+            return
 
-        return msg, data
+        future.set_result(data)
 
-    def get(self, expr, *args):
+    def put(self, path, expr, *args, compression_level: int = None, chunk_size: int = None):
         """
-        Evaluate an expression on the remote server and return the result. This works like
-        `mdsvalue()` in our other APIs.
+        Put an evaluated expression into a node in the last opened MDSplus tree.
+
+        Numeric arrays too large for one message are sent in chunks, and assembled in a
+        variable on the server before being written to the node.
 
+        :param str path: The path to the node to write data into.
         :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
         :param *args: The optional arguments to be inserted for the placeholders in the
             expression. All native python/numpy types will be converted to Descriptors.
-        :return: The result of executing the expression.
-        :rtype: :class:`Descriptor`
+        :param int compression_level: The compression level to send this request with,
+            overriding the compression policy. Use 0 to send it uncompressed.
+        :param int chunk_size: Send numeric arrays larger than this many bytes in chunks of
+            this size. Defaults to only chunking arrays that do not fit in one message, in
+            chunks of `MAX_CHUNK_SIZE`.
         :raises TimeoutError: if the connection fails.
         :raises BrokenPipeError: if the SSH subprocess fails.
         :raises OSError: if the paramiko client fails.
         :raises MdsException: if the result status indicates an error.
         """
+        with self._stats.operation('put'):
+            args = [path, expr] + list(args)
+            args_format = ['$'] * len(args)
+
+            with self._chunkedVariables() as variables:
+                for i in range(2, len(args)):
+                    array = self._chunkedArray(args[i], chunk_size)
+                    if array is not None:
+                        variable = CHUNKED_VARIABLE.format(next(_chunked_variable_ids))
+                        self._putChunked(variable, array, chunk_size or MAX_CHUNK_SIZE, compression_level, variables)
+                        args[i] = None
+
+                        # The variable holds the flattened array, so it is reshaped as it is written
+                        args_format[i] = variable
+                        if array.ndim > 1:
+                            dims = ','.join(str(dim) for dim in reversed(array.shape))
+                            args_format[i] = f'set_range({dims},{variable})'
+
+                args = [arg for arg, format in zip(args, args_format) if format == '$']
+                status = self.get(f'TreePut({",".join(args_format)})', *args, compression_level=compression_level, idempotent=False).data()
+
+            if STATUS_NOT_OK(status):
+                raise getException(status)
+
+    @staticmethod
+    def _chunkedArray(arg, chunk_size):
+        """
+        Return the numpy array of a `put()` argument if it needs to be sent in chunks, or None.
+        """
 
-        if expr.strip() == '':
-            return Descriptor()
+        if isinstance(arg, DescriptorA):
+            arg = arg.data()
 
-        mget = Message(expr, compression_level=self._compression_level)
-        mget.nargs = 1 + len(args)
+        if not isinstance(arg, numpy.ndarray) or arg.ndim == 0 or arg.dtype.kind not in 'iufc':
+            return None
 
-        self._message_id += 1
-        mget.message_id = self._message_id
+        if chunk_size is None:
+            chunk_size = MAX_MSGLEN - ctypes.sizeof(Message)
 
-        self._send(mget)
+        return arg if arg.nbytes > chunk_size else None
 
-        for i, arg in enumerate(args):
-            marg = Message(arg, compression_level=self._compression_level)
-            marg.nargs = mget.nargs
-            marg.message_id = mget.message_id
-            marg.descriptor_idx = i + 1
+    def _putChunked(self, variable, array, chunk_size, compression_level, variables):
+        """
+        Send a numpy array in chunks of up to `chunk_size` bytes, and join them into a flat
+        array in `variable` on the server. The names of the variables still in use on the
+        server are kept in `variables`.
 
-            self._send(marg)
+        TDI cannot assign to a subscript, and appending each chunk to the array would copy it
+        once per chunk, so each chunk is sent into its own variable, and they are joined at the
+        end, up to `MAX_JOINED_CHUNKS` at a time.
+        """
 
-        manswer, data = self._recv()
+        flat = numpy.ravel(array)
+        step = max(1, chunk_size // flat.itemsize)
+        names = (f'{variable}_{i}' for i in itertools.count())
 
-        if STATUS_NOT_OK(manswer.status):
-            raise getException(manswer.status)
+        # Each request ends with `;1` so that the data is not sent back
+        parts = []
+        for start in range(0, flat.size, step):
+            parts.append(next(names))
+            variables.append(parts[-1])
+            self.get(f'{parts[-1]}=$;1', flat[start : start + step], compression_level=compression_level, idempotent=False)
 
-        return data
+        while True:
+            groups = [ parts[i : i + MAX_JOINED_CHUNKS] for i in range(0, len(parts), MAX_JOINED_CHUNKS) ]
+            parts = [ variable if len(groups) == 1 else next(names) for _ in groups ]
 
-    def getObject(self, expr, *args):
-        """
-        Evaluate a `get()` expression, but the expression will be wrapped in 'SerializeOut'
-        and `deserialize()` will be called on the result. This allows you to retrieve data
-        with CLASS_R or CLASS_APD, that otherwise cannot be retrieved with a regular `get()`.
+            for joined, group in zip(parts, groups):
+                variables.append(joined)
+                freed = ';'.join(f'deallocate("{part}")' for part in group)
+                self.get(f'{joined}=[{",".join(group)}];{freed};1', idempotent=False)
 
-        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
-        :param *args: The optional arguments to be inserted for the placeholders in the
-            expression. All native python/numpy types will be converted to Descriptors.
-        :return: The result of executing the expression.
-        :rtype: :class:`Descriptor`
-        :raises TimeoutError: if the connection fails.
-        :raises BrokenPipeError: if the SSH subprocess fails.
-        :raises OSError: if the paramiko client fails.
-        :raises MdsException: if the result status indicates an error.
-        """
-        return self.get(f'SerializeOut(`({expr};))', *args).deserialize(conn=self)
+                for part in group:
+                    variables.remove(part)
 
-    def put(self, path, expr, *args):
-        """
-        Put an evaluated expression into a node in the last opened MDSplus tree.
+            if len(groups) == 1:
+                return
 
-        :param str path: The path to the node to write data into.
-        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders
-        :param *args: The optional arguments to be inserted for the placeholders in the
-            expression. All native python/numpy types will be converted to Descriptors.
-        :raises TimeoutError: if the connection fails.
-        :raises BrokenPipeError: if the SSH subprocess fails.
-        :raises OSError: if the paramiko client fails.
-        :raises MdsException: if the result status indicates an error.
+    def stats(self):
         """
-        args = [path, expr] + list(args)
-        args_format = ','.join('$' * len(args))
-        status = self.get(f'TreePut({args_format})', *args).data()
+        Return the performance counters of this connection, collected since it was created
+        or since `resetStats()`. These can tell you whether time is being spent waiting on
+        the server, or moving data over the network.
+
+        Example:
+        ```
+        stats = c.stats()
+        print(stats['operations']['get']['p99'], stats['compression_ratio_received'])
+        ```
+
+        :return: A dictionary of,
+            `requests`: The number of requests sent to the server,
+            `reconnects`: The number of times the connection was restored by `reconnect()`,
+            `messages_sent`, `messages_received`: The number of messages, including arguments,
+            `bytes_sent`, `bytes_received`: The number of bytes on the wire,
+            `bytes_sent_uncompressed`, `bytes_received_uncompressed`: The number of bytes
+            before compression,
+            `compression_ratio_sent`, `compression_ratio_received`: The uncompressed size over
+            the size on the wire, or None if nothing has been sent or received,
+            `operations`: `{ NAME: { 'count', 'errors', 'mean', 'min', 'p50', 'p90', 'p99', 'max' } }`
+            with the latencies in seconds of each of `get`, `getObject`, `getInto`, `put`, `tcl`,
+            `GetMany.execute`, `PutMany.execute`, and `Pipeline.execute`.
+        :rtype: dict
+        """
+        return self._stats.snapshot()
 
-        if STATUS_NOT_OK(status):
-            raise getException(status)
+    def resetStats(self):
+        """Reset the performance counters returned by `stats()`."""
+        self._stats.reset()
 
-    def getMany(self):
+    def getMany(self, **kwargs):
         """
         Return a :class:`GetMany` object tied to this connection.
 
-        :return: :class:`GetMany(self)`
+        :param **kwargs: Options for splitting large lists into batches, see :class:`GetMany`.
+        :return: :class:`GetMany(self, **kwargs)`
         :rtype: :class:`GetMany`
         """
 
-        return GetMany(self)
+        return GetMany(self, **kwargs)
+
+    def pipeline(self, max_in_flight: int = 64):
+        """
+        Return a :class:`Pipeline` object tied to this connection.
+
+        :param int max_in_flight: The maximum number of requests to send before waiting
+            for a reply, defaults to 64.
+        :return: :class:`Pipeline(self, max_in_flight)`
+        :rtype: :class:`Pipeline`
+        """
+
+        return Pipeline(self, max_in_flight)
 
-    def putMany(self):
+    def putMany(self, **kwargs):
         """
         Return a :class:`PutMany` object tied to this connection.
 
-        :return: :class:`PutMany(self)`
+        :param **kwargs: Options for splitting large lists into batches, see :class:`PutMany`.
+        :return: :class:`PutMany(self, **kwargs)`
         :rtype: :class:`PutMany`
         """
 
@@ -556,24 +2672,56 @@ class Connection:
             import warnings
             warnings.warn('putMany is likely broken in MDSplus < 7.145.7, use with caution')
 
-        return PutMany(self)
+        return PutMany(self, **kwargs)
 
-    def openTree(self, tree: str, shot: int):
+    def openTree(self, tree: str, shot: int, mode: str = 'NORMAL', path: str = None):
         """
-        Open an MDSplus tree on a remote server.
+        Open an MDSplus tree on a remote server. The tree will be reopened by `reconnect()`.
 
         :param str tree: The tree name to open.
         :param int shot: The shot number to open.
+        :param str mode: The mode to open the tree in, either 'NORMAL', 'READONLY', or 'EDIT',
+            defaults to 'NORMAL'.
+        :param str path: The path to find the tree in, which overrides `{tree}_path` on the
+            server while the tree is being opened.
         :raises TimeoutError: if the network connection fails.
         :raises BrokenPipeError: if the SSH subprocess fails.
         :raises OSError: if the paramiko client fails.
+        :raises TypeError: if the mode is invalid.
         :raises MdsException: if the tree could not be opened.
         """
 
-        status = self.get('TreeOpen($,$)', tree, shot).data()
+        mode = mode.upper()
+        self._openTree(tree, shot, mode, path)
 
-        if STATUS_NOT_OK(status):
-            raise getException(status)
+        # Opening the same tree again makes it the current tree, and resets the default node
+        session = (tree.upper(), shot, mode, path)
+        if session in self._open_trees:
+            self._open_trees.remove(session)
+
+        self._open_trees.append(session)
+        del self._open_trees[ : -MAX_REPLAY_TREES ]
+        self._default_paths.clear()
+
+    def _openTree(self, tree: str, shot: int, mode: str, path: str):
+
+        if mode not in TREE_OPEN_EXPRESSIONS:
+            raise TypeError('Invalid mode specificed, must be "readonly", "normal", or "edit"')
+
+        try:
+            env_name = f'{tree.lower()}_path'
+            if path is not None:
+                old_path = self.get(f'getenv("{env_name}")')
+                self.get(f'setenv("{env_name}={path}")')
+
+            status = self.get(TREE_OPEN_EXPRESSIONS[mode], tree, shot).data()
+
+            if STATUS_NOT_OK(status):
+                raise getException(status)
+
+        finally:
+            if path is not None:
+                self.get(f'setenv("{env_name}={old_path}")')
 
     def closeTree(self, tree: str, shot: int):
         """
@@ -592,6 +2740,11 @@ class Connection:
         if STATUS_NOT_OK(status):
             raise getException(status)
 
+        for session in reversed(self._open_trees):
+            if session[0] == tree.upper() and session[1] == shot:
+                self._open_trees.remove(session)
+                break
+
     def closeAllTrees(self):
         """
         Close all open MDSplus trees.
@@ -604,11 +2757,15 @@ class Connection:
         :raises MdsException: if there was a problem executing the `get()`.
         """
 
+        self._open_trees.clear()
+        self._default_paths.clear()
+
         return self.get("_i=0;WHILE(IAND(TreeClose(),1)) _i++;_i")
 
     def setDefault(self, path: str):
         """
-        Change the current default tree location on the remote server
+        Change the current default tree location on the remote server, this will be repeated
+        by `reconnect()`.
 
         :param str path: The tree node path to be set as the new default location.
         :raises TimeoutError: if the network connection fails.
@@ -618,11 +2775,53 @@ class Connection:
             could not be changed.
         """
 
+        self._setDefault(path)
+
+        # Relative paths depend on the previous default, but absolute paths do not
+        if path.startswith('\\') or '::' in path:
+            self._default_paths.clear()
+
+        self._default_paths.append(path)
+
+    def _setDefault(self, path: str):
+
         status = self.get('TreeSetDefault($)', path).data()
 
         if STATUS_NOT_OK(status):
             raise getException(status)
 
+    def registerHelper(self, name: str, source: str):
+        """
+        Define a helper, such as a `public fun`, on the remote server. Helpers are defined
+        again by `reconnect()`, and registering the same source again does nothing, so this
+        can be called before every use of the helper.
+
+        Example:
+        ```
+        c.registerHelper('Double', 'public fun Double(in _x) { return(_x * 2); }')
+        c.get('Double(21)')
+        ```
+
+        :param str name: The name of the helper, registering a new source for the same name
+            will replace it.
+        :param str source: The TDI expression that defines the helper.
+        :raises TimeoutError: if the network connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises MdsException: if the helper could not be defined.
+        """
+
+        if self._helpers.get(name) == source:
+            return
+
+        self._defineHelper(source)
+        self._helpers[name] = source
+
+    def _defineHelper(self, source: str):
+
+        # The value of the definition itself might not be something we can receive
+        self.get(f'{source.rstrip().rstrip(";")};1')
+
     def tcl(self, command: str):
         """
         Execute a mdstcl command and return the result.
@@ -635,10 +2834,11 @@ class Connection:
         :raises OSError: if the paramiko client fails.
         :raises MdsException: if there was a problem executing the command.
         """
-        result = self.get('Tcl($,_res);_res', command)
-        if result is None:
-            return ''
-        return result.data()
+        with self._stats.operation('tcl'):
+            result = self.get('Tcl($,_res);_res', command, idempotent=False)
+            if result is None:
+                return ''
+            return result.data()
     
     def getServerVersion(self):
         if self._server_version is None:
@@ -748,14 +2948,57 @@ class GetMany:
     y = result['y']
     x = result['x']
     ```
+
+    Large lists are split into batches, each sent as its own request, so that no request is
+    larger than `max_request_size`, and no reply is estimated to be larger than `max_reply_size`.
+    The size of a reply is only known if it is given to `append()`, or if `probe_sizes` is True,
+    in which case the size of each result is evaluated on the server first. This evaluates
+    every expression twice, so only use it with expressions that can safely be repeated.
+    The results of all of the batches are merged into one Dictionary.
+
+    The batches are sent one after another on our connection with `BATCH_DISPATCH_SEQUENTIAL`,
+    or with the next one sent while the reply to the last is received with
+    `BATCH_DISPATCH_PIPELINED`. With `BATCH_DISPATCH_POOL`, they are sent in parallel on
+    connections leased from `pool`, which open the same trees as our connection, and close them
+    again before they are returned to the pool. TDI variables only last for one batch, so an
+    expression that uses one is kept in the same batch as the expression that assigns it. The
+    leased connections are separate sessions, so variables from outside of the list are not
+    available to them.
+
+    :param Connection connection: The connection to evaluate the expressions on.
+    :param int max_request_size: The largest serialized list of expressions to send in one
+        request, defaults to `MAX_BATCH_SIZE`.
+    :param int max_reply_size: The largest estimated reply to ask for in one request, or None
+        for no limit, defaults to `MAX_BATCH_SIZE`.
+    :param int max_queries: The most expressions to send in one request, or None for no limit,
+        defaults to None.
+    :param bool probe_sizes: Evaluate the size of the results without a size given to `append()`
+        before splitting the list, defaults to False.
+    :param str dispatch: How to send the batches, one of the `BATCH_DISPATCH_*` modes, defaults
+        to `BATCH_DISPATCH_SEQUENTIAL`.
+    :param ConnectionPool pool: The pool to lease connections from for `BATCH_DISPATCH_POOL`.
     """
 
-    def __init__(self, connection: Connection):
+    def __init__(self,
+        connection: Connection,
+        max_request_size: int = MAX_BATCH_SIZE,
+        max_reply_size: int = MAX_BATCH_SIZE,
+        max_queries: int = None,
+        probe_sizes: bool = False,
+        dispatch: str = BATCH_DISPATCH_SEQUENTIAL,
+        pool = None,
+    ):
         self._connection = connection
         self._queries = List()
+        self._parameters = {}
+        self._reply_sizes = {}
+        self._probe_sizes = probe_sizes
+        self._prepared = None
         self._result = None
 
-    def append(self, name, exp, *args):
+        self._batches = _Batches(connection, max_request_size, max_reply_size, max_queries, dispatch, pool)
+
+    def append(self, name, exp, *args, reply_size: int = None):
         """
         Add a named expression to the list to be evaluated by `execute()`.
 
@@ -764,12 +3007,30 @@ class GetMany:
         :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders.
         :param *args: The optional arguments to be inserted for the placeholders in the
             expression. All native python/numpy types will be converted to Descriptors.
+            A :class:`Parameter` is replaced with a value passed to `execute()`.
+        :param int reply_size: The expected size of the result in bytes, used to split large
+            lists into batches, defaults to None.
         """
+        args = list(args)
+
+        if reply_size is not None:
+            self._reply_sizes[name] = reply_size
+
+        parameters = {}
+        for i, arg in enumerate(args):
+            if isinstance(arg, Parameter):
+                parameters[i] = arg.name
+                args[i] = Descriptor()
+
+        if len(parameters) > 0:
+            self._parameters[name] = parameters
+
         self._queries.append(Dictionary({
             'name': name,
             'exp': exp,
-            'args': list(args),
+            'args': args,
         }))
+        self._prepared = None
 
     def remove(self, name):
         """
@@ -780,13 +3041,106 @@ class GetMany:
         for query in self._queries:
             if query['name'] == name:
                 self._queries.remove(query)
+                self._parameters.pop(name, None)
+                self._reply_sizes.pop(name, None)
+                self._prepared = None
                 break
 
-    def execute(self):
+    def prepare(self):
+        """
+        Serialize the list of expressions once, so that executing it again only has to
+        serialize the values of its :class:`Parameter` arguments. This saves rebuilding the
+        same list for every shot of a scan. Calling `append()` or `remove()` afterwards
+        undoes this, and changes made to the arguments themselves are not seen.
+
+        Example:
+        ```
+        gm = c.getMany()
+        gm.append('_open', 'TreeOpen($,$)', Parameter('tree'), Parameter('shot'))
+        gm.append('y', '\\IP')
+        gm.prepare()
+
+        for shot in shots:
+            result = gm.execute(tree='cmod', shot=shot)
+        ```
+
+        :return: This GetMany, to allow chaining.
+        :rtype: :class:`GetMany`
+        """
+        self._prepared = _PreparedQueries(self._queries, self._parameters)
+        return self
+
+    def _pack(self, parameters: dict):
+        if self._prepared is not None:
+            return self._prepared.pack(parameters)
+
+        if len(self._parameters) > 0 or len(parameters) > 0:
+            return _PreparedQueries(self._queries, self._parameters).pack(parameters)
+
+        return [ bytes(query.pack()) for query in self._queries ]
+
+    def _serialize(self, parameters: dict):
+        return UInt8Array(_pack_apd(bytes(self._queries._dsc), self._pack(parameters)))
+
+    def _split(self, parameters: dict):
+        """
+        Serialize the queries into as few batches as fit within the limits.
+        """
+
+        reply_sizes = None
+        if self._probe_sizes or len(self._reply_sizes) > 0:
+            reply_sizes = self._estimateReplySizes(parameters)
+
+        expressions = [ query['exp'].data() for query in self._queries ]
+        return self._batches.split(bytes(self._queries._dsc), self._pack(parameters), reply_sizes, expressions)
+
+    def _estimateReplySizes(self, parameters: dict):
+        """
+        Return the size of the result of each query, either from `append()`, or by evaluating
+        the size of each result on the server if `probe_sizes` is True, otherwise 0.
+        """
+
+        sizes = []
+        indices = {}
+
+        probes = List()
+        for i, query in enumerate(self._queries):
+            name = query['name'].data()
+            sizes.append(self._reply_sizes.get(name, 0))
+
+            if name in self._reply_sizes or not self._probe_sizes:
+                continue
+
+            args = list(query['args'])
+            for index, parameter in self._parameters.get(name, {}).items():
+                args[index] = parameters.get(parameter)
+
+            indices[name] = i
+            probes.append(Dictionary({
+                'name': name,
+                'exp': f'size(SerializeOut(`({query["exp"].data()};)))',
+                'args': args,
+            }))
+
+        if len(probes) > 0:
+            result = self._connection.get('GetManyExecute($)', probes.serialize())
+            if isinstance(result, String):
+                raise MdsException(f'GetMany Error: {result.data()}')
+
+            for name, probe in result.deserialize().items():
+                if 'value' in probe:
+                    sizes[indices[name.data()]] = int(probe['value'].data())
+
+        return sizes
+
+    def execute(self, deadline: float = None, **parameters):
         """
         Execute all expressions in the list by calling `GetManyExecute()` on the remote
         server, and passing the serialized list as data.
 
+        :param float deadline: The number of seconds the whole request may take, see
+            `Connection.get()`.
+        :param **parameters: The values of the :class:`Parameter` arguments, by name.
         :return: The Dictionary of results from the expressions. In the format of,
             `{ NAME: { 'value': DATA } }` if the expression succeeded, or
             `{ NAME: { 'error': ERROR_STRING } }` if there was an error.
@@ -794,15 +3148,130 @@ class GetMany:
         :raises TimeoutError: if the network connection fails.
         :raises BrokenPipeError: if the SSH subprocess fails.
         :raises OSError: if the paramiko client fails.
-        :raises MdsException: if the result of GetManyExecute() is an error string, or
-            if `get()` encounters an error.
+        :raises DeadlineExceeded: if the deadline passes before the reply is received.
+        :raises RequestCancelled: if the request is cancelled with `Connection.cancel()`.
+        :raises MdsException: if the result of GetManyExecute() is an error string, if
+            `get()` encounters an error, or if the parameters do not match.
+        """
+        with self._connection._stats.operation('GetMany.execute'):
+            results = self._batches.execute('GetManyExecute($)', self._split(parameters), deadline=deadline)
+            return self._merge(results)
+
+    def execute_iter(self, deadline: float = None, **parameters):
+        """
+        Like `execute()`, but yield the name and result of each expression as soon as it has
+        been received, instead of waiting for the whole reply. This lets you start working on
+        the first results of a large GetMany while the rest are still arriving. The results are
+        also available from `get()` as soon as they have been yielded.
+
+        The connection cannot be used for anything else until the iteration is finished, and any
+        other threads will wait for it. Stopping early throws away the rest of the reply. If the
+        connection has interceptors, or the reply is received by another thread, the whole reply
+        is received before the first result is yielded. Large lists are split into batches like
+        `execute()`, but the batches are always received one after another.
+
+        Example:
+        ```
+        for name, result in gm.execute_iter():
+            process(name, gm.get(name))
+        ```
+
+        :param float deadline: The number of seconds the whole request may take, see
+            `Connection.get()`.
+        :param **parameters: The values of the :class:`Parameter` arguments, by name.
+        :return: An iterator of the name and result of each expression, in the format of the
+            items of the Dictionary returned by `execute()`.
+        :rtype: iterator of tuple(:class:`String`, :class:`Dictionary`)
+        :raises TimeoutError: if the network connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before the reply is received.
+        :raises RequestCancelled: if the request is cancelled with `Connection.cancel()`.
+        :raises MdsException: if the result of GetManyExecute() is an error string, or if
+            the parameters do not match.
+        """
+
+        # Interceptors only see whole results
+        if len(self._connection._interceptors) > 0:
+            yield from self.execute(deadline=deadline, **parameters).items()
+            return
+
+        batches = self._split(parameters)
+
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+
+        self._result = Dictionary()
+
+        for batch in batches:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            manswer, data = self._connection._openStream('GetManyExecute($)', batch, deadline=remaining)
+
+            if not isinstance(data, _ReplyStream):
+                if STATUS_NOT_OK(manswer.status):
+                    raise getException(manswer.status)
+
+                for name, result in self._unpack(data).items():
+                    self._result[name] = result
+                    yield name, result
+
+                continue
+
+            results = _StreamedResults()
+            with data as stream:
+                receiving = True
+                while receiving:
+                    receiving = stream.receive()
+                    for name, result in results.parse(stream.buffer, stream.received):
+                        self._result[name] = result
+                        yield name, result
+
+    def submit(self, **parameters):
+        """
+        Like `execute()`, but return a future for the result instead of waiting for it.
+        This requires the connection to be created with `thread_safe=True`, see
+        `Connection.submit()`. Large lists are split into batches like `execute()`, which
+        are all sent at once.
+
+        :param **parameters: The values of the :class:`Parameter` arguments, by name.
+        :return: A future that resolves to the Dictionary of results from the expressions,
+            see `execute()`.
+        :rtype: :class:`concurrent.futures.Future`
+        :raises MdsException: if the connection is not thread safe, or if the parameters
+            do not match.
+        """
+
+        batches = self._split(parameters)
+        futures = [ self._connection._submit('GetManyExecute($)', batch) for batch in batches[ : -1 ] ]
+
+        # The replies are resolved in order, so the other batches are done by the time the last one is
+        def resolve(result):
+            return self._merge([ future.result() for future in futures ] + [ result ])
+
+        return self._connection._submit('GetManyExecute($)', batches[-1], resolve=resolve)
+
+    def _unpack(self, result):
+
+        if isinstance(result, String):
+            raise MdsException(f'GetMany Error: {result.data()}')
+
+        # Each result is only unpacked when it is first accessed
+        return result.deserialize(lazy=True)
+
+    def _merge(self, results):
         """
-        result = self._connection.get('GetManyExecute($)', self._queries.serialize())
+        Unpack the results of each batch, and merge them into one Dictionary.
+        """
+
+        if len(results) == 1:
+            self._result = self._unpack(results[0])
+            return self._result
 
-        if isinstance(self._result, String):
-            raise MdsException(f'GetMany Error: {self._result.data()}')
+        merged = Dictionary()
+        for result in results:
+            merged.update(self._unpack(result))
 
-        self._result = result.deserialize()
+        self._result = merged
         return self._result
 
     def get(self, name):
@@ -853,14 +3322,34 @@ class PutMany:
     if result['a'] != 'Success':
         pass
     ```
+
+    Like :class:`GetMany`, large lists are split into batches of up to `max_request_size`,
+    which are sent with one of the `BATCH_DISPATCH_*` modes, and their results are merged.
+
+    :param Connection connection: The connection to store the data with.
+    :param int max_request_size: The largest serialized list of nodes and expressions to send
+        in one request, defaults to `MAX_BATCH_SIZE`.
+    :param int max_queries: The most nodes to send in one request, or None for no limit,
+        defaults to None.
+    :param str dispatch: How to send the batches, one of the `BATCH_DISPATCH_*` modes, defaults
+        to `BATCH_DISPATCH_SEQUENTIAL`.
+    :param ConnectionPool pool: The pool to lease connections from for `BATCH_DISPATCH_POOL`.
     """
 
 
-    def __init__(self, connection: Connection):
+    def __init__(self,
+        connection: Connection,
+        max_request_size: int = MAX_BATCH_SIZE,
+        max_queries: int = None,
+        dispatch: str = BATCH_DISPATCH_SEQUENTIAL,
+        pool = None,
+    ):
         self._connection = connection
         self._queries = List()
         self._result = Dictionary()
 
+        self._batches = _Batches(connection, max_request_size, None, max_queries, dispatch, pool)
+
     def append(self, node, exp, *args):
         """
         Add a node/expression to the list to be evaluated and inserted by `execute()`
@@ -902,12 +3391,32 @@ class PutMany:
         :raises MdsException: if the result of PutManyExecute() is an error string, or
             if `get()` encounters an error.
         """
-        result = self._connection.get('PutManyExecute($)', self._queries.serialize())
+        with self._connection._stats.operation('PutMany.execute'):
+            results = self._batches.execute('PutManyExecute($)', self._split(), idempotent=False)
+            return self._merge(results)
+
+    def _split(self):
+        """
+        Serialize the queries into as few batches as fit within the limits.
+        """
+
+        expressions = [ query['exp'].data() for query in self._queries ]
+        items = [ bytes(query.pack()) for query in self._queries ]
+        return self._batches.split(bytes(self._queries._dsc), items, expressions=expressions)
+
+    def _merge(self, results):
+        """
+        Check the result of each batch for an error, and merge them into one Dictionary.
+        """
+
+        for result in results:
+            if isinstance(result, String):
+                raise MDSplusException(f'PutMany Error: {result.data()}')
 
-        if isinstance(self._result, String):
-            raise MDSplusException(f'PutMany Error: {self._result.data()}')
+        self._result = results[0].deserialize(conn=self)
+        for result in results[ 1 : ]:
+            self._result.update(result.deserialize(conn=self))
 
-        self._result = result.deserialize(conn=self)
         return self._result
 
     def checkStatus(self, node):
@@ -930,4 +3439,120 @@ class PutMany:
         if self.result[node] != "Success":
             raise getExceptionFromError(self._result[node])
 
-        return self.result[node]
\ No newline at end of file
+        return self.result[node]
+
+class Pipeline:
+    """
+    Allows you to send many expressions back-to-back, without waiting a full round trip
+    for each reply. Unlike :class:`GetMany`, each expression is sent as its own request,
+    so this works with any server and any expression that `get()` accepts.
+
+    This must be constructed with a reference to a :class:`Connection`, this be done with
+    `connection.pipeline()`. You can then call `append()` to add expressions to the list.
+    Once the list is complete, you must use `execute()` to send the expressions to the
+    server and retrieve the results. The replies are matched to their requests using the
+    `message_id` of each message. This will return a dictionary of the results, or you
+    can use `get()` to access the expressions by name.
+
+    At most `max_in_flight` requests are sent before waiting for a reply, so that neither
+    side can fill up its network buffers and stall.
+
+    Example:
+    ```
+    p = c.pipeline()
+    for shot in shots:
+        p.append(shot, 'getnci($, "LENGTH")', shot)
+    result = p.execute()
+
+    length = p.get(shots[0])
+    # or
+    length = result[shots[0]]
+    ```
+    """
+
+    def __init__(self, connection: Connection, max_in_flight: int = 64):
+        if not (0 < max_in_flight <= MAX_MESSAGE_ID):
+            raise MdsException(f'max_in_flight must be between 1 and {MAX_MESSAGE_ID}')
+
+        self._connection = connection
+        self._max_in_flight = max_in_flight
+        self._queries = []
+        self._result = None
+
+    def append(self, name, exp, *args):
+        """
+        Add a named expression to the list to be evaluated by `execute()`.
+
+        :param name: The name of the expression to evaluate. This will be how you
+            retrieve the data from either the result dictionary or using `get()`.
+        :param str expr: The TDI expression to be evaluated, possibly with `$` placeholders.
+        :param *args: The optional arguments to be inserted for the placeholders in the
+            expression. All native python/numpy types will be converted to Descriptors.
+        """
+        self._queries.append({
+            'name': name,
+            'exp': exp,
+            'args': list(args),
+        })
+
+    def remove(self, name):
+        """
+        Remove a named expression from the list
+
+        :param name: The name of the expression to remove
+        """
+        for query in self._queries:
+            if query['name'] == name:
+                self._queries.remove(query)
+                break
+
+    def execute(self, deadline: float = None):
+        """
+        Send all expressions in the list, and then collect the replies as they arrive. Each
+        request goes through the same interceptors, `auto_reconnect`, and `cancel()` as `get()`.
+
+        :param float deadline: The number of seconds all of the requests may take, see `get()`.
+        :return: The dictionary of results from the expressions. In the format of,
+            `{ NAME: DATA }` if the expression succeeded, or `{ NAME: EXCEPTION }` with the
+            exception `get()` would have raised if there was an error.
+        :rtype: dict
+        :raises TimeoutError: if the network connection fails.
+        :raises BrokenPipeError: if the SSH subprocess fails.
+        :raises OSError: if the paramiko client fails.
+        :raises DeadlineExceeded: if the deadline passes before all of the replies are received.
+        :raises RequestCancelled: if the requests are cancelled with `cancel()`.
+        :raises MdsException: if a reply could not be matched to its request.
+        """
+
+        with self._connection._stats.operation('Pipeline.execute'), self._connection._deadline(deadline):
+            self._result = { query['name']: Descriptor() for query in self._queries }
+
+            queries = [ query for query in self._queries if query['exp'].strip() != '' ]
+            results = self._connection._pipeline([ (query['exp'], query['args']) for query in queries ], self._max_in_flight)
+
+            for query, result in zip(queries, results):
+                self._result[query['name']] = result
+
+            return self._result
+
+    def get(self, name):
+        """
+        Get the result of a named expression, or raise an error if the evaluation failed.
+
+        :param name: The name of the expression
+        :return: The resulting data from the expression
+        :rtype: :class:`Descriptor`
+        :raises MdsException: if `execute()` has not been called, or if the evaluation of
+            the expression on the server failed.
+        """
+        if self._result is None:
+            raise MdsException('Pipeline has not been executed, call execute() first.')
+
+        if name not in self._result:
+            return None
+
+        result = self._result[name]
+        if isinstance(result, Descriptor):
+            return result
+
+        raise result
@@ -26,6 +26,8 @@
 import ctypes
 import numpy
 
+from collections.abc import MutableMapping
+
 from .exceptions import *
 from .internals.dtypedef import *
 from .internals.classdef import *
@@ -328,21 +330,27 @@ class Descriptor:
         return bytearray()
     
     @staticmethod
-    def unpack(buffer, conn=None):
+    def unpack(buffer, conn=None, lazy=False):
         """
         Unpack the given buffer and construct the corresponding :class:`Descriptor` subclass. This requires a
         buffer with a `mdsdsc_t` header.
 
+        The buffer is read in place and is never modified. With `lazy=True`, each :class:`Dictionary`
+        only indexes its keys, and a value is unpacked the first time it is accessed. The buffer must then
+        be left unchanged for as long as the :class:`Dictionary` is in use.
+
         :param buffer: The buffer to unpack.
         :type buffer: bytes, bytearray or any type that implements the buffer protocol.
         :param Connection conn: The connection, used to gather missing metadata, such as the FULLPATH
             of a given NID, defaults to None
+        :param bool lazy: Unpack the values of each :class:`Dictionary` on first access, defaults to False
         :return: An instance of a :class:`Descriptor` subclass containing the data.
         :rtype: A subclass of :class:`Descriptor`
         :raises MdsException: if there are problems unpacking the data.
         """
 
-        buffer = bytearray(buffer)
+        # Slicing a memoryview does not copy, so each nested descriptor is read straight from the buffer
+        buffer = memoryview(buffer).cast('B')
         
         # TODO: Improve?
         dtype_id = buffer[2]
@@ -358,7 +366,7 @@ class Descriptor:
 
         if issubclass(dtype_class, DescriptorS):
 
-            dsc = mdsdsc_s_t.from_buffer(buffer)
+            dsc = mdsdsc_s_t.from_buffer_copy(buffer)
 
             if dsc.length == 0:
                 dsc.length = get_dtype_size(dsc.dtype_id)
@@ -373,16 +381,16 @@ class Descriptor:
                 data = numpy.frombuffer(data_buffer, dtype=NUMPY_DTYPE_MAP[dtype_id], count=1)[0]
             
             elif dsc.dtype_id in STRING_DTYPE_LIST:
-                data = data_buffer.decode('ascii')
+                data = bytes(data_buffer).decode('ascii')
             
             elif dsc.dtype_id in [ DTYPE_F, DTYPE_D, DTYPE_G ]:
-                data = convert_float(dsc.dtype_id, data_buffer)
+                data = convert_float(dsc.dtype_id, bytearray(data_buffer))
 
             return dtype_class(data, conn=conn)
 
         elif issubclass(dtype_class, DescriptorA):
 
-            dsc = mdsdsc_a_t.from_buffer(buffer)
+            dsc = mdsdsc_a_t.from_buffer_copy(buffer)
 
             if dsc.length == 0:
                 dsc.length = get_dtype_size(dsc.dtype_id)
@@ -431,7 +439,7 @@ class Descriptor:
                 data = numpy.frombuffer(data_buffer, dtype=f'|S{dsc.length}').astype(str)
 
             elif dsc.dtype_id in [ DTYPE_F, DTYPE_D, DTYPE_G ]:
-                data = convert_float_array(dsc.dtype_id, data_buffer)
+                data = convert_float_array(dsc.dtype_id, bytearray(data_buffer))
 
             data = data.reshape(shape, order=order)
                 
@@ -439,7 +447,7 @@ class Descriptor:
         
         elif issubclass(dtype_class, DescriptorAPD):
 
-            dsc = mdsdsc_a_t.from_buffer(buffer)
+            dsc = mdsdsc_a_t.from_buffer_copy(buffer)
 
             if dsc.offset == 0:
                 dsc.offset = ctypes.sizeof(dsc)
@@ -450,6 +458,12 @@ class Descriptor:
             offsets_buffer = buffer[ dsc.offset : dsc.offset + dsc.arsize ]
             offsets = numpy.frombuffer(offsets_buffer, dtype=numpy.uint32)
 
+            if lazy and issubclass(dtype_class, Dictionary):
+                result = dtype_class(conn=conn)
+                result._data = _UnpackedItems(buffer, offsets, conn=conn)
+                result._dsc.arsize = dsc.arsize
+                return result
+
             descs = []
             for offset in offsets:
                 if offset == 0:
@@ -457,13 +471,13 @@ class Descriptor:
                     continue
 
                 data_buffer = buffer[offset : ]
-                descs.append(Descriptor.unpack(data_buffer, conn=conn))
+                descs.append(Descriptor.unpack(data_buffer, conn=conn, lazy=lazy))
 
             return dtype_class(descs=descs, conn=conn)
             
         elif issubclass(dtype_class, DescriptorR):
 
-            dsc = mdsdsc_r_t.from_buffer(buffer)
+            dsc = mdsdsc_r_t.from_buffer_copy(buffer)
 
             offsets_buffer = buffer[ ctypes.sizeof(dsc) : ]
             offsets = numpy.frombuffer(offsets_buffer, dtype=numpy.uint32, count=dsc.ndesc)
@@ -482,7 +496,7 @@ class Descriptor:
                     continue
 
                 dscptr_buffer = buffer[ offsets[i] : ]
-                arguments.append(Descriptor.unpack(dscptr_buffer, conn=conn))
+                arguments.append(Descriptor.unpack(dscptr_buffer, conn=conn, lazy=lazy))
 
             return dtype_class(*arguments, conn=conn)
 
@@ -974,8 +988,41 @@ class DescriptorA(Descriptor):
 
         return buffer
         
-    def pack_data(self):
+    def pack_data(self, copy=True):
+        """
+        Pack just the data into a bytearray.
+
+        :param bool copy: If False, return a read-only memoryview of the data instead of a
+            copy when it is contiguous. The view is only valid while the data is unchanged.
+        :return: The serialized data.
+        :rtype: `bytearray` or `memoryview`
+        """
+
+        if not copy and self._data.flags.c_contiguous:
+            view = memoryview(self._data.reshape(-1).view(numpy.uint8))
+            return view.toreadonly()
+
         return bytearray(self._data.tobytes())
+
+    @classmethod
+    def from_numpy(cls, data, conn=None):
+        """
+        Construct a numeric array type around an existing numpy array without copying it,
+        as opposed to the regular constructor which always makes a copy. The array must
+        already have the numpy dtype of this class, and changes to it will be visible in
+        the :class:`Descriptor`.
+
+        :param numpy.ndarray data: The array to use as the data.
+        :return: An instance of this class sharing memory with `data`.
+        :rtype: A subclass of :class:`DescriptorA`
+        """
+
+        instance = cls(conn=conn)
+        if data.dtype != instance._data.dtype:
+            raise MdsException(f'Unable to use a numpy array of {data.dtype} for {cls.__name__}')
+
+        DescriptorA.__init__(instance, data=data, dsc=instance._dsc, conn=conn)
+        return instance
     
     @staticmethod
     def unpack_data(dtype_id, buffer, dims=[], length=0):
@@ -985,6 +1032,12 @@ class DescriptorA(Descriptor):
             numpy_dtype = NUMPY_DTYPE_MAP[dtype_id]
             data = numpy.frombuffer(buffer, dtype=numpy_dtype)
 
+            if len(dims) > 0:
+                data = data.reshape(dims[::-1])
+
+            # The buffer was allocated just for this data, so there is no need to copy it again
+            return dtype_class.from_numpy(data)
+
         elif dtype_id == DTYPE_T:
             data = numpy.frombuffer(buffer, dtype=f'|S{length}').astype(str)
 
@@ -1086,8 +1139,8 @@ class UInt8Array(DescriptorA, Numeric):
             return f'Byte_Unsigned([ ... ])'
         return f'Byte_Unsigned({repr(self._data.tolist())})'
 
-    def deserialize(self, conn=None):
-        return Descriptor.unpack(bytearray(self.data().tobytes()), conn=conn)
+    def deserialize(self, conn=None, lazy=False):
+        return Descriptor.unpack(numpy.ascontiguousarray(self.data()), conn=conn, lazy=lazy)
 
 class UInt16Array(DescriptorA, Numeric):
     def __init__(self, data=[], conn=None):
@@ -1177,8 +1230,8 @@ class Int8Array(DescriptorA, Numeric):
             return f'Byte([ ... ])'
         return f'Byte({repr(self._data.tolist())})'
 
-    def deserialize(self, conn=None):
-        return Descriptor.unpack(bytearray(self.data().tobytes()), conn=conn)
+    def deserialize(self, conn=None, lazy=False):
+        return Descriptor.unpack(numpy.ascontiguousarray(self.data()), conn=conn, lazy=lazy)
 
 class Int16Array(DescriptorA, Numeric):
     def __init__(self, data=[], conn=None):
@@ -1472,6 +1525,75 @@ class Tuple(DescriptorAPD):
     def data(self):
         return tuple([ data.data() for data in self._data ])
 
+class _UnpackedItems(MutableMapping):
+    """
+    The items of a serialized :class:`Dictionary`. The keys are unpacked up front, and each value is
+    unpacked from the buffer the first time it is accessed.
+    """
+
+    def __init__(self, buffer=None, offsets=(), conn=None):
+        self._conn = conn
+
+        # key -> the buffer starting at the packed value, or None if it is missing
+        self._packed = {}
+
+        # key -> unpacked value
+        self._values = {}
+
+        for i in range(0, len(offsets) - 1, 2):
+            if offsets[i] == 0:
+                key = Descriptor(conn=conn)
+            else:
+                key = Descriptor.unpack(buffer[offsets[i] : ], conn=conn)
+
+            self._packed[key] = buffer[offsets[i + 1] : ] if offsets[i + 1] != 0 else None
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            packed = self._packed[key]
+            if packed is None:
+                value = Descriptor(conn=self._conn)
+            else:
+                value = Descriptor.unpack(packed, conn=self._conn, lazy=True)
+
+            self._values[key] = value
+
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._packed.setdefault(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._packed[key]
+        self._values.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._packed
+
+    def __iter__(self):
+        return iter(self._packed)
+
+    def __len__(self):
+        return len(self._packed)
+
+    def merge(self, other):
+        """
+        Add the items of another mapping, without unpacking the values it has not unpacked yet.
+        """
+
+        if not isinstance(other, _UnpackedItems):
+            for key, value in other.items():
+                self[key] = value
+            return
+
+        for key, packed in other._packed.items():
+            self._packed[key] = packed
+            if key in other._values:
+                self._values[key] = other._values[key]
+            else:
+                self._values.pop(key, None)
+
 class Dictionary(DescriptorAPD):
     
     # dict or key, value, ...repeat
@@ -1547,6 +1669,29 @@ class Dictionary(DescriptorAPD):
     def get(self, key, default):
         return self._data.get(key, default)
 
+    def update(self, other):
+        """
+        Add the items of another :class:`Dictionary` or dict, replacing the values of any keys
+        that are already present. Values that have not been unpacked yet, see `Descriptor.unpack()`,
+        are added without unpacking them.
+
+        :param other: The items to add.
+        :type other: :class:`Dictionary` or dict
+        """
+
+        if isinstance(other, Dictionary) and isinstance(other._data, _UnpackedItems):
+            if not isinstance(self._data, _UnpackedItems):
+                items = _UnpackedItems(conn=self._conn)
+                items.merge(self._data)
+                self._data = items
+
+            self._data.merge(other._data)
+            self._dsc.arsize = (len(self._data) * 2) * self._dsc.length
+
+        else:
+            for key, value in other.items():
+                self[key] = value
+
     def data(self):
         return dict({ key.data(): value.data() for key, value in self._data.items() })
     
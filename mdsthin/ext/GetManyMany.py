@@ -3,7 +3,8 @@ import time
 import queue
 import threading
 
-from ..connection import Connection
+from ..connection import Connection, Parameter
+from ..pool import ConnectionPool
 from ..exceptions import getExceptionFromError
 
 class GetManyMany:
@@ -43,7 +44,25 @@ class GetManyMany:
 
         def run(self):
 
-            c = Connection(self._gmm._connection_url, **self._gmm._connection_kwargs)
+            if self._gmm._pool is not None:
+                with self._gmm._pool.connection() as c:
+                    self.process(c)
+
+            else:
+                c = Connection(self._gmm._connection_url, **self._gmm._connection_kwargs)
+                self.process(c)
+                c.disconnect()
+
+        def process(self, c):
+
+            # The queries are the same for every shot, so only the tree and shot need to be serialized each time
+            gm = c.getMany()
+            gm.append('_gmm_open', 'TreeOpen($,$)', Parameter('tree'), Parameter('shot'))
+
+            for query in self._gmm._queries:
+                gm.append(query['name'], query['exp'], *query['args'])
+
+            gm.prepare()
 
             while True:
                 try:
@@ -51,20 +70,16 @@ class GetManyMany:
                 except queue.Empty:
                     break
 
-                gm = c.getMany()
-                gm.append('_gmm_open', 'TreeOpen($,$)', tree, shot)
-
-                for query in self._gmm._queries:
-                    gm.append(query['name'], query['exp'], *query['args'])
-
-                result = gm.execute()
+                result = gm.execute(tree=tree, shot=shot)
                 
                 self._gmm._results.put(GetManyMany.Result(tree, shot, result))
 
-            c.disconnect()
+    def __init__(self, connection_url: str = None, num_workers: int = 8, worker_delay: float = 0.0, pool: ConnectionPool = None, **connection_kwargs):
 
-    def __init__(self, connection_url: str, num_workers: int = 8, worker_delay: float = 0.0, **connection_kwargs):
-        
+        if connection_url is None and pool is None:
+            raise Exception('GetManyMany requires either a connection_url or a pool')
+
+        self._pool = pool
         self._connection_url = connection_url
         self._connection_kwargs = connection_kwargs
         self._num_workers = num_workers
@@ -24,8 +24,10 @@
 #
 
 import os
+import contextlib
 
 from ..connection import *
+from ..pool import *
 from ..internals.usagedef import *
 
 # TODO: Improve
@@ -39,15 +41,71 @@ def getDefaultConnection():
     return _default_connection
 
 def setDefaultConnection(conn):
+    """
+    Set the connection used by :class:`Tree` when one is not passed in. This can also be a
+    :class:`ConnectionPool`, in which case each :class:`Tree` leases its own connection.
+    """
     global _default_connection
     _default_connection = conn
 
+# Helper functions defined on the server with `Connection.registerHelper()`
+_TREE_FIND_NODE_WILD_RELATIVE = (
+    'public fun TreeFindNodeWildRelative(in _path, in _startnid, optional _usagemask) {' +
+        '_ctx=0q;' +
+        '_nid=0;' +
+        '_nids=[];' +
+        'if (!present(_usagemask)) _usagemask = -1;' +
+        'while (TreeShr->TreeFindNodeWildRelative(_path, val(_startnid), ref(_nid), ref(_ctx), val(_usagemask)) & 1) {' +
+            'if (size(_nids) > 0) {' +
+                '_nids = [_nids, _nid];' +
+            '} else {' +
+                '_nids = [_nid];' +
+            '}' +
+        '};' +
+        'TreeShr->TreeFindNodeEnd(_ctx);' +
+        'return(_nids);' +
+    '}'
+)
+
+_TREE_DECOMPILE_RECORD = (
+    'public fun TreeDecompileRecord(in _nid) {' +
+        '_out=1;' +
+        '_status=TreeShr->TreeGetRecord(val(_nid), xd(_out));' +
+        'return(execute("decompile(`_out)"));' +
+    '}'
+)
+
+_TREE_GET_RECORD_SERIALIZED = (
+    'public fun TreeGetRecordSerialized(in _nid) {' +
+        '_out=1;' +
+        '_status=TreeShr->TreeGetRecord(val(_nid), xd(_out));' +
+        'return(execute("SerializeOut(`_out)"));' +
+    '}'
+)
+
+@contextlib.contextmanager
+def _borrowConnection(conn):
+    if isinstance(conn, ConnectionPool):
+        with conn.connection() as c:
+            yield c
+    else:
+        yield conn
+
 class _NCI:
 
     # Must be implemented
     def _getNci(self, property):
         raise Exception('_getNci must be implemented to subclass _NCI')
 
+    @property
+    def _conn(self) -> Connection:
+        # Look the connection up through the tree, so that nodes stop using a leased
+        # connection once the tree has returned it to the pool
+        conn = self._tree._connection
+        if conn is None:
+            raise MdsException('Unable to use a node of an mdsthin.Tree that has been closed.')
+        return conn
+
     # TODO: _setNci
 
     ###
@@ -501,7 +559,6 @@ class _NCI:
 # TODO:
 class TreeNodeArray(_NCI):
     def __init__(self, nids, tree):
-        self._conn = tree._conn
         self._tree = tree
 
         # TODO: Improve?
@@ -548,7 +605,6 @@ class TreeNodeArray(_NCI):
 class TreeNode(_NCI):
 
     def __init__(self, nid, tree):
-        self._conn: Connection = tree._conn
         self._tree: Tree = tree
 
         if type(nid) is str:
@@ -712,26 +768,8 @@ class TreeNode(_NCI):
             except KeyError:
                 raise Exception(f'Unknown usage {u}')
             
-        # TODO: Implement TreeFindNodeWildRelative as a .fun
-        nids = self._conn.get(
-            'public fun TreeFindNodeWildRelative(in _path, in _startnid, optional _usagemask) {' +
-                '_ctx=0q;' +
-                '_nid=0;' +
-                '_nids=[];' +
-                'if (!present(_usagemask)) _usagemask = -1;' +
-                'while (TreeShr->TreeFindNodeWildRelative(_path, val(_startnid), ref(_nid), ref(_ctx), val(_usagemask)) & 1) {' +
-                    'if (size(_nids) > 0) {' +
-                        '_nids = [_nids, _nid];' +
-                    '} else {' +
-                        '_nids = [_nid];' +
-                    '}' +
-                '};' +
-                'TreeShr->TreeFindNodeEnd(_ctx);' +
-                'return(_nids);' +
-            '};' +
-            'TreeFindNodeWildRelative($, $, $)',
-            wildcard, self._nid, usage_mask
-        ).data()
+        self._conn.registerHelper('TreeFindNodeWildRelative', _TREE_FIND_NODE_WILD_RELATIVE)
+        nids = self._conn.get('TreeFindNodeWildRelative($, $, $)', wildcard, self._nid, usage_mask).data()
 
         return TreeNodeArray(nids, self._tree)
 
@@ -786,29 +824,13 @@ class TreeNode(_NCI):
             pass
 
     def decompile(self):
-        # TODO: Implement TreeDecompileRecord as a .fun
-        return self._conn.get(
-            'public fun TreeDecompileRecord(in _nid) {' +
-                '_out=1;' +
-                '_status=TreeShr->TreeGetRecord(val(_nid), xd(_out));' +
-                'return(execute("decompile(`_out)"));' +
-            '};' +
-            'TreeDecompileRecord($)',
-            self._nid
-        ).data()
+        self._conn.registerHelper('TreeDecompileRecord', _TREE_DECOMPILE_RECORD)
+        return self._conn.get('TreeDecompileRecord($)', self._nid).data()
     
     @property
     def record(self):
-        # TODO: Implement TreeGetRecordSerialized as a .fun
-        return self._conn.get(
-            'public fun TreeGetRecordSerialized(in _nid) {' +
-                '_out=1;' +
-                '_status=TreeShr->TreeGetRecord(val(_nid), xd(_out));' +
-                'return(execute("SerializeOut(`_out)"));' +
-            '};' +
-            'TreeGetRecordSerialized($)',
-            self._nid
-        ).deserialize(conn=self._conn)
+        self._conn.registerHelper('TreeGetRecordSerialized', _TREE_GET_RECORD_SERIALIZED)
+        return self._conn.get('TreeGetRecordSerialized($)', self._nid).deserialize(conn=self._conn)
     
     def getRecord(self):
         return self.record
@@ -835,21 +857,49 @@ class classmethodX(object):
 class Tree(TreeNode):
 
     def __init__(self, tree: str, shot: int = -1, mode: str = 'NORMAL', path: str = None, conn: Connection = None):
-        self._conn: Connection = conn
-        if self._conn is None:
-            self._conn = getDefaultConnection()
-            if self._conn is None:
+        if conn is None:
+            conn = getDefaultConnection()
+            if conn is None:
                 raise Exception('Unable to create an mdsthin.Tree without a connection.')
 
-        # TODO: Clone connection so that each Tree has its own Connection
+        self._tree = self
+        self._connection: Connection = None
+
+        # Each Tree leases its own Connection from a pool, as the open tree is per-connection
+        self._pool: ConnectionPool = None
+        if isinstance(conn, ConnectionPool):
+            self._pool = conn
+            conn = self._pool.acquire()
+
+        self._connection = conn
 
         self._treename = tree
         self._path = path
-        self.open(mode, shot)
 
-        # TODO: Use 0, the default nid, or the nid of \\TOP ?
-        super().__init__(self._conn.get('GetDefaultNid()'), self)
-        # super().__init__(self, self._conn.get('getnci("\\\\TOP","NID_NUMBER")'))
+        try:
+            self.open(mode, shot)
+
+            # TODO: Use 0, the default nid, or the nid of \\TOP ?
+            super().__init__(self._conn.get('GetDefaultNid()'), self)
+            # super().__init__(self, self._conn.get('getnci("\\\\TOP","NID_NUMBER")'))
+        except:
+            self.close()
+            raise
+
+    # Used for with statement
+    def __enter__(self):
+        return self
+
+    # Used for with statement
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __del__(self):
+        # Return a leased connection that was never closed, without making any requests
+        # from the garbage collector
+        if getattr(self, '_pool', None) is not None and self._connection is not None:
+            conn, self._connection = self._connection, None
+            self._pool.release(conn, discard=True)
 
     def __repr__(self):
         return f'Tree("{self._treename.upper()}",{self.shot},"Normal")'
@@ -1004,9 +1054,29 @@ class Tree(TreeNode):
             shot=self._shot,
             mode=self._mode,
             path=self._path,
-            conn=self._conn.copy()
+            conn=(self._pool if self._pool is not None else self._conn.copy())
         )
 
+    def close(self):
+        """
+        If this Tree leased its connection from a :class:`ConnectionPool`, close its trees and
+        return the connection to the pool. The Tree and its nodes cannot be used after this.
+        """
+        if self._pool is None or self._connection is None:
+            return
+
+        conn, self._connection = self._connection, None
+
+        # Don't leave our trees open for whoever leases the connection next, and if they
+        # cannot be closed then don't reuse the connection at all
+        try:
+            conn.closeAllTrees()
+        except Exception:
+            self._pool.release(conn, discard=True)
+            return
+
+        self._pool.release(conn)
+
     def readonly(self, shot: int = None):
         self.open('READONLY', shot)
 
@@ -1020,30 +1090,8 @@ class Tree(TreeNode):
         if shot is not None:
             self._shot = shot
 
-        try:
-            env_name = f'{self._treename.lower()}_path'
-            if self._path is not None:
-                old_path = self._conn.get(f'getenv("{env_name}")')
-                self._conn.get(f'setenv("{env_name}={self._path}")')
-
-            self._mode = mode.upper()
-            if self._mode == 'NORMAL':
-                status = self._conn.get('TreeOpen($,$)', self._treename, self._shot).data()
-            elif self._mode == 'EDIT':
-                status = self._conn.get('TreeOpenEdit($,$)', self._treename, self._shot).data()
-            elif self._mode == 'READONLY':
-                status = self._conn.get('TreeOpen($,$,1)', self._treename, self._shot).data()
-            # elif self._mode == 'NEW':
-            #     status = self._conn.get('TreeOpenNew($,$)', self._treename, self._shot).data()
-            else:
-                raise TypeError('Invalid mode specificed, must be "readonly", "normal", "edit", or "new"')
-
-            if STATUS_NOT_OK(status):
-                raise getException(status)
-            
-        finally:
-            if self._path is not None:
-                self._conn.get(f'setenv("{env_name}={old_path}")')
+        self._mode = mode.upper()
+        self._conn.openTree(self._treename, self._shot, self._mode, path=self._path)
 
     def getNodeWild(self, wildcard: str, *usage: str):
         usage_mask = 0xFFFF
@@ -1072,7 +1120,8 @@ class Tree(TreeNode):
             if conn is None:
                 raise Exception('Unable to use mdsthin.Tree without a connection.')
 
-        status = conn.get('TreeSetCurrentShot($,$)', tree, shot).data()
+        with _borrowConnection(conn) as c:
+            status = c.get('TreeSetCurrentShot($,$)', tree, shot).data()
 
         if STATUS_NOT_OK(status):
             raise getException(status)
@@ -1088,7 +1137,8 @@ class Tree(TreeNode):
             if conn is None:
                 raise Exception('Unable to use mdsthin.Tree without a connection.')
 
-        shot = conn.get('TreeGetCurrentShot($)', tree).data()
+        with _borrowConnection(conn) as c:
+            shot = c.get('TreeGetCurrentShot($)', tree).data()
         if shot == 0:
             raise TreeNOCURRENT()
         
@@ -25,6 +25,8 @@
 
 from __future__ import annotations
 
+import numpy
+
 from .descriptors import *
 
 client_t = ctypes.c_int8
@@ -37,6 +39,9 @@ SENDCAPABILITIES = 0xF
 
 MAX_DIMS = 8
 
+# msglen is a signed 32-bit integer, so larger arrays have to be sent in chunks, see `Connection.put()`
+MAX_MSGLEN = 2**31 - 1
+
 class MsgHdr(ctypes.LittleEndianStructure):
     _pack_ = 4
     _fields_ = [
@@ -56,6 +61,15 @@ class Message(MsgHdr):
     
     def __init__(self, dsc = None, compression_level: int = 0):
 
+        if isinstance(dsc, numpy.ndarray) and dsc.flags.c_contiguous:
+
+            # The array only needs to be read while sending, so wrap it instead of letting
+            # the constructor copy it
+            for dtype_id, numpy_dtype in NUMPY_DTYPE_MAP.items():
+                if dsc.dtype == numpy_dtype:
+                    dsc = DTYPE_CLASS_MAP[CLASS_A][dtype_id].from_numpy(dsc)
+                    break
+
         if not isinstance(dsc, Descriptor):
             dsc = Descriptor(dsc)
 
@@ -68,45 +82,92 @@ class Message(MsgHdr):
             if not isinstance(dsc, (DescriptorS, DescriptorA)):
                 raise Exception('Only able to send CLASS_S and CLASS_A descriptors, use `SerializeIn`')
             
-            self.buffer = dsc.pack_data()
             self.length = dsc.length
             self.dtype_id = dsc.dtype_id
 
-            if isinstance(dsc, DescriptorA):
+            if isinstance(dsc, DescriptorS):
+                self.buffer = dsc.pack_data()
+
+            else:
+                # Large arrays are sent directly from a view of their data, see `pack_buffers()`
+                self.buffer = dsc.pack_data(copy=False)
+
                 self.ndims = dsc.dimct
                 for i in range(self.ndims):
                     self.dims[i] = dsc.dims[i]
 
         self.client_type = IEEE_CLIENT
 
+        msglen = ctypes.sizeof(Message) + len(self.buffer)
+        if msglen > MAX_MSGLEN:
+            raise MdsException(f'Unable to send {msglen} bytes in one message, the limit is {MAX_MSGLEN}')
+
+        self.msglen = msglen
+
+        if compression_level > 0:
+            self.compress(compression_level)
+
+    def compress(self, compression_level: int):
+        """
+        Compress the data of this message, if that makes it smaller.
+
+        The compressed data is prefixed with the original msglen, and the `COMPRESSED` bit
+        is set in `client_type`.
+
+        :param int compression_level: The zlib compression level, from 1 to 9.
+        :return: True if the data was compressed.
+        :rtype: bool
+        """
+
+        import zlib
+
+        if len(self.buffer) == 0 or (self.client_type & COMPRESSED) > 0:
+            return False
+
+        compressed_buffer = zlib.compress(self.buffer, compression_level)
+        if len(compressed_buffer) + ctypes.sizeof(ctypes.c_uint32) >= len(self.buffer):
+            return False
+
+        original_msglen = ctypes.c_uint32(self.msglen)
+
+        self.client_type |= COMPRESSED
+        self.buffer = bytearray(original_msglen) + compressed_buffer
         self.msglen = ctypes.sizeof(Message) + len(self.buffer)
+        return True
 
-        if len(self.buffer) > 0 and compression_level > 0:
-            import zlib
+    @property
+    def uncompressed_msglen(self):
+        """
+        The msglen of this message before it was compressed.
+        """
 
-            compressed_buffer = zlib.compress(self.buffer, compression_level)
-            if len(compressed_buffer) < len(self.buffer):
-                original_msglen = self.msglen
-                compressed_buffer = bytearray(original_msglen) + compressed_buffer
+        if (self.client_type & COMPRESSED) == 0:
+            return self.msglen
 
-                self.client_type |= COMPRESSED
-                self.buffer = compressed_buffer
-                self.msglen = ctypes.sizeof(Message) + len(self.buffer)
+        return ctypes.c_uint32.from_buffer_copy(self.buffer[ : ctypes.sizeof(ctypes.c_uint32) ]).value
 
     def pack(self):
         return bytes(self) + self.buffer
 
-    def unpack_data(self, buffer):
+    def pack_buffers(self):
+        """
+        Pack the header and the data as separate buffers, without copying the data. This
+        allows them to be sent with a single call to `socket.sendmsg()`.
 
-        if (self.client_type & COMPRESSED) > 0:
-            import zlib
+        :return: The serialized header, followed by the data if there is any.
+        :rtype: list
+        """
 
-            original_msglen = ctypes.c_uint32.from_buffer(buffer).value
-            original_buffer_size = original_msglen - ctypes.sizeof(Message) - ctypes.sizeof(ctypes.c_uint32)
-            compressed_buffer = buffer[ctypes.sizeof(ctypes.c_uint32) : ]
-            
-            buffer = zlib.decompress(compressed_buffer, bufsize=original_buffer_size)
-            self.msglen = original_msglen
+        if len(self.buffer) == 0:
+            return [ bytes(self) ]
+
+        return [ bytes(self), self.buffer ]
+
+    @property
+    def data_dtype_id(self):
+        """
+        The dtype of the data in this message, which can differ from `dtype_id`.
+        """
 
         dtype_id = self.dtype_id
 
@@ -120,9 +181,139 @@ class Message(MsgHdr):
             dtype_id = DTYPE_FSC
         elif dtype_id == DTYPE_DC:
             dtype_id = DTYPE_FTC
+
+        return dtype_id
+
+    def _array_dtype(self):
+        # The numpy dtype of the data if this is a numeric array, otherwise None
+        if self.ndims > 0 and self.data_dtype_id in NUMPY_DTYPE_MAP:
+            return numpy.dtype(NUMPY_DTYPE_MAP[self.data_dtype_id])
+        return None
+
+    def _array_fits(self, out, original_length):
+        numpy_dtype = self._array_dtype()
+        return (
+            numpy_dtype is not None
+            and isinstance(out, numpy.ndarray)
+            and out.dtype == numpy_dtype
+            and out.nbytes == original_length
+            and out.flags.c_contiguous
+            and out.flags.writeable
+        )
+
+    def allocate_data_buffer(self, out=None):
+        """
+        Allocate the buffer to receive the data of this message into, based on `msglen`.
+
+        Uncompressed numeric arrays are received directly into a numpy array of their final
+        shape and dtype, so that `unpack_data()` does not need to copy them. If `out` is a
+        contiguous numpy array of the same dtype and size, it will be used instead.
+
+        :param numpy.ndarray out: An optional array to receive the data into.
+        :return: A writable buffer of `msglen - sizeof(Message)` bytes.
+        :rtype: `numpy.ndarray` or `bytearray`
+        """
+
+        data_length = self.msglen - ctypes.sizeof(Message)
+
+        if (self.client_type & COMPRESSED) == 0 and self._array_dtype() is not None:
+            if self._array_fits(out, data_length):
+                return out
+
+            shape = self.dims[ : self.ndims ][ : : -1 ]
+            if numpy.prod(shape, dtype=numpy.int64) * self._array_dtype().itemsize == data_length:
+                return numpy.empty(shape, dtype=self._array_dtype())
+
+        return bytearray(data_length)
+
+    def unpack_data(self, buffer, out=None):
+
+        if (self.client_type & COMPRESSED) > 0:
+            prefix_size = MessageDecompressor.PREFIX_SIZE
+
+            decompressor = MessageDecompressor(self, buffer[ : prefix_size ], out=out)
+            decompressor.decompress(memoryview(buffer)[ prefix_size : ])
+            buffer = decompressor.finish()
+
+        dtype_id = self.data_dtype_id
         
         if self.ndims > 0:
             return DescriptorA.unpack_data(dtype_id, buffer, dims=self.dims[: self.ndims], length=self.length)
             
         else:
             return DescriptorS.unpack_data(dtype_id, buffer, length=self.length)
+
+class MessageDecompressor:
+    """
+    Decompresses the data of a compressed message incrementally, as it is received.
+
+    This reads the original msglen that prefixes the compressed data, and updates the message
+    to describe the uncompressed data. Each chunk passed to `decompress()` is then written
+    straight into the buffer from `Message.allocate_data_buffer()`, so the decompression can
+    overlap with receiving the rest of the message.
+
+    :param Message msg: The header of the compressed message.
+    :param prefix: The first 4 bytes of the message data, containing the original msglen.
+    :param numpy.ndarray out: An optional array to decompress the data into.
+    """
+
+    PREFIX_SIZE = ctypes.sizeof(ctypes.c_uint32)
+
+    def __init__(self, msg: Message, prefix, out=None):
+        import zlib
+
+        self.compressed_length = msg.msglen - ctypes.sizeof(Message) - self.PREFIX_SIZE
+
+        msg.msglen = ctypes.c_uint32.from_buffer_copy(prefix).value
+        msg.client_type &= ~COMPRESSED
+
+        self._decompressor = zlib.decompressobj()
+        self._buffer = msg.allocate_data_buffer(out)
+        self._view = memoryview(self._buffer).cast('B')
+        self._length = len(self._view)
+
+    @property
+    def buffer(self):
+        """The buffer the data is being decompressed into."""
+        return self._buffer
+
+    @property
+    def received(self):
+        """The number of bytes that have been decompressed so far."""
+        return self._length - len(self._view)
+
+    def decompress(self, chunk):
+        """
+        Decompress the next chunk of the compressed data.
+
+        :param chunk: The next part of the compressed data.
+        :raises MdsException: if the data is larger than the original msglen.
+        """
+
+        # Never inflate more than the rest of the original msglen, so that a corrupt or hostile
+        # message fails as soon as it is too large, instead of being decompressed in memory first
+        self._write(self._decompressor.decompress(chunk, max(1, len(self._view))))
+        while len(self._decompressor.unconsumed_tail) > 0:
+            self._write(self._decompressor.decompress(self._decompressor.unconsumed_tail, max(1, len(self._view))))
+
+    def _write(self, data):
+        if len(data) > len(self._view):
+            raise MdsException('The decompressed message is larger than expected')
+
+        self._view[ : len(data) ] = data
+        self._view = self._view[ len(data) : ]
+
+    def finish(self):
+        """
+        Finish decompressing the message.
+
+        :return: The uncompressed data to pass to `Message.unpack_data()`.
+        :rtype: `numpy.ndarray` or `bytearray`
+        :raises MdsException: if the data is not the size of the original msglen.
+        """
+
+        self._write(self._decompressor.flush())
+        if len(self._view) > 0 or not self._decompressor.eof:
+            raise MdsException('The decompressed message is smaller than expected')
+
+        return self._buffer
@@ -0,0 +1,346 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import weakref
+import threading
+import contextlib
+
+from .exceptions import *
+from .connection import Connection, SUPPORTED_PROTOCOLS, _parse_url
+
+class ConnectionPool:
+    """
+    Keeps a set of logged-in :class:`Connection` objects to one server, and leases them out
+    so that they can be reused instead of connecting and logging in for every job.
+
+    Connections are created as needed, up to `max_connections`, after which `acquire()` will
+    wait for one to be returned. A limit on the connections to a host can also be shared by
+    every pool, see `setHostLimit()`. Connections that have been idle for longer than
+    `health_check_interval` are checked with a cheap request before being leased out, and
+    are reconnected if the check fails.
+
+    Leased connections keep any state from their previous lease, such as open trees, the
+    default node, and TDI variables, so each job should set up the state it needs.
+
+    Example:
+    ```
+    pool = ConnectionPool('server', max_connections=4)
+
+    with pool.connection() as c:
+        c.openTree('test', 123)
+        y = c.get('SIGNAL_NODE').data()
+    ```
+    """
+
+    # The connections to each host from every pool, see `setHostLimit()`
+    _host_lock = threading.Lock()
+    _host_limits = {}
+    _host_sizes = {}
+    _host_pools = {}
+
+    def __init__(self, url: str, max_connections: int = 8, health_check_interval: float = 30.0, max_host_connections: int = None, **connection_kwargs):
+        """
+        Initialize a pool of connections to a given URL. No connections are made until
+        they are first needed.
+
+        :param str url: The URL to connect to, see :class:`Connection`.
+        :param int max_connections: The maximum number of connections in this pool, leased
+            or idle, defaults to 8.
+        :param float health_check_interval: Connections idle for longer than this many seconds
+            are checked before being leased out, defaults to 30s.
+        :param int max_host_connections: If set, calls `setHostLimit()` to limit the connections
+            to this host from every pool together.
+        :param **connection_kwargs: Additional arguments to pass to :class:`Connection`.
+        """
+
+        if max_connections < 1:
+            raise MdsException('max_connections must be at least 1')
+
+        if max_host_connections is not None:
+            self.setHostLimit(url, max_host_connections)
+
+        self._host = self._hostKey(url)
+        with ConnectionPool._host_lock:
+            ConnectionPool._host_pools.setdefault(self._host, weakref.WeakSet()).add(self)
+
+        self._url = url
+        self._max_connections = max_connections
+        self._health_check_interval = health_check_interval
+        self._connection_kwargs = connection_kwargs
+
+        self._condition = threading.Condition()
+        self._closed = False
+
+        # The number of connections that exist, both leased and idle
+        self._size = 0
+
+        # A stack of (Connection, time.monotonic() when it was returned), so the most recently
+        # used connection is leased out first
+        self._idle = []
+
+    # Used for with statement
+    def __enter__(self):
+        return self
+
+    # Used for with statement
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    @property
+    def url(self):
+        return self._url
+
+    @classmethod
+    def setHostLimit(cls, url: str, max_connections: int = None):
+        """
+        Limit the number of connections, leased or idle, that every pool together keeps to
+        a host. When a pool needs a new connection and the host is at its limit, it closes
+        the least recently used idle connection of another pool to that host, or waits for
+        one to be released.
+
+        :param str url: The URL or name of the host, any protocol, username, or port is ignored.
+        :param int max_connections: The maximum number of connections, or None to remove the limit.
+        """
+
+        if max_connections is not None and max_connections < 1:
+            raise MdsException('max_connections must be at least 1')
+
+        host = cls._hostKey(url)
+        with cls._host_lock:
+            if max_connections is None:
+                cls._host_limits.pop(host, None)
+            else:
+                cls._host_limits[host] = max_connections
+
+        # A higher limit may let waiting pools connect
+        cls._notifyHost(host)
+
+    @staticmethod
+    def _hostKey(url: str):
+        _, _, host, _ = _parse_url(url, SUPPORTED_PROTOCOLS)
+        return host.lower()
+
+    @classmethod
+    def _notifyHost(cls, host: str):
+        with cls._host_lock:
+            pools = list(cls._host_pools.get(host, ()))
+
+        for pool in pools:
+            with pool._condition:
+                pool._condition.notify()
+
+    def _reserveHost(self):
+        """
+        Count a new connection against the limit of our host, if there is room for it.
+        """
+
+        with ConnectionPool._host_lock:
+            size = ConnectionPool._host_sizes.get(self._host, 0)
+            limit = ConnectionPool._host_limits.get(self._host)
+            if limit is not None and size >= limit:
+                return False
+
+            ConnectionPool._host_sizes[self._host] = size + 1
+            return True
+
+    def _releaseHost(self, count: int = 1):
+        if count == 0:
+            return
+
+        with ConnectionPool._host_lock:
+            ConnectionPool._host_sizes[self._host] -= count
+
+        self._notifyHost(self._host)
+
+    def _evictIdle(self):
+        """
+        Close the least recently used idle connection of another pool to our host, to make
+        room for a new connection of our own.
+
+        :return: True if a connection was closed.
+        """
+
+        with ConnectionPool._host_lock:
+            pools = [ pool for pool in ConnectionPool._host_pools.get(self._host, ()) if pool is not self ]
+
+        for pool in pools:
+            with pool._condition:
+                if len(pool._idle) == 0:
+                    continue
+
+                conn, _ = pool._idle.pop(0)
+                pool._size -= 1
+
+            conn.disconnect()
+            pool._releaseHost()
+            return True
+
+        return False
+
+    def acquire(self, timeout: float = None):
+        """
+        Lease a connection from the pool, which must be returned with `release()`.
+        Prefer using `connection()` in a with statement.
+
+        :param float timeout: The maximum number of seconds to wait for a connection to be
+            returned if the pool is at `max_connections`, defaults to waiting forever.
+        :return: A logged-in connection.
+        :rtype: :class:`Connection`
+        :raises TimeoutError: if no connection became available before the timeout.
+        :raises MdsException: if the pool has been closed, or if the login fails.
+        """
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        conn = None
+        evict = True
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise MdsException('ConnectionPool has been closed')
+
+                if len(self._idle) > 0:
+                    conn, last_used = self._idle.pop()
+                    break
+
+                host_full = False
+                if self._size < self._max_connections:
+                    # Reserve our spot, and create the connection outside the lock
+                    if self._reserveHost():
+                        self._size += 1
+                        break
+
+                    host_full = True
+
+                if not (host_full and evict):
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f'No connection to {self._url} became available within {timeout}s')
+
+                    self._condition.wait(remaining)
+                    evict = True
+                    continue
+
+            # The host is at its limit, so make room by closing an idle connection of another
+            # pool, outside of our lock. If there are none, the next pass waits for a release.
+            evict = self._evictIdle()
+
+        try:
+            if conn is None:
+                conn = Connection(self._url, **self._connection_kwargs)
+
+            elif time.monotonic() - last_used > self._health_check_interval:
+                if not self._check_health(conn):
+                    conn._logger.warning(f'Pooled connection to {self._url} failed its health check, reconnecting')
+                    conn.reconnect()
+
+        except:
+            self._forget()
+            raise
+
+        return conn
+
+    def release(self, conn: Connection, discard: bool = False):
+        """
+        Return a leased connection to the pool.
+
+        :param Connection conn: The connection returned by `acquire()`.
+        :param bool discard: Disconnect the connection instead of reusing it, for instance
+            if it may have been left in a bad state.
+        """
+
+        if not discard:
+            with self._condition:
+                if not self._closed:
+                    self._idle.append((conn, time.monotonic()))
+                    self._condition.notify()
+                    return
+
+        conn.disconnect()
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+        self._releaseHost()
+
+    def _check_health(self, conn: Connection):
+        if conn._socket is None:
+            return False
+
+        try:
+            return (conn.get('1') == 1)
+        except Exception:
+            return False
+
+    @contextlib.contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Lease a connection from the pool for the duration of a with statement. If the network
+        connection fails inside the with statement, the connection is discarded instead of
+        being returned to the pool.
+
+        :param float timeout: The maximum number of seconds to wait for a connection, see `acquire()`.
+        :return: A context manager that yields a logged-in :class:`Connection`.
+        :raises TimeoutError: if no connection became available before the timeout.
+        :raises MdsException: if the pool has been closed, or if the login fails.
+        """
+
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except OSError:
+            # TimeoutError, BrokenPipeError, ConnectionResetError, etc.
+            self.release(conn, discard=True)
+            raise
+        except:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """
+        Disconnect all idle connections, any leased connections will be disconnected when
+        they are released.
+        """
+
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for conn, _ in idle:
+            conn.disconnect()
+
+        self._releaseHost(len(idle))
@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import numpy
+
+from .descriptors import *
+from .exceptions import *
+
+class Parameter:
+    """
+    Stands in for an argument of a :class:`GetMany` query that is given a new value each
+    time it is executed, see `GetMany.prepare()`.
+
+    :param str name: The name that the value is passed to `execute()` with.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f'Parameter({self.name!r})'
+
+def _pack_apd(header: bytes, items: list):
+    """
+    Pack a :class:`DescriptorAPD` from the header of its descriptor and its already packed
+    items, in the same way as `DescriptorAPD.pack()`. The offsets of each item are relative
+    to the start of that item, so the packed items can be reused in any position.
+
+    :param bytes header: The packed `mdsdsc_a_t` of the List or Dictionary, the `arsize` of
+        which is updated to match the number of items.
+    :param list items: The packed items, or None for missing items.
+    :return: The packed descriptor.
+    :rtype: bytes
+    """
+
+    offsets = numpy.zeros(len(items), dtype=numpy.uint32)
+
+    dsc = mdsdsc_a_t.from_buffer_copy(header)
+    dsc.arsize = offsets.nbytes
+    header = bytes(dsc)
+
+    data_offset = len(header) + offsets.nbytes
+    for i, item in enumerate(items):
+        if item is not None:
+            offsets[i] = data_offset
+            data_offset += len(item)
+
+    return b''.join([ header, offsets.tobytes() ] + [ item for item in items if item is not None ])
+
+class _PreparedQueries:
+    """
+    The serialized queries of a :class:`GetMany`, packed once so that only the values of the
+    :class:`Parameter` arguments have to be packed each time it is executed.
+
+    :param List queries: The queries, with missing descriptors in place of the parameters.
+    :param dict parameters: The parameters of each query by name, as `{ NAME: { INDEX: PARAMETER_NAME } }`.
+    """
+
+    def __init__(self, queries: List, parameters: dict):
+        self._header = bytes(queries._dsc)
+        self._names = set()
+
+        # Each query is either its packed bytes, or the packed bytes up to its args along with
+        # the header of its args and each packed arg, or the name of the parameter in its place
+        self._queries = []
+        for query in queries:
+            query_parameters = parameters.get(query['name'].data())
+            if not query_parameters:
+                self._queries.append(bytes(query.pack()))
+                continue
+
+            # The args are always the last item, so nothing before them moves when they change size
+            args = query['args']
+            packed_query = query.pack()
+            prefix = bytes(packed_query[ : len(packed_query) - len(args.pack()) ])
+
+            packed_args = []
+            for i, arg in enumerate(args):
+                if i in query_parameters:
+                    packed_args.append(query_parameters[i])
+                    self._names.add(query_parameters[i])
+                elif type(arg) is Descriptor:
+                    packed_args.append(None)
+                else:
+                    packed_args.append(bytes(arg.pack()))
+
+            self._queries.append((prefix, bytes(args._dsc), packed_args))
+
+    def bind(self, parameters: dict):
+        """
+        Pack the queries with the given values for the parameters.
+
+        :param dict parameters: The value of each parameter by name.
+        :return: The serialized queries, ready to pass to `GetManyExecute()`.
+        :rtype: :class:`UInt8Array`
+        :raises MdsException: if a parameter is missing, or not used by any query.
+        """
+        return UInt8Array(_pack_apd(self._header, self.pack(parameters)))
+
+    def pack(self, parameters: dict):
+        """
+        Pack each query with the given values for the parameters, see `bind()`.
+
+        :param dict parameters: The value of each parameter by name.
+        :return: The packed queries.
+        :rtype: list of bytes
+        :raises MdsException: if a parameter is missing, or not used by any query.
+        """
+
+        for name in self._names - parameters.keys():
+            raise MdsException(f'No value was given for the parameter "{name}"')
+
+        for name in parameters.keys() - self._names:
+            raise MdsException(f'There is no parameter named "{name}"')
+
+        packed_values = {}
+        for name, value in parameters.items():
+            value = Descriptor.from_data(value)
+            packed_values[name] = None if type(value) is Descriptor else bytes(value.pack())
+
+        items = []
+        for query in self._queries:
+            if isinstance(query, bytes):
+                items.append(query)
+                continue
+
+            prefix, args_header, packed_args = query
+            packed_args = [ packed_values[arg] if isinstance(arg, str) else arg for arg in packed_args ]
+            items.append(prefix + _pack_apd(args_header, packed_args))
+
+        return items
@@ -0,0 +1,412 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import re
+import math
+import time
+import json
+import threading
+import contextlib
+
+class LatencyHistogram:
+    """
+    Counts latencies in buckets that grow exponentially, so that percentiles can be estimated
+    in constant memory. Each bucket spans about 12% of its value, from 1us to over an hour,
+    and the percentiles are accurate to within that.
+    """
+
+    MIN_LATENCY = 1e-6
+    BUCKETS_PER_DECADE = 20
+    DECADES = 10
+
+    def __init__(self):
+        self._buckets = [ 0 ] * (self.BUCKETS_PER_DECADE * self.DECADES + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float):
+        """
+        Record one latency.
+
+        :param float seconds: The latency in seconds.
+        """
+
+        if seconds <= self.MIN_LATENCY:
+            index = 0
+        else:
+            index = math.ceil(math.log10(seconds / self.MIN_LATENCY) * self.BUCKETS_PER_DECADE)
+            index = min(index, len(self._buckets) - 1)
+
+        self._buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float):
+        """
+        Estimate a percentile of the recorded latencies.
+
+        :param float percent: The percentile, from 0 to 100.
+        :return: The upper bound of the bucket containing the percentile, or None if nothing
+            has been recorded.
+        :rtype: float
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, bucket in enumerate(self._buckets):
+            seen += bucket
+            if seen >= rank:
+                upper = self.MIN_LATENCY * 10 ** (index / self.BUCKETS_PER_DECADE)
+                return min(max(upper, self.min), self.max)
+
+        return self.max
+
+    def summary(self):
+        """
+        :return: The count, mean, min, max, and the 50th, 90th, and 99th percentiles.
+        :rtype: dict
+        """
+
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class ConnectionStats:
+    """
+    Collects the performance counters of a :class:`Connection`, see `Connection.stats()`.
+
+    Bytes are counted as they are sent and received on the wire, and again as they are before
+    compression, so the compression ratio can be computed. Operations are the public methods,
+    like `get()` and `GetMany.execute()`, and are timed from start to finish, including any
+    requests they make of their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Set all of the counters back to zero."""
+
+        with self._lock:
+            self._requests = 0
+            self._reconnects = 0
+            self._messages_sent = 0
+            self._messages_received = 0
+            self._bytes_sent = 0
+            self._bytes_sent_uncompressed = 0
+            self._bytes_received = 0
+            self._bytes_received_uncompressed = 0
+            self._operations = {}
+
+    def recordRequest(self):
+        with self._lock:
+            self._requests += 1
+
+    def recordReconnect(self):
+        with self._lock:
+            self._reconnects += 1
+
+    def recordSent(self, size: int, uncompressed_size: int):
+        """
+        :param int size: The msglen of a message as sent.
+        :param int uncompressed_size: The msglen of the message before it was compressed.
+        """
+
+        with self._lock:
+            self._messages_sent += 1
+            self._bytes_sent += size
+            self._bytes_sent_uncompressed += uncompressed_size
+
+    def recordReceived(self, size: int, uncompressed_size: int):
+        """
+        :param int size: The msglen of a message as received.
+        :param int uncompressed_size: The msglen of the message after it was decompressed.
+        """
+
+        with self._lock:
+            self._messages_received += 1
+            self._bytes_received += size
+            self._bytes_received_uncompressed += uncompressed_size
+
+    @contextlib.contextmanager
+    def operation(self, name: str):
+        """
+        Time an operation, and count it as an error if it raises. Operations started inside
+        another operation on the same thread are part of it, and are not counted on their own.
+
+        :param str name: The name of the operation, e.g. 'get'.
+        """
+
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+
+        failed = False
+        start = time.perf_counter()
+        try:
+            yield
+
+        except BaseException:
+            failed = True
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.depth = depth
+
+            if depth == 0:
+                with self._lock:
+                    if name not in self._operations:
+                        self._operations[name] = { 'errors': 0, 'latency': LatencyHistogram() }
+
+                    operation = self._operations[name]
+                    operation['latency'].record(elapsed)
+                    if failed:
+                        operation['errors'] += 1
+
+    def snapshot(self):
+        """
+        :return: A copy of the counters, see `Connection.stats()`.
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'reconnects': self._reconnects,
+                'messages_sent': self._messages_sent,
+                'messages_received': self._messages_received,
+                'bytes_sent': self._bytes_sent,
+                'bytes_sent_uncompressed': self._bytes_sent_uncompressed,
+                'bytes_received': self._bytes_received,
+                'bytes_received_uncompressed': self._bytes_received_uncompressed,
+                'compression_ratio_sent': _ratio(self._bytes_sent, self._bytes_sent_uncompressed),
+                'compression_ratio_received': _ratio(self._bytes_received, self._bytes_received_uncompressed),
+                'operations': {
+                    name: dict(operation['latency'].summary(), errors=operation['errors'])
+                    for name, operation in self._operations.items()
+                },
+            }
+
+def _ratio(size, uncompressed_size):
+    if size == 0:
+        return None
+
+    return uncompressed_size / size
+
+class RequestTiming:
+    """
+    The time spent in each phase of a single request, in seconds, see the `timing_callback`
+    argument of :class:`Connection`.
+
+    - `serialize`: Converting the expression and arguments into messages.
+    - `compress`: Compressing the messages.
+    - `send`: Writing the messages to the socket.
+    - `wait`: From the end of `send` until the header of the reply arrived. This is mostly
+      the time the server spent evaluating the expression, plus one network round trip.
+    - `receive`: Reading the data of the reply from the socket.
+    - `decompress`: Decompressing the data of the reply.
+    - `decode`: Converting the data of the reply into a :class:`Descriptor`.
+    - `total`: From the start of `serialize` until the reply was handed to the caller.
+
+    The phases of the reply are 0 if the reply had no data. When requests are pipelined,
+    `wait` includes the time spent waiting for the replies to earlier requests.
+    """
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        self.start = time.perf_counter()
+        self.sent = None
+
+        self.serialize = 0.0
+        self.compress = 0.0
+        self.send = 0.0
+        self.wait = 0.0
+        self.receive = 0.0
+        self.decompress = 0.0
+        self.decode = 0.0
+        self.total = 0.0
+
+        # The msglen of the request, including its arguments, and of the reply, as sent on the wire
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        # The size of the data of each argument, before compression
+        self.arg_sizes = []
+
+    def __repr__(self):
+        phases = ', '.join(
+            f'{name}={getattr(self, name) * 1000:.3f}ms'
+            for name in [ 'serialize', 'compress', 'send', 'wait', 'receive', 'decompress', 'decode', 'total' ]
+        )
+        return f'RequestTiming({self.expr!r}, {phases}, bytes_sent={self.bytes_sent}, bytes_received={self.bytes_received})'
+
+# Numbers, with an optional exponent and TDI type suffix, that are not part of a name or a path
+_FINGERPRINT_NUMBER = re.compile(r'(?<![\w$.\\])(\d+\.?\d*|\.\d+)([eEdDgGfF][+-]?\d+)?(BU|WU|LU|QU|OU|B|W|L|Q|O)?(?![\w.])', re.IGNORECASE)
+_FINGERPRINT_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+_FINGERPRINT_PLACEHOLDER = re.compile(r'\$\d+')
+_FINGERPRINT_WHITESPACE = re.compile(r'\s+')
+
+def fingerprint(expr: str):
+    """
+    Normalize a TDI expression, so that requests that differ only in their shot numbers,
+    strings, or other literals are grouped together. Literals are replaced with `?`,
+    numbered placeholders like `$1` with `$`, and runs of whitespace with a single space.
+
+    Example:
+    ```
+    fingerprint('TreeOpen("cmod", 1234567)') == 'TreeOpen(?, ?)'
+    fingerprint('getnci($, "LENGTH")') == 'getnci($, ?)'
+    ```
+
+    :param str expr: The TDI expression.
+    :return: The normalized expression.
+    :rtype: str
+    """
+
+    expr = _FINGERPRINT_STRING.sub('?', expr)
+    expr = _FINGERPRINT_NUMBER.sub('?', expr)
+    expr = _FINGERPRINT_PLACEHOLDER.sub('$', expr)
+    return _FINGERPRINT_WHITESPACE.sub(' ', expr).strip()
+
+class SlowQueryLog:
+    """
+    Records the requests that take longer than `threshold`, along with the fingerprint of their
+    expression, the sizes of their arguments and reply, and the timing of each phase, see
+    :class:`RequestTiming`. Each record is written as a line of JSON to a rotating file,
+    and/or passed to a callback.
+
+    It also totals the time spent on every request by fingerprint, slow or not, so that
+    `top()` can tell you which expressions use the most time on the server.
+
+    Example:
+    ```
+    slow_query_log = SlowQueryLog(threshold=1.0, path='slow_queries.log')
+    c = Connection('server', slow_query_log=slow_query_log)
+    ...
+    for fingerprint, totals in slow_query_log.top(5):
+        print(fingerprint, totals['count'], totals['total'])
+    ```
+
+    :param float threshold: Requests taking longer than this many seconds are recorded,
+        defaults to 1s.
+    :param str path: The file to write the records to, or None to not write them.
+    :param callback: A function to call with the record of each slow request, as a dict.
+    :param int max_bytes: The size at which the file is rotated, defaults to 10MiB.
+    :param int backup_count: The number of rotated files to keep, defaults to 3.
+    """
+
+    def __init__(self,
+        threshold: float = 1.0,
+        path: str = None,
+        callback = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+    ):
+        self.threshold = threshold
+        self._callback = callback
+        self._handler = None
+
+        if path is not None:
+            import logging.handlers
+            self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+            self._handler.setFormatter(logging.Formatter('%(message)s'))
+
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def __call__(self, timing: RequestTiming):
+        key = fingerprint(timing.expr)
+
+        with self._lock:
+            if key not in self._totals:
+                self._totals[key] = { 'count': 0, 'slow': 0, 'total': 0.0, 'wait': 0.0 }
+
+            totals = self._totals[key]
+            totals['count'] += 1
+            totals['total'] += timing.total
+            totals['wait'] += timing.wait
+
+            if timing.total < self.threshold:
+                return
+
+            totals['slow'] += 1
+
+        record = {
+            'time': time.time(),
+            'fingerprint': key,
+            'arg_sizes': timing.arg_sizes,
+            'bytes_sent': timing.bytes_sent,
+            'bytes_received': timing.bytes_received,
+        }
+
+        for phase in [ 'serialize', 'compress', 'send', 'wait', 'receive', 'decompress', 'decode', 'total' ]:
+            record[phase] = getattr(timing, phase)
+
+        if self._handler is not None:
+            import logging
+            self._handler.emit(logging.makeLogRecord({ 'msg': json.dumps(record) }))
+
+        if self._callback is not None:
+            self._callback(record)
+
+    def top(self, count: int = 10):
+        """
+        Return the fingerprints that have used the most time, slow or not.
+
+        :param int count: The number of fingerprints to return, defaults to 10.
+        :return: A list of `(fingerprint, { 'count', 'slow', 'total', 'wait' })` sorted by
+            `total`, the time spent on all requests with that fingerprint, in seconds.
+        :rtype: list
+        """
+
+        with self._lock:
+            totals = [ (key, dict(value)) for key, value in self._totals.items() ]
+
+        totals.sort(key=lambda item: item[1]['total'], reverse=True)
+        return totals[ : count ]
+
+    def close(self):
+        """Close the log file."""
+
+        if self._handler is not None:
+            self._handler.close()
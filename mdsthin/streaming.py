@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import ctypes
+import numpy
+
+from .descriptors import *
+from .exceptions import *
+
+class _StreamedResults:
+    """
+    Unpacks the items of a serialized :class:`Dictionary` while it is being received. The table
+    of offsets at the start tells us where each item is, and as they are packed in order, each
+    one is complete once the data up to the start of the next one has arrived.
+    """
+
+    def __init__(self):
+        self._offsets = None
+        self._ends = None
+        self._next = 0
+
+    def parse(self, buffer, received: int):
+        """
+        Yield each key and value that has been received completely, and not yet been yielded.
+
+        :param buffer: The buffer the serialized Dictionary is being received into.
+        :param int received: The number of bytes at the start of `buffer` that have been received.
+        :return: An iterator of the keys and values.
+        :rtype: iterator of tuple(:class:`Descriptor`, :class:`Descriptor`)
+        :raises MdsException: if the buffer does not contain a serialized Dictionary.
+        """
+
+        view = memoryview(buffer).cast('B')
+
+        if self._offsets is None:
+            header_size = ctypes.sizeof(mdsdsc_a_t)
+            if received < header_size:
+                return
+
+            dsc = mdsdsc_a_t.from_buffer_copy(view)
+            if dsc.class_id != CLASS_APD or dsc.dtype_id != DTYPE_DICTIONARY or dsc.length != ctypes.sizeof(ctypes.c_uint32):
+                raise MdsException('GetMany Error: The result is not a Dictionary')
+
+            offsets_start = dsc.offset if dsc.offset != 0 else header_size
+            offsets_end = offsets_start + dsc.arsize
+            if received < offsets_end:
+                return
+
+            offsets = numpy.frombuffer(view[ offsets_start : offsets_end ], dtype=numpy.uint32).astype(numpy.int64)
+
+            starts = numpy.append(numpy.unique(offsets[ offsets != 0 ]), len(view))
+            ends = starts[ numpy.searchsorted(starts, offsets, side='right') ]
+
+            self._offsets = offsets
+            self._ends = numpy.where(offsets != 0, ends, 0)
+
+        while self._next + 1 < len(self._offsets):
+            i = self._next
+            if max(self._ends[i], self._ends[i + 1]) > received:
+                return
+
+            self._next += 2
+            yield self._unpack(view, self._offsets[i]), self._unpack(view, self._offsets[i + 1])
+
+    @staticmethod
+    def _unpack(view, offset):
+        if offset == 0:
+            return Descriptor()
+
+        # The values hold on to the buffer, and are unpacked as they are accessed
+        return Descriptor.unpack(view[ offset : ], lazy=True)
@@ -23,11 +23,15 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+from .capture_test import *
 from .cmod_test import *
+from .compression_test import *
 from .connection_test import *
 from .descriptors_test import *
 from .exceptions_test import *
 from .serialize_test import *
+from .stats_test import *
+from .testing_test import *
 from .write_test import *
 
 from .run import run_mdsthin_tests
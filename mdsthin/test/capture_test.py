@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import gc
+import os
+import sys
+import tempfile
+import unittest
+
+from ..capture import *
+from ..capture import _CaptureWriter
+from ..connection import *
+from ..message import *
+from ..testing import *
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.mdscap')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_replay(self):
+
+        login = Message()
+        login.status = 1
+
+        reply = Message(Int32(42))
+        reply.message_id = 1
+        reply.status = 1
+
+        # A capture of a login, and of one request and its reply, split across two reads
+        writer = _CaptureWriter(self.path)
+        writer.write(CAPTURE_CONNECTED, b'')
+        writer.write(CAPTURE_SENT, b'login')
+        writer.write(CAPTURE_RECEIVED, bytes(login))
+        writer.write(CAPTURE_SENT, b'request')
+        writer.write(CAPTURE_RECEIVED, bytes(reply))
+        writer.write(CAPTURE_RECEIVED, reply.buffer)
+        writer.close()
+
+        records = list(readCapture(self.path))
+        self.assertEqual([ direction for direction, _, _ in records ], [ b'C', b'S', b'R', b'S', b'R', b'R' ])
+
+        conn = Connection(f'replay://{self.path}')
+        self.assertEqual(conn.get('42'), 42)
+
+        # The capture has run out
+        self.assertRaises(ConnectionResetError, conn.get, '42')
+
+        # and there is no second connection to reconnect to
+        self.assertRaises(ConnectionRefusedError, conn.reconnect)
+
+    def test_record(self):
+
+        with MdsipTestServer(expressions={ 'answer()': Int32(42) }) as server:
+            conn = Connection(server.url, auto_reconnect=True, record=self.path)
+            self.assertEqual(conn.get('answer()'), 42)
+
+            # The capture continues across reconnects, with each connection recorded separately
+            server.dropConnections()
+            self.assertEqual(conn.get('answer()'), 42)
+            self.assertEqual(conn.get('"Hello"'), 'Hello')
+
+            file = conn._capture_writer._file
+            conn.disconnect()
+            self.assertTrue(file.closed)
+            self.assertIsNone(conn._capture_writer)
+
+        records = list(readCapture(self.path))
+        self.assertEqual([ direction for direction, _, _ in records ].count(CAPTURE_CONNECTED), 2)
+
+        # The replay loses its first connection at the same point, and reconnects to the second
+        conn = Connection(f'replay://{self.path}', auto_reconnect=True)
+        self.assertEqual(conn.get('answer()'), 42)
+        self.assertEqual(conn.get('answer()'), 42)
+        self.assertEqual(conn.get('"Hello"'), 'Hello')
+        conn.disconnect()
+
+    def test_not_a_capture(self):
+
+        with open(self.path, 'wb') as file:
+            file.write(b'not a capture')
+
+        self.assertRaises(MdsException, list, readCapture(self.path))
+
+    def test_record_fails(self):
+
+        # A connection that fails to create its capture is cleaned up without errors
+        unraisable = []
+        previous_hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+        try:
+            self.assertRaises(OSError, Connection, '127.0.0.1:1', record=os.path.join(self.path, 'missing', 'x.mdscap'))
+            gc.collect()
+        finally:
+            sys.unraisablehook = previous_hook
+
+        self.assertEqual(unraisable, [])
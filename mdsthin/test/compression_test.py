@@ -0,0 +1,84 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import unittest
+
+import numpy
+
+from ..compression import *
+from ..message import *
+
+class CompressionTest(unittest.TestCase):
+
+    def test_policy(self):
+
+        policy = CompressionPolicy()
+
+        zeros = numpy.zeros(100000).tobytes()
+        noise = numpy.random.default_rng(0).random(100000).tobytes()
+
+        # Small, incompressible or unnegotiated payloads are sent uncompressed
+        self.assertEqual(policy.chooseLevel(b'\0' * 100, 6), 0)
+        self.assertEqual(policy.chooseLevel(noise, 6), 0)
+        self.assertEqual(policy.chooseLevel(zeros, 0), 0)
+
+        # Until the throughput is known, the negotiated level is used
+        self.assertIsNone(policy.throughput)
+        self.assertEqual(policy.chooseLevel(zeros, 6), 6)
+
+        # Small transfers are ignored, as they mostly measure latency
+        policy.recordTransfer(100, 1.0)
+        self.assertIsNone(policy.throughput)
+
+        # Fast links disable compression, slow links use more of it
+        policy.recordTransfer(1000 * 1000 * 1000, 1.0)
+        self.assertEqual(policy.chooseLevel(zeros, 6), 0)
+
+        slow = CompressionPolicy()
+        slow.recordTransfer(1000 * 1000, 1.0)
+        self.assertEqual(slow.chooseLevel(zeros, 6), 6)
+        self.assertEqual(slow.chooseLevel(zeros, 3), 3)
+
+    def test_message_compress(self):
+
+        data = numpy.zeros(10000, dtype=numpy.int32)
+        msg = Message(data)
+        original_msglen = msg.msglen
+
+        self.assertTrue(msg.compress(6))
+        self.assertTrue(msg.client_type & COMPRESSED)
+        self.assertLess(msg.msglen, original_msglen)
+
+        # The compressed data is prefixed with the original msglen
+        prefix = ctypes.c_uint32.from_buffer_copy(msg.buffer[ : 4 ])
+        self.assertEqual(prefix.value, original_msglen)
+
+        received = Message.from_buffer_copy(bytes(msg))
+        self.assertEqual(received.unpack_data(bytearray(msg.buffer)), Int32Array(data))
+
+        # Data that does not shrink is left alone
+        msg = Message(numpy.random.default_rng(0).random(100))
+        self.assertFalse(msg.compress(6))
+        self.assertFalse(msg.client_type & COMPRESSED)
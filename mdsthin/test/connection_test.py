@@ -23,10 +23,16 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import sys
+import asyncio
+import logging
 import getpass
 import unittest
 
 from ..connection import *
+from ..pool import *
+from ..connection import _SubprocessSocket
+from ..async_connection import *
 from ..functions import *
 
 class ConnectionTest(unittest.TestCase):
@@ -52,6 +58,7 @@ class ConnectionTest(unittest.TestCase):
             else:
                 cls.PORT = 8000
 
+            cls.URL = url
             cls.conn = Connection(url)
 
     def setUp(self):
@@ -130,6 +137,223 @@ class ConnectionTest(unittest.TestCase):
         self.assertEqual(gm.get('b'), 'Hello, World!')
         self.assertRaises(TreeNOT_OPEN, gm.get, 'c')
 
+    def test_prepared_getmany(self):
+
+        gm = self.conn.getMany()
+        gm.append('double', '$ * 2', Parameter('x'))
+        gm.append('fixed', '$ + 1', 41)
+        gm.prepare()
+
+        for x in range(5):
+            gm.execute(x=x)
+            self.assertEqual(gm.get('double'), x * 2)
+            self.assertEqual(gm.get('fixed'), 42)
+
+        self.assertRaises(MdsException, gm.execute)
+
+    def test_getmany_batches(self):
+
+        with ConnectionPool(self.URL, max_connections=2, timeout=self.TIMEOUT) as pool:
+            options = [
+                { 'max_queries': 2 },
+                { 'max_reply_size': 10000, 'probe_sizes': True },
+                { 'max_queries': 2, 'dispatch': BATCH_DISPATCH_PIPELINED },
+                { 'max_queries': 2, 'dispatch': BATCH_DISPATCH_POOL, 'pool': pool },
+            ]
+
+            for kwargs in options:
+                with self.subTest(**{ key: value for key, value in kwargs.items() if key != 'pool' }):
+                    gm = self.conn.getMany(**kwargs)
+                    # An odd number of queries before it, so that the variable is used across a split
+                    for i in range(5):
+                        gm.append(f'zero{i}', f'zero(1000, {i}.0)')
+
+                    # The variable has to be evaluated in the same batch as it was assigned
+                    gm.append('assign', '_mdsthin_batch = 42')
+                    gm.append('use', '_mdsthin_batch')
+                    gm.append('error', 'asdf')
+                    result = gm.execute()
+
+                    self.assertEqual(len(result), 8)
+                    for i in range(5):
+                        self.assertTrue((gm.get(f'zero{i}').data() == i).all())
+
+                    self.assertEqual(gm.get('use'), 42)
+                    self.assertRaises(TreeNOT_OPEN, gm.get, 'error')
+
+    def test_pipeline(self):
+
+        p = self.conn.pipeline(max_in_flight=4)
+        for i in range(300):
+            p.append(i, '$ * 2', i)
+        p.append('error', 'asdf')
+        p.append('empty', '')
+        result = p.execute()
+
+        self.assertEqual(len(result), 302)
+        for i in range(300):
+            self.assertEqual(p.get(i), i * 2)
+        self.assertRaises(TreeNOT_OPEN, p.get, 'error')
+        self.assertEqual(type(p.get('empty')), Descriptor)
+
+        # The connection should still be usable after the message_id has wrapped around
+        self.assertEqual(self.conn.get('42'), 42)
+
+    def test_get_into(self):
+
+        out = numpy.ones(1000, dtype=numpy.float32)
+        result = self.conn.getInto('zero(1000, 0.0)', out=out)
+        self.assertTrue(numpy.may_share_memory(result.data(), out))
+        self.assertTrue((out == 0).all())
+
+        self.assertRaises(MdsException, self.conn.getInto, 'zero(10, 0.0)', out=out)
+        self.assertRaises(MdsException, self.conn.getInto, 'zero(1000, 0)', out=out)
+
+    def test_chunked(self):
+
+        expected = numpy.arange(30000, dtype=numpy.int32).reshape(100, 300)
+        result = self.conn.getChunked('set_range(300, 100, 0 : 29999)', chunk_size=10000)
+        self.assertIsInstance(result, Int32Array)
+        self.assertTrue(numpy.array_equal(result.data(), expected))
+
+        out = numpy.empty_like(expected)
+        result = self.conn.getChunked('set_range(300, 100, 0 : 29999)', chunk_size=10000, out=out)
+        self.assertTrue(numpy.may_share_memory(result.data(), out))
+        self.assertTrue(numpy.array_equal(out, expected))
+
+        # The chunks of a put() are joined by the server, more than MAX_JOINED_CHUNKS at a time
+        data = numpy.arange(30000, dtype=numpy.float64)
+        with self.conn._chunkedVariables() as variables:
+            self.conn._putChunked('_mdsthin_test', data, 400, None, variables)
+            self.assertTrue(numpy.array_equal(self.conn.get('_mdsthin_test').data(), data))
+            self.assertEqual(variables, [ '_mdsthin_test' ])
+
+        self.assertRaises(TdiUNKNOWN_VAR, self.conn.get, '_mdsthin_test')
+
+    def test_async(self):
+
+        async def run():
+            async with AsyncConnection(self.URL, timeout=self.TIMEOUT) as conn:
+
+                results = await asyncio.gather(*[ conn.get('$ * 2', i) for i in range(300) ])
+                self.assertListEqual([ result.data() for result in results ], [ i * 2 for i in range(300) ])
+
+                with self.assertRaises(TreeNOT_OPEN):
+                    await conn.get('asdf')
+
+                gm = conn.getMany()
+                gm.append('a', '42')
+                gm.append('b', '"Hello, World!"')
+                await gm.execute()
+
+                self.assertEqual(gm.get('a'), 42)
+                self.assertEqual(gm.get('b'), 'Hello, World!')
+
+        asyncio.run(run())
+
+    def test_reconnect(self):
+
+        conn = Connection(self.URL, timeout=self.TIMEOUT, auto_reconnect=True)
+        conn.registerHelper('Double', 'public fun Double(in _x) { return(_x * 2); }')
+        self.assertEqual(conn.get('Double(21)'), 42)
+
+        # Simulate the connection dropping, the helper should be defined again
+        conn._socket.close()
+        self.assertEqual(conn.get('Double(21)'), 42)
+
+        # Requests with side effects are not retried
+        conn._socket.close()
+        self.assertRaises(OSError, conn.get, '_x = 1', idempotent=False)
+        self.assertEqual(conn.get('Double(2)'), 4)
+
+        conn.disconnect()
+
+    def test_thread_safe(self):
+        import threading
+
+        conn = Connection(self.URL, timeout=self.TIMEOUT, thread_safe=True)
+        errors = []
+
+        def worker(offset):
+            try:
+                for i in range(50):
+                    self.assertEqual(conn.get('$ * 2', offset + i), 2 * (offset + i))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [ threading.Thread(target=worker, args=(i * 1000,)) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        conn.disconnect()
+
+    def test_submit(self):
+
+        conn = Connection(self.URL, timeout=self.TIMEOUT, thread_safe=True)
+
+        futures = [ conn.submit('$ * 2', i) for i in range(100) ]
+        self.assertEqual([ future.result() for future in futures ], [ i * 2 for i in range(100) ])
+
+        self.assertEqual(list(conn.map([ '1', ('$ + 1', 1) ])), [ 1, 2 ])
+        self.assertIsInstance(conn.submit('1 +').exception(), MdsException)
+
+        gm = conn.getMany()
+        gm.append('a', '42')
+        gm.submit().result()
+        self.assertEqual(gm.get('a'), 42)
+
+        conn.disconnect()
+
+        self.assertRaises(MdsException, self.conn.submit, '1')
+
+    def test_interceptors(self):
+
+        seen = []
+        def log(request, proceed):
+            seen.append(request.expr)
+            return proceed(request)
+
+        def rewrite(request, proceed):
+            if request.expr == 'ANSWER':
+                request = request._replace(expr='$ * 2', args=(21,))
+            return proceed(request)
+
+        conn = Connection(self.URL, timeout=self.TIMEOUT, interceptors=[ log ])
+        conn.addInterceptor(rewrite)
+
+        # The outermost interceptor sees the request before it is rewritten
+        self.assertEqual(conn.get('ANSWER'), 42)
+        self.assertEqual(seen, [ 'ANSWER' ])
+
+        conn.removeInterceptor(rewrite)
+        conn.tcl('show version')
+        self.assertEqual(seen[-1], 'Tcl($,_res);_res')
+
+        # Pipelined requests go through the interceptors too
+        p = conn.pipeline()
+        p.append('a', '$ + 1', 41)
+        self.assertEqual(p.execute()['a'], 42)
+        self.assertEqual(seen[-1], '$ + 1')
+
+        conn.disconnect()
+
+    def test_connection_pool(self):
+
+        with ConnectionPool(self.URL, max_connections=2, timeout=self.TIMEOUT) as pool:
+
+            with pool.connection() as a:
+                with pool.connection() as b:
+                    self.assertIsNot(a, b)
+                    self.assertRaises(TimeoutError, pool.acquire, timeout=0.1)
+
+            # The most recently returned connection is reused
+            with pool.connection() as c:
+                self.assertIs(c, a)
+                self.assertEqual(c.get('42'), 42)
+
     def test_root_whoami(self):
 
         root_conn = Connection(f'root@{self.SERVER}')
@@ -168,6 +392,23 @@ class ConnectionTest(unittest.TestCase):
                 f'Connection("{url}") failed'
             )
 
+        if sys.platform != 'win32':
+            from ..connection import _ssh_control_masters
+
+            url = f'ssh://{self.USERNAME}@{self.SERVER}'
+            with Connection(url, timeout=self.TIMEOUT, ssh_share_connection=True) as conn1:
+                with Connection(url, timeout=self.TIMEOUT, ssh_share_connection=True) as conn2:
+                    self.assertEqual(len(_ssh_control_masters), 1)
+                    self.assertEqual(conn2.get('whoami()').data(), self.USERNAME)
+
+                # The control master must still work after the second connection is closed
+                self.assertEqual(conn1.get('whoami()').data(), self.USERNAME)
+
+            self.assertEqual(
+                len(_ssh_control_masters), 0,
+                f'Connection("{url}", ssh_share_connection=True) did not stop the control master'
+            )
+
         # TODO: Test ssh_subprocess_args
         # TODO: Test plink
 
@@ -209,6 +450,18 @@ class ConnectionTest(unittest.TestCase):
                     f'Connection("{url}", ssh_backend="paramiko") failed'
                 )
 
+            url = f'ssh://{self.USERNAME}@{self.SERVER}'
+            with Connection(url, timeout=self.TIMEOUT, ssh_backend='paramiko', ssh_share_connection=True) as conn1:
+                with Connection(url, timeout=self.TIMEOUT, ssh_backend='paramiko', ssh_share_connection=True) as conn2:
+                    self.assertIs(
+                        conn1._socket._client, conn2._socket._client,
+                        f'Connection("{url}", ssh_backend="paramiko", ssh_share_connection=True) did not share the client'
+                    )
+                    self.assertEqual(conn2.get('whoami()').data(), self.USERNAME)
+
+                # The shared client must still work after the second connection is closed
+                self.assertEqual(conn1.get('whoami()').data(), self.USERNAME)
+
             # TODO: Test ssh_paramiko_options
 
         except ImportError:
@@ -313,3 +566,50 @@ class ConnectionTest(unittest.TestCase):
         self.assertEqual(type(result), Descriptor)
         self.assertEqual(result.data(), None)
 
+
+@unittest.skipIf(sys.platform == 'win32', 'selectors cannot wait on pipes on Windows')
+class SubprocessSocketTest(unittest.TestCase):
+
+    def _spawn(self, *command):
+        import subprocess
+
+        proc = subprocess.Popen(
+            [ sys.executable, '-c', *command ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+
+        sock = _SubprocessSocket(proc, 2.0, logging.getLogger(__name__))
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_echo(self):
+
+        # Echo stdin back to stdout
+        sock = self._spawn('import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer, 1)')
+
+        # Small enough to fit in the pipes, as we send everything before receiving
+        data = bytes(range(256)) * 64
+        sock.sendall(data)
+
+        buffer = bytearray(len(data))
+        view = memoryview(buffer)
+        while len(view) > 0:
+            view = view[ sock.recv_into(view, len(view), 0) : ]
+
+        self.assertEqual(buffer, data)
+
+    def test_timeout(self):
+
+        sock = self._spawn('import time; time.sleep(10)')
+        self.assertRaises(TimeoutError, sock.recv_into, bytearray(1), 1, 0)
+
+    def test_exit(self):
+
+        sock = self._spawn('import sys; sys.stderr.write("Permission denied\\n"); sys.exit(255)')
+
+        with self.assertLogs(__name__, 'WARNING'):
+            with self.assertRaisesRegex(BrokenPipeError, 'Permission denied'):
+                sock.recv_into(bytearray(1), 1, 0)
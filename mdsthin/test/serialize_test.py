@@ -27,6 +27,7 @@ import unittest
 
 from ..descriptors import *
 from ..functions import *
+from ..message import *
 
 class SerializeTest(unittest.TestCase):
 
@@ -131,3 +132,90 @@ class SerializeTest(unittest.TestCase):
 
                 buffer = data.pack()
                 self.assertEqual(buffer, info['buffer'])
+
+    def test_message_buffers(self):
+
+        data = numpy.arange(12, dtype=numpy.float64).reshape(3, 4)
+
+        for value in [ data, data[:, ::2], numpy.asfortranarray(data), Float64Array(data), StringArray(['one', 'seven']) ]:
+            with self.subTest(repr(value)):
+
+                msg = Message(value)
+                expected = Message(Descriptor(value))
+
+                # Sending the header and data separately should match packing them together
+                self.assertEqual(b''.join(msg.pack_buffers()), expected.pack())
+                self.assertEqual(msg.msglen, len(expected.pack()))
+
+        # Contiguous arrays are sent from their original memory
+        header, buffer = Message(data).pack_buffers()
+        self.assertTrue(numpy.may_share_memory(numpy.frombuffer(buffer, dtype=numpy.uint8), data))
+
+    def test_message_decompressor(self):
+        import zlib
+
+        data = numpy.repeat(numpy.arange(100, dtype=numpy.int32), 100).reshape(100, 100)
+        msg = Message(data)
+        original_msglen = msg.msglen
+
+        msg.client_type |= COMPRESSED
+        buffer = bytes(ctypes.c_uint32(original_msglen)) + zlib.compress(bytes(msg.buffer))
+        msg.msglen = ctypes.sizeof(Message) + len(buffer)
+
+        # Feed the compressed data in small chunks, as if it were arriving from the network
+        decompressor = MessageDecompressor(msg, buffer[ : 4 ])
+        for i in range(4, len(buffer), 7):
+            decompressor.decompress(buffer[ i : i + 7 ])
+
+        self.assertEqual(msg.msglen, original_msglen)
+        self.assertEqual(msg.unpack_data(decompressor.finish()), Int32Array(data))
+
+        # Truncated data should not be silently accepted
+        msg.msglen = ctypes.sizeof(Message) + len(buffer)
+        msg.client_type |= COMPRESSED
+        decompressor = MessageDecompressor(msg, buffer[ : 4 ])
+        decompressor.decompress(buffer[ 4 : -8 ])
+        self.assertRaises(MdsException, decompressor.finish)
+
+        # Data that inflates past the original msglen fails without being inflated first
+        msg = Message(numpy.zeros(4, dtype=numpy.int32))
+        compressed = zlib.compress(bytes(64 * 1024 * 1024))
+        msg.client_type |= COMPRESSED
+        msg.msglen = ctypes.sizeof(Message) + 4 + len(compressed)
+        decompressor = MessageDecompressor(msg, bytes(ctypes.c_uint32(ctypes.sizeof(Message) + 16)))
+        self.assertRaises(MdsException, decompressor.decompress, compressed)
+        self.assertEqual(decompressor.received, 16)
+
+    def test_lazy_dictionary(self):
+
+        data = Dictionary({
+            'y': Dictionary({ 'value': Float32Array([ 1.0, 2.0, 3.0 ]) }),
+            'x': Dictionary({ 'value': String('seconds') }),
+            'missing': Dictionary({ 'error': String('%TREE-W-NNF, Node Not Found') }),
+        })
+
+        buffer = data.pack()
+        original = bytes(buffer)
+        result = Descriptor.unpack(buffer, lazy=True)
+
+        # Only the keys are unpacked up front
+        self.assertEqual(len(result._data._values), 0)
+        self.assertEqual(len(result), 3)
+        self.assertEqual([ key.data() for key in result.keys() ], [ 'y', 'x', 'missing' ])
+        self.assertIn('y', result)
+        self.assertNotIn('z', result)
+
+        self.assertEqual(result['x']['value'], 'seconds')
+        self.assertEqual(len(result._data._values), 1)
+
+        self.assertEqual(result['y']['value'].data().tolist(), [ 1.0, 2.0, 3.0 ])
+        self.assertEqual(result['missing'].data(), { 'error': '%TREE-W-NNF, Node Not Found' })
+        self.assertEqual(result.pack(), original)
+
+        result['z'] = 5
+        data['z'] = 5
+        self.assertEqual(result['z'], 5)
+        self.assertEqual(result.pack(), data.pack())
+
+        # Unpacking reads the buffer in place, and does not modify it
+        self.assertEqual(buffer, original)
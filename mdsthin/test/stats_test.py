@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import unittest
+
+from ..stats import *
+
+class StatsTest(unittest.TestCase):
+
+    def test_latency_histogram(self):
+
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+
+        for i in range(1, 101):
+            histogram.record(i / 1000)
+
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['min'], 0.001)
+        self.assertEqual(summary['max'], 0.1)
+        self.assertAlmostEqual(summary['mean'], 0.0505)
+
+        # The percentiles are estimated to within the width of a bucket
+        self.assertAlmostEqual(summary['p50'], 0.050, delta=0.050 * 0.13)
+        self.assertAlmostEqual(summary['p90'], 0.090, delta=0.090 * 0.13)
+        self.assertLessEqual(summary['p99'], 0.1)
+
+    def test_connection_stats(self):
+
+        stats = ConnectionStats()
+        stats.recordRequest()
+        stats.recordSent(148, 1048)
+        stats.recordReceived(48, 48)
+
+        with stats.operation('GetMany.execute'):
+            # Nested operations are part of the outer one
+            with stats.operation('get'):
+                pass
+
+        with self.assertRaises(ValueError):
+            with stats.operation('get'):
+                raise ValueError()
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertEqual(snapshot['bytes_sent'], 148)
+        self.assertAlmostEqual(snapshot['compression_ratio_sent'], 1048 / 148)
+        self.assertEqual(snapshot['compression_ratio_received'], 1.0)
+        self.assertEqual(snapshot['operations']['GetMany.execute']['count'], 1)
+        self.assertEqual(snapshot['operations']['get']['count'], 1)
+        self.assertEqual(snapshot['operations']['get']['errors'], 1)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()['operations'], {})
+        self.assertIsNone(stats.snapshot()['compression_ratio_sent'])
+
+    def test_request_timing(self):
+
+        timing = RequestTiming('$ * 2')
+        timing.wait = 0.5
+        timing.bytes_sent = 109
+
+        self.assertEqual(timing.expr, '$ * 2')
+        self.assertIn('wait=500.000ms', repr(timing))
+        self.assertIn('bytes_sent=109', repr(timing))
+
+    def test_fingerprint(self):
+
+        self.assertEqual(fingerprint('TreeOpen("cmod", 1234567)'), 'TreeOpen(?, ?)')
+        self.assertEqual(fingerprint('getnci($1,  "LENGTH")'), 'getnci($, ?)')
+        self.assertEqual(fingerprint('\\IP2 + 1.5D0 * 42QU'), '\\IP2 + ? * ?')
+        self.assertEqual(fingerprint('SIGNAL_01[10:20]'), 'SIGNAL_01[?:?]')
+
+    def test_slow_query_log(self):
+
+        records = []
+        slow_query_log = SlowQueryLog(threshold=1.0, callback=records.append)
+
+        for shot, total in [ (1, 0.1), (2, 0.2), (3, 2.0) ]:
+            timing = RequestTiming(f'TreeOpen("cmod", {shot})')
+            timing.total = total
+            slow_query_log(timing)
+
+        timing = RequestTiming('\\IP')
+        timing.total = 0.5
+        slow_query_log(timing)
+
+        # Only the slow request is recorded, but all of them are totalled
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['fingerprint'], 'TreeOpen(?, ?)')
+        self.assertEqual(records[0]['total'], 2.0)
+
+        top = slow_query_log.top(1)
+        self.assertEqual(top[0][0], 'TreeOpen(?, ?)')
+        self.assertEqual(top[0][1]['count'], 3)
+        self.assertEqual(top[0][1]['slow'], 1)
+        self.assertAlmostEqual(top[0][1]['total'], 2.3)
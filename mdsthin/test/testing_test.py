@@ -0,0 +1,647 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import re
+import time
+import asyncio
+import numpy
+import threading
+import unittest
+
+from ..connection import *
+from ..pool import *
+from ..async_connection import *
+from ..descriptors import *
+from ..exceptions import *
+from ..testing import *
+
+class TestingServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MdsipTestServer(
+            trees={
+                'test': {
+                    '\\IP': Signal(Float32Array(numpy.arange(5, dtype=numpy.float32)), None, Float64Array(numpy.linspace(0, 1, 5))),
+                    'NUMERIC': Int32(42),
+                    'TEXT': 'hello',
+                    'EMPTY': None,
+                },
+            },
+            expressions={
+                'answer()': Int32(42),
+                'double($)': lambda x: x.data() * 2,
+            },
+        )
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_get(self):
+        c = Connection(self.server.url)
+
+        self.assertEqual(c.get('whoami()'), c._username)
+        self.assertEqual(c.get('1'), Int32(1))
+        self.assertEqual(c.get('1Q'), Int64(1))
+        self.assertEqual(c.get('1.5D0'), Float64(1.5))
+        self.assertEqual(c.get('"hello"'), 'hello')
+        self.assertEqual(c.get('$2', 1, 2), 2)
+        self.assertEqual(c.get('answer()'), 42)
+        self.assertEqual(c.get('double($)', 21), 42)
+        self.assertEqual(c.get('_x = 7'), 7)
+        self.assertEqual(c.get('_x'), 7)
+        self.assertEqual(c.getServerVersion(), TESTING_SERVER_VERSION)
+
+        with self.assertRaises(TdiSYNTAX):
+            c.get('1 +')
+
+        with self.assertRaises(TdiUNKNOWN_VAR):
+            c.get('_y')
+
+        with self.assertRaises(TreeNOT_OPEN):
+            c.get('\\IP')
+
+    def test_tree(self):
+        c = Connection(self.server.url)
+
+        c.openTree('test', 1)
+        self.assertEqual(c.get('numeric'), 42)
+        self.assertEqual(c.get('\\IP').data().tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(c.get('dim_of(\\IP)').data().tolist(), [0, 0.25, 0.5, 0.75, 1])
+        self.assertIsInstance(c.getObject('\\IP'), Signal)
+
+        with self.assertRaises(TreeNODATA):
+            c.get('EMPTY')
+
+        with self.assertRaises(TreeNNF):
+            c.get('MISSING')
+
+        c.put('EMPTY', '$', numpy.arange(3, dtype=numpy.int32))
+        self.assertEqual(self.server.getNode('test', 'empty').data().tolist(), [0, 1, 2])
+
+        c.closeTree('test', 1)
+        with self.assertRaises(TreeNOT_OPEN):
+            c.closeTree('test', 1)
+
+        with self.assertRaises(TreeFILE_NOT_FOUND):
+            c.openTree('missing', 1)
+
+        c.openTree('test', 1, mode='readonly')
+        with self.assertRaises(TreeREADONLY):
+            c.put('EMPTY', '1')
+
+        self.assertEqual(c.closeAllTrees(), 1)
+
+    def test_get_many(self):
+        c = Connection(self.server.url)
+        c.openTree('test', 1)
+
+        gm = c.getMany()
+        gm.append('y', '_sig = \\IP')
+        gm.append('x', 'dim_of(_sig)')
+        gm.append('arg', '$', 5)
+        gm.append('missing', 'MISSING')
+        gm.execute()
+
+        self.assertIsInstance(gm.get('y'), Signal)
+        self.assertEqual(gm.get('x').data().tolist(), [0, 0.25, 0.5, 0.75, 1])
+        self.assertEqual(gm.get('arg'), 5)
+
+        with self.assertRaises(TreeNNF):
+            gm.get('missing')
+
+        pm = c.putMany()
+        pm.append('TEXT', '$', 'goodbye')
+        pm.append('MISSING', '1')
+        result = pm.execute()
+
+        self.assertEqual(result['TEXT'], 'Success')
+        self.assertEqual(result['MISSING'], str(TreeNNF()))
+        self.assertEqual(self.server.getNode('test', 'TEXT'), 'goodbye')
+
+    def test_compression(self):
+        self.server.compression_level = 5
+        c = Connection(self.server.url, compression_level=9)
+        self.assertEqual(c._compression_level, 5)
+
+        data = numpy.zeros(100000, dtype=numpy.float64)
+        self.assertTrue(numpy.array_equal(c.get('$', data).data(), data))
+
+        stats = c.stats()
+        self.assertLess(stats['bytes_received'], data.nbytes)
+
+        # An invalid level is rejected before anything is sent, including one set by an interceptor
+        count = self.server.request_count
+        self.assertRaises(MdsException, c.get, '$', data, compression_level=12)
+        self.assertRaises(MdsException, c.put, 'NUMERIC', '$', 1, compression_level=-1)
+
+        c.addInterceptor(lambda request, proceed: proceed(request._replace(compression_level=10)))
+        self.assertRaises(MdsException, c.get, '$', data)
+        self.assertEqual(self.server.request_count, count)
+
+        c = Connection(self.server.url, thread_safe=True)
+        self.assertRaises(MdsException, c.submit, '1', compression_level=10)
+
+        async def run():
+            async with AsyncConnection(self.server.url) as c:
+                with self.assertRaises(MdsException):
+                    await c.get('1', compression_level=10)
+
+        asyncio.run(run())
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        c = Connection(self.server.url)
+
+        # Pipelined requests overlap their round trips, so this takes about one round trip
+        p = c.pipeline()
+        for i in range(20):
+            p.append(str(i), '$', i)
+
+        start = time.monotonic()
+        result = p.execute()
+        self.assertLess(time.monotonic() - start, 0.05 * 10)
+        self.assertEqual(result['19'], 19)
+
+    def test_interceptors(self):
+        seen = []
+        def log(request, proceed):
+            seen.append(request.expr)
+            return proceed(request)
+
+        c = Connection(self.server.url, thread_safe=True, interceptors=[ log ])
+
+        p = c.pipeline()
+        p.append('answer', 'answer()')
+        p.append('missing', '_missing')
+        result = p.execute()
+
+        self.assertEqual(result['answer'], 42)
+        self.assertIsInstance(result['missing'], TdiUNKNOWN_VAR)
+        self.assertEqual(seen, [ 'answer()', '_missing' ])
+
+        self.assertEqual(c.submit('double($)', 21).result(), 42)
+        self.assertEqual(seen[-1], 'double($)')
+
+        gm = c.getMany(max_queries=1, dispatch=BATCH_DISPATCH_PIPELINED)
+        gm.append('a', 'answer()')
+        gm.append('b', 'answer()')
+        gm.execute()
+        self.assertEqual(seen[-2 : ], [ 'GetManyExecute($)', 'GetManyExecute($)' ])
+
+    def test_reconnect(self):
+        c = Connection(self.server.url, auto_reconnect=True)
+        c.openTree('test', 1)
+
+        self.server.dropConnections()
+
+        self.assertEqual(c.get('NUMERIC'), 42)
+        self.assertEqual(self.server.connection_count, 2)
+
+        # Pipelined requests are sent again after reconnecting too
+        self.server.dropConnections()
+        p = c.pipeline()
+        p.append('numeric', 'NUMERIC')
+        self.assertEqual(p.execute()['numeric'], 42)
+        self.assertEqual(self.server.connection_count, 3)
+
+        # A slow reply is not mistaken for a lost connection, and is not sent again
+        calls = []
+        self.server.expressions['slow()'] = lambda: calls.append(time.sleep(1)) or 1
+
+        c = Connection(self.server.url, timeout=0.5, auto_reconnect=True)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            c.get('slow()')
+
+        self.assertLess(time.monotonic() - start, 0.9)
+        time.sleep(0.6)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.server.connection_count, 4)
+
+    def test_pool(self):
+        pool = ConnectionPool(self.server.url, max_connections=4)
+
+        def worker():
+            for _ in range(10):
+                with pool.connection() as c:
+                    self.assertEqual(c.get('1'), 1)
+
+        threads = [ threading.Thread(target=worker) for _ in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pool.close()
+
+        self.assertLessEqual(self.server.connection_count, 4)
+        self.assertGreaterEqual(self.server.request_count, 80)
+
+        # The limit for a host is shared by every pool connecting to it
+        first = ConnectionPool(self.server.url, max_host_connections=2)
+        second = ConnectionPool(self.server.url)
+        try:
+            a = first.acquire()
+            b = second.acquire()
+            with self.assertRaises(TimeoutError):
+                second.acquire(timeout=0.2)
+
+            # An idle connection of another pool is closed to make room
+            first.release(a)
+            c = second.acquire(timeout=0.2)
+            self.assertIsNot(c, a)
+            self.assertIsNone(a._socket)
+
+            second.release(b)
+            second.release(c)
+
+        finally:
+            ConnectionPool.setHostLimit(self.server.url, None)
+            first.close()
+            second.close()
+
+    def test_pool_tree(self):
+        from ..ext import Tree
+
+        def default_nid():
+            raise TreeNNF()
+
+        self.server.expressions['GetDefaultNid()'] = default_nid
+        self.server.expressions['getnci($,"FULLPATH")'] = '\\TEST::TOP'
+
+        pool = ConnectionPool(self.server.url, max_connections=2)
+
+        # Failing to open a tree, or anything after it, returns the leased connection
+        for _ in range(3):
+            with self.assertRaises(TreeFILE_NOT_FOUND):
+                Tree('missing', 1, conn=pool)
+
+            with self.assertRaises(TreeNNF):
+                Tree('test', 1, conn=pool)
+
+        self.server.expressions['GetDefaultNid()'] = 0
+
+        with Tree('test', 1, conn=pool) as tree:
+            node = tree.top
+            self.assertEqual(node.fullpath, '\\TEST::TOP')
+
+        # The connection went back to the pool with its trees closed, and the nodes stop using it
+        with pool.connection(timeout=1) as c:
+            self.assertEqual(c._open_trees, [])
+
+        with self.assertRaises(MdsException):
+            node.fullpath
+
+        pool.close()
+
+    def test_deadline(self):
+        self.server.expressions['sleep($)'] = lambda seconds: time.sleep(seconds.data()) or 1
+        self.server.expressions['large()'] = numpy.arange(1000000, dtype=numpy.float32)
+
+        c = Connection(self.server.url)
+        c.openTree('test', 1)
+
+        # Cancelled before the reply arrives, so we reconnect and reopen the tree
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            c.get('sleep($)', 1.0, deadline=0.2)
+        self.assertLess(time.monotonic() - start, 0.9)
+
+        self.assertEqual(c.get('NUMERIC'), 42)
+        self.assertEqual(self.server.connection_count, 2)
+
+        # Cancelled part way through receiving the reply, so the rest of it is drained
+        self.server.bandwidth = 8 * 1024 * 1024
+        with self.assertRaises(DeadlineExceeded):
+            c.get('large()', deadline=0.1)
+
+        self.assertEqual(c.get('NUMERIC'), 42)
+        self.assertEqual(self.server.connection_count, 2)
+
+        self.assertEqual(c.get('large()', deadline=10).data().shape, (1000000,))
+
+        gm = c.getMany()
+        gm.append('x', 'sleep($)', 1.0)
+        with self.assertRaises(DeadlineExceeded):
+            gm.execute(deadline=0.2)
+
+    def test_cancel(self):
+        self.server.expressions['sleep($)'] = lambda seconds: time.sleep(seconds.data()) or 1
+
+        c = Connection(self.server.url, thread_safe=True)
+
+        timer = threading.Timer(0.2, c.cancel)
+        timer.start()
+
+        with self.assertRaises(RequestCancelled):
+            c.get('sleep($)', 1.0)
+
+        timer.join()
+        self.assertEqual(c.get('1'), 1)
+
+    def test_prepared_get_many(self):
+        c = Connection(self.server.url)
+
+        gm = c.getMany()
+        gm.append('_open', 'TreeOpen($,$)', Parameter('tree'), Parameter('shot'))
+        gm.append('numeric', 'NUMERIC')
+        gm.append('shot', '$', Parameter('shot'))
+        gm.append('array', '$', numpy.arange(3, dtype=numpy.int32))
+
+        expected = c.getMany()
+        expected.append('_open', 'TreeOpen($,$)', 'test', 42)
+        expected.append('numeric', 'NUMERIC')
+        expected.append('shot', '$', 42)
+        expected.append('array', '$', numpy.arange(3, dtype=numpy.int32))
+
+        # The prepared queries serialize to the same bytes as building them from scratch
+        gm.prepare()
+        self.assertEqual(gm._serialize({ 'tree': 'test', 'shot': 42 }).data().tobytes(), expected._queries.serialize().data().tobytes())
+
+        for shot in [ 1, 2, 3 ]:
+            gm.execute(tree='test', shot=shot)
+            self.assertEqual(gm.get('numeric'), 42)
+            self.assertEqual(gm.get('shot'), shot)
+            self.assertEqual(gm.get('array').data().tolist(), [ 0, 1, 2 ])
+
+        with self.assertRaises(MdsException):
+            gm.execute(tree='test')
+
+        with self.assertRaises(MdsException):
+            gm.execute(tree='test', shot=1, unknown=2)
+
+        # Changing the queries undoes prepare()
+        gm.remove('array')
+        gm.execute(tree='test', shot=4)
+        self.assertIsNone(gm.get('array'))
+        self.assertEqual(gm.get('shot'), 4)
+
+    def test_async_get_many(self):
+
+        async def run():
+            async with AsyncConnection(self.server.url) as c:
+                await c.get('setenv("test_path=/old")')
+                await c.openTree('test', 1, mode='readonly', path='/trees')
+                self.assertEqual(await c.get('getenv("test_path")'), '/old')
+
+                gm = c.getMany(max_queries=1)
+                gm.append('numeric', 'NUMERIC')
+                gm.append('shot', '$', Parameter('shot'))
+                gm.prepare()
+
+                for shot in [ 1, 2 ]:
+                    await gm.execute(shot=shot)
+                    self.assertEqual(gm.get('numeric'), 42)
+                    self.assertEqual(gm.get('shot'), shot)
+
+                with self.assertRaises(MdsException):
+                    await gm.execute()
+
+                # Only the methods that can be awaited are supported
+                self.assertRaises(MdsException, gm.execute_iter)
+                self.assertRaises(MdsException, gm.submit)
+                self.assertRaises(MdsException, c.getMany, probe_sizes=True)
+                self.assertRaises(MdsException, c.getMany, dispatch=BATCH_DISPATCH_PIPELINED)
+                self.assertRaises(MdsException, c.putMany, dispatch=BATCH_DISPATCH_PIPELINED)
+
+                with self.assertRaises(TypeError):
+                    await c.openTree('test', 1, mode='new')
+
+        asyncio.run(run())
+
+    def test_async_put_many(self):
+
+        async def run():
+            async with AsyncConnection(self.server.url) as c:
+                await c.openTree('test', 1)
+
+                pm = c.putMany(max_queries=1)
+                pm.append('NUMERIC', '$', 7)
+                pm.append('TEXT', '$', 'written')
+                result = await pm.execute()
+
+                self.assertEqual(len(result), 2)
+                self.assertEqual(result['NUMERIC'], 'Success')
+                self.assertEqual(self.server.getNode('test', 'NUMERIC'), 7)
+                self.assertEqual(self.server.getNode('test', 'TEXT'), 'written')
+
+        asyncio.run(run())
+
+    def test_get_many_iter(self):
+        self.server.addTree('large', { 'SIG': numpy.arange(1000000, dtype=numpy.float32) })
+
+        for compression_level in [ 0, 5 ]:
+            with self.subTest(compression_level=compression_level):
+                self.server.compression_level = compression_level
+                c = Connection(self.server.url, compression_level=compression_level)
+                c.openTree('large', 1)
+
+                gm = c.getMany()
+                for i in range(4):
+                    gm.append(f'sig{i}', 'SIG')
+                gm.append('missing', 'MISSING')
+
+                names = []
+                for name, result in gm.execute_iter():
+                    names.append(name)
+
+                    # Each result can be used as soon as it has been yielded
+                    if name != 'missing':
+                        self.assertEqual(gm.get(name).data()[-1], 999999)
+
+                self.assertEqual(names, [ 'sig0', 'sig1', 'sig2', 'sig3', 'missing' ])
+                with self.assertRaises(TreeNNF):
+                    gm.get('missing')
+
+                # The connection cannot be used until the iteration is finished
+                results = gm.execute_iter()
+                next(results)
+                with self.assertRaises(MdsException):
+                    c.get('1')
+
+                # Stopping early throws away the rest of the reply
+                results.close()
+                self.assertEqual(c.get('1'), 1)
+                self.assertEqual(len(list(gm.execute_iter())), 5)
+
+    def test_batches(self):
+        self.server.addTree('large', { f'SIG{i}': numpy.full(1000, i, dtype=numpy.float32) for i in range(6) })
+
+        c = Connection(self.server.url)
+        c.openTree('large', 1)
+
+        pool = ConnectionPool(self.server.url, max_connections=2)
+        options = [
+            { 'max_queries': 2 },
+            { 'max_reply_size': 10000, 'probe_sizes': True },
+            { 'max_queries': 2, 'dispatch': BATCH_DISPATCH_PIPELINED },
+            { 'max_queries': 2, 'dispatch': BATCH_DISPATCH_POOL, 'pool': pool },
+        ]
+
+        for kwargs in options:
+            with self.subTest(**{ key: value for key, value in kwargs.items() if key != 'pool' }):
+                gm = c.getMany(**kwargs)
+                gm.append('missing', 'MISSING')
+                for i in range(0, 6, 2):
+                    # The variable has to be evaluated in the same batch as it was assigned
+                    gm.append(f'sig{i}', f'_sig{i} = SIG{i}')
+                    gm.append(f'sig{i + 1}', f'_sig{i}')
+
+                result = gm.execute()
+
+                self.assertEqual([ key.data() for key in result.keys() ], [ 'missing', 'sig0', 'sig1', 'sig2', 'sig3', 'sig4', 'sig5' ])
+                for i in range(6):
+                    self.assertEqual(gm.get(f'sig{i}').data()[0], i - (i % 2))
+
+                with self.assertRaises(TreeNNF):
+                    gm.get('missing')
+
+        pool.close()
+
+        seen = []
+        def log(request, proceed):
+            seen.append(request.expr)
+            return proceed(request)
+
+        # Each leased connection opens the trees once, and closes them before it is released
+        pool = ConnectionPool(self.server.url, max_connections=2, interceptors=[ log ])
+        gm = c.getMany(max_queries=1, dispatch=BATCH_DISPATCH_POOL, pool=pool)
+        for i in range(6):
+            gm.append(f'sig{i}', f'SIG{i}')
+
+        gm.execute()
+        self.assertEqual(seen.count('TreeOpen($,$)'), 2)
+        self.assertEqual(seen.count('GetManyExecute($)'), 6)
+
+        with pool.connection() as leased:
+            with self.assertRaises(MdsException):
+                leased.get('SIG0')
+
+        # TDI variables of our connection are not available to the leased connections
+        c.get('_outside = 1')
+        gm = c.getMany(max_queries=1, dispatch=BATCH_DISPATCH_POOL, pool=pool)
+        gm.append('inside', '_inside = 2')
+        gm.append('outside', '_outside')
+        gm.execute()
+
+        self.assertEqual(gm.get('inside'), 2)
+        with self.assertRaises(TdiUNKNOWN_VAR):
+            gm.get('outside')
+
+        pool.close()
+
+        # The expected reply sizes can also be given instead of probing for them
+        gm = c.getMany(max_reply_size=10000)
+        for i in range(6):
+            gm.append(f'sig{i}', f'SIG{i}', reply_size=4000)
+
+        count = self.server.request_count
+        gm.execute()
+        self.assertEqual(self.server.request_count - count, 3)
+        self.assertEqual(len(list(gm.execute_iter())), 6)
+
+        pm = c.putMany(max_queries=4)
+        for i in range(6):
+            pm.append(f'SIG{i}', '$', i * 10)
+
+        count = self.server.request_count
+        result = pm.execute()
+        self.assertEqual(self.server.request_count - count, 2)
+        self.assertEqual(len(result), 6)
+        self.assertEqual(self.server.getNode('large', 'SIG5'), 50)
+
+    def test_chunked(self):
+        data = numpy.arange(24000, dtype=numpy.float64).reshape(24, 1000)
+        self.server.addTree('chunked', { 'BIG': data, 'EMPTY': None, 'SCALAR': Int32(5) })
+
+        c = Connection(self.server.url)
+        c.openTree('chunked', 1)
+
+        count = self.server.request_count
+        result = c.getChunked('BIG', chunk_size=10000)
+        self.assertGreater(self.server.request_count - count, 10)
+        self.assertIsInstance(result, Float64Array)
+        self.assertTrue(numpy.array_equal(result.data(), data))
+
+        out = numpy.empty_like(data)
+        result = c.getChunked('BIG', chunk_size=10000, out=out)
+        self.assertTrue(numpy.may_share_memory(result.data(), out))
+        self.assertTrue(numpy.array_equal(out, data))
+
+        self.assertEqual(c.getChunked('SCALAR', chunk_size=10000), Int32(5))
+
+        with self.assertRaises(MdsException):
+            c.getChunked('BIG', out=numpy.empty(5))
+
+        with self.assertRaises(TreeNNF):
+            c.getChunked('MISSING')
+
+        count = self.server.request_count
+        c.put('EMPTY', '$', data, chunk_size=10000)
+        self.assertGreater(self.server.request_count - count, 10)
+        self.assertTrue(numpy.array_equal(self.server.getNode('chunked', 'EMPTY'), data))
+
+        # The variables used to assemble the chunks are freed on the server
+        with self.assertRaises(TdiUNKNOWN_VAR):
+            c.get(CHUNKED_VARIABLE.format(1))
+
+        seen = []
+        def log(request, proceed):
+            seen.append(request.expr)
+            return proceed(request)
+
+        # More chunks than can be joined at once are joined in groups, each sent once
+        c.addInterceptor(log)
+        c.put('EMPTY', '$', data, chunk_size=500)
+        self.assertTrue(numpy.array_equal(self.server.getNode('chunked', 'EMPTY'), data))
+        self.assertEqual(len([ expr for expr in seen if expr.endswith('=$;1') ]), 388)
+        self.assertEqual(len([ expr for expr in seen if '=[' in expr ]), 3)
+
+        for expr in seen:
+            for variable in re.findall(r'(_mdsthin_chunked\w+)=', expr):
+                with self.assertRaises(TdiUNKNOWN_VAR):
+                    c.get(variable)
+
+        c.removeInterceptor(log)
+
+        # The data on the server is lost if the connection is restored part way through
+        def drop(request, proceed):
+            seen.append(request.expr)
+            if len(seen) == 2:
+                self.server.dropConnections()
+            return proceed(request)
+
+        c = Connection(self.server.url, auto_reconnect=True, interceptors=[ drop ])
+        c.openTree('chunked', 1)
+
+        seen.clear()
+        with self.assertRaisesRegex(MdsException, 'lost during a chunked transfer'):
+            c.put('EMPTY', '$', data, chunk_size=10000)
+
+        seen.clear()
+        with self.assertRaisesRegex(MdsException, 'lost during a chunked transfer'):
+            c.getChunked('BIG', chunk_size=10000)
+
+        self.assertTrue(numpy.array_equal(c.getChunked('BIG', chunk_size=10000).data(), data))
@@ -0,0 +1,754 @@
+#
+# Copyright (c) 2024, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import re
+import time
+import queue
+import ctypes
+import contextlib
+import socket
+import threading
+import socketserver
+
+from .exceptions import *
+from .descriptors import *
+from .message import *
+
+# The version reported to `Tcl('show version')`, which is read by `Connection.getServerVersion()`
+TESTING_SERVER_VERSION = (7, 153, 3)
+
+_HEADER_SIZE = ctypes.sizeof(MsgHdr)
+
+# The MDSip protocol version sent in the login response
+_MDSIP_VERSION = 3
+
+_INTEGER_LITERAL = re.compile(r'([+-]?\d+)(BU|WU|LU|QU|B|W|L|Q)?', re.IGNORECASE)
+_FLOAT_LITERAL = re.compile(r'[+-]?(\d+\.\d*|\.\d+|\d+(?=[ED]))([ED][+-]?\d+)?', re.IGNORECASE)
+_STRING_LITERAL = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+_ARGUMENT = re.compile(r'\$(\d*)')
+_VARIABLE = re.compile(r'_\w+')
+_ASSIGNMENT = re.compile(r'(_\w+)\s*=\s*(.+)', re.DOTALL)
+_NODE_PATH = re.compile(r'[\\.:]?[\w$.:\\-]+')
+
+_INTEGER_TYPES = {
+    None: Int32,
+    'B': Int8,
+    'BU': UInt8,
+    'W': Int16,
+    'WU': UInt16,
+    'L': Int32,
+    'LU': UInt32,
+    'Q': Int64,
+    'QU': UInt64,
+}
+
+def _splitTopLevel(expr: str, separator: str):
+    """
+    Split an expression on a separator that is not inside brackets or a string literal.
+    """
+
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(expr):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == separator and depth == 0:
+            parts.append(expr[start : i].strip())
+            start = i + 1
+
+    parts.append(expr[start : ].strip())
+    return parts
+
+def _isParenthesized(expr: str):
+    """
+    Check if an expression is entirely inside one pair of parentheses, such as `(a+b)` but not `(a)+(b)`.
+    """
+
+    if not expr.startswith('(') or not expr.endswith(')'):
+        return False
+
+    depth = 0
+    quote = None
+    for c in expr[ : -1 ]:
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+            if depth == 0:
+                return False
+
+    return True
+
+def _normalizePath(path: str):
+    """
+    Reduce a node path to the form used as a key in `MdsipTestServer.trees`, so that
+    `\\TREE::TOP:NODE`, `\\NODE`, `:NODE`, and `node` all refer to the same node.
+    """
+
+    path = path.strip().upper().lstrip('\\')
+    path = path.split('::', maxsplit=1)[-1]
+
+    if path == 'TOP':
+        return ''
+
+    if path.startswith('TOP.') or path.startswith('TOP:'):
+        path = path[4 : ]
+
+    return path.lstrip('.:')
+
+class _Session:
+    """
+    The state of one client connection, like the state of one mdsip server process.
+    """
+
+    def __init__(self, username: str, compression_level: int):
+        self.username = username
+        self.compression_level = compression_level
+        self.open_trees = []
+        self.default_path = ''
+        self.variables = {}
+        self.environment = {}
+
+    @property
+    def current_tree(self):
+        if len(self.open_trees) == 0:
+            return None
+        return self.open_trees[-1]
+
+class _OpenTree:
+
+    def __init__(self, name: str, shot: int, nodes: dict, readonly: bool):
+        self.name = name
+        self.shot = shot
+        self.nodes = nodes
+        self.readonly = readonly
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.server.testing_server._serve(self.request)
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class MdsipTestServer:
+    """
+    An in-process mdsip server for tests and benchmarks, which needs neither MDSplus nor
+    a network. It speaks the real protocol, including the login handshake, compression,
+    and message ids, so any :class:`Connection` or :class:`ConnectionPool` can connect to
+    `url` and exercise the same code paths as they would against a real server.
+
+    Rather than a full TDI interpreter, it understands the expressions that mdsthin itself
+    sends, such as `TreeOpen($,$)`, `TreePut(...)`, `SerializeOut(...)`, `SerializeIn($)`,
+    `GetManyExecute($)`, and `PutManyExecute($)`, each call to which has its own `_variables`
+    as on a real server, along with literals, `$` arguments,
+    `_variables`, node paths, `data()`, `dim_of()`, `size()`, `shape()`, `set_range()`, subscripts,
+    `[a,b]`, `deallocate()`, and statements separated by `;`. Anything else can be scripted with
+    `expressions`.
+
+    Example:
+    ```
+    with MdsipTestServer(trees={ 'test': { '\\\\IP': numpy.arange(1000.0) } }) as server:
+        conn = Connection(server.url)
+        conn.openTree('test', 1)
+        ip = conn.get('\\\\IP').data()
+    ```
+
+    :param dict trees: The in-memory trees to serve, as `{ TREE: { PATH: VALUE } }`. Every
+        shot of a tree refers to the same nodes, and `TreePut` can only write to nodes that
+        already exist, so use a VALUE of None for an empty node.
+    :param dict expressions: Scripted responses, as `{ EXPR: VALUE }`. If VALUE is callable,
+        it is called with the arguments of the request, and its return value is sent. This
+        is checked before anything else, so it can override the built-in expressions.
+    :param int compression_level: The highest compression level to agree to, from 0 to 9.
+        The level used is the lower of this and the level requested by the client.
+    :param float latency: An artificial delay in seconds before each reply is sent, to
+        imitate the round trip time of a real network. Replies are delayed independently,
+        so requests that are pipelined overlap their delays like they would on a network.
+    :param float bandwidth: An artificial limit on how fast replies are sent, in bytes per
+        second, to imitate a slow network.
+    :param str host: The address to listen on, defaults to the loopback interface.
+    :param int port: The port to listen on, defaults to a free port chosen by the system.
+    """
+
+    def __init__(
+            self,
+            trees: dict = None,
+            expressions: dict = None,
+            compression_level: int = 0,
+            latency: float = 0,
+            bandwidth: float = None,
+            host: str = '127.0.0.1',
+            port: int = 0,
+        ):
+
+        if compression_level < 0 or compression_level > 9:
+            raise MdsException(f'Invalid compression level: {compression_level}, must be between 0 and 9')
+
+        self._lock = threading.Lock()
+        self._sockets = set()
+
+        self.trees = {}
+        for tree, nodes in (trees or {}).items():
+            self.addTree(tree, nodes)
+
+        self.expressions = dict(expressions or {})
+        self.compression_level = compression_level
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+        # The number of logins and requests handled, to check how connections are reused
+        self.connection_count = 0
+        self.request_count = 0
+
+        self._server = _ThreadingServer((host, port), _RequestHandler)
+        self._server.testing_server = self
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MdsipTestServer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def url(self):
+        """
+        The URL to pass to :class:`Connection` to connect to this server.
+        """
+        return f'{self.host}:{self.port}'
+
+    def addTree(self, tree: str, nodes: dict):
+        """
+        Add or replace an in-memory tree.
+
+        :param str tree: The name of the tree.
+        :param dict nodes: The nodes of the tree, as `{ PATH: VALUE }`.
+        """
+        with self._lock:
+            self.trees[tree.upper()] = {
+                _normalizePath(path): (None if value is None else Descriptor.from_data(value))
+                for path, value in nodes.items()
+            }
+
+    def getNode(self, tree: str, path: str):
+        """
+        Get the value stored in a node, for example to check the result of `put()`.
+
+        :param str tree: The name of the tree.
+        :param str path: The path to the node.
+        :return: The value of the node, or None if it is empty.
+        :rtype: :class:`Descriptor`
+        :raises TreeFILE_NOT_FOUND: if the tree does not exist.
+        :raises TreeNNF: if the node does not exist.
+        """
+        with self._lock:
+            if tree.upper() not in self.trees:
+                raise TreeFILE_NOT_FOUND()
+
+            nodes = self.trees[tree.upper()]
+            if _normalizePath(path) not in nodes:
+                raise TreeNNF()
+
+            return nodes[_normalizePath(path)]
+
+    def dropConnections(self):
+        """
+        Close the sockets of every connected client, as if the network had failed. This
+        allows testing `auto_reconnect` and `ConnectionPool` recovery.
+        """
+        with self._lock:
+            sockets = list(self._sockets)
+
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Stop listening and disconnect every client.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self.dropConnections()
+        self._thread.join()
+
+    def _serve(self, sock: socket.socket):
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        with self._lock:
+            self._sockets.add(sock)
+
+        replies = None
+        writer = None
+        if self.latency > 0:
+            replies = queue.Queue()
+            writer = threading.Thread(target=self._write, args=(sock, replies), daemon=True)
+            writer.start()
+
+        try:
+            # The login request uses dims[0] for the protocol version, so the username is
+            # read as raw bytes instead of with `unpack_data()`
+            header = Message.from_buffer_copy(self._recvExact(sock, _HEADER_SIZE))
+            username = self._recvExact(sock, header.msglen - _HEADER_SIZE).decode()
+
+            session = _Session(username, min(header.status, self.compression_level))
+
+            # The login response is a copy of the login request with a few fields changed
+            login = Message.from_buffer_copy(bytes(header))
+            login.msglen = _HEADER_SIZE
+            login.status = 1 | (session.compression_level << 1)
+            login.ndims = 1
+            login.dims[0] = _MDSIP_VERSION
+            sock.sendall(bytes(login))
+
+            with self._lock:
+                self.connection_count += 1
+
+            while True:
+                header, expr = self._read(sock)
+                args = [ self._read(sock)[1] for _ in range(header.nargs - 1) ]
+
+                with self._lock:
+                    self.request_count += 1
+
+                msg = self._reply(session, expr.data(), args)
+                msg.message_id = header.message_id
+
+                if replies is None:
+                    self._send(sock, msg.pack())
+                else:
+                    replies.put((time.monotonic() + self.latency, msg.pack()))
+
+        except (EOFError, OSError):
+            pass
+
+        finally:
+            if replies is not None:
+                replies.put(None)
+                writer.join()
+
+            with self._lock:
+                self._sockets.discard(sock)
+
+    def _write(self, sock: socket.socket, replies: queue.Queue):
+        while True:
+            reply = replies.get()
+            if reply is None:
+                break
+
+            due, buffer = reply
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                self._send(sock, buffer)
+            except OSError:
+                break
+
+    def _send(self, sock: socket.socket, buffer: bytes):
+        if self.bandwidth is None:
+            sock.sendall(buffer)
+            return
+
+        # Send a hundredth of a second's worth at a time
+        view = memoryview(buffer)
+        chunk_size = max(1, int(self.bandwidth / 100))
+        for offset in range(0, len(view), chunk_size):
+            chunk = view[ offset : offset + chunk_size ]
+            sock.sendall(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def _recvExact(self, sock: socket.socket, size: int):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        while len(view) > 0:
+            bytes_read = sock.recv_into(view)
+            if bytes_read == 0:
+                raise EOFError()
+            view = view[bytes_read : ]
+        return buffer
+
+    def _read(self, sock: socket.socket):
+        header = Message.from_buffer_copy(self._recvExact(sock, _HEADER_SIZE))
+        data = self._recvExact(sock, header.msglen - _HEADER_SIZE)
+
+        if header.dtype_id == DTYPE_MISSING:
+            return header, Descriptor()
+
+        return header, header.unpack_data(data)
+
+    def _reply(self, session: _Session, expr: str, args: list):
+
+        try:
+            value = self._evaluate(session, expr, args)
+
+            # Only scalars and arrays can be sent, so records such as Signals are sent as
+            # their data, like data() would do
+            if value is not None and not isinstance(value, (DescriptorS, DescriptorA)) and type(value) is not Descriptor:
+                if isinstance(value, DescriptorAPD):
+                    raise TdiINVCLADSC()
+
+                value = Descriptor.from_data(value.data())
+
+            msg = Message(value)
+            msg.status = 1
+
+        except MdsException as e:
+            msg = Message()
+            msg.status = getattr(e, 'status', TdiABORT.status)
+
+        if session.compression_level > 0:
+            msg.compress(session.compression_level)
+
+        return msg
+
+    def _evaluate(self, session: _Session, expr: str, args: list):
+        """
+        Evaluate an expression for a session, and return the resulting :class:`Descriptor`.
+        """
+
+        expr = expr.strip()
+
+        if expr in self.expressions:
+            value = self.expressions[expr]
+            if callable(value):
+                try:
+                    value = value(*args)
+                except MdsException:
+                    raise
+                except Exception as e:
+                    raise MdsException(str(e)) from e
+
+            return Descriptor.from_data(value)
+
+        for pattern, method in self._BUILTINS:
+            match = pattern.fullmatch(expr)
+            if match is not None:
+                return method(self, session, match, args)
+
+        statements = _splitTopLevel(expr, ';')
+        if len(statements) > 1:
+            for statement in statements[ : -1 ]:
+                self._evaluate(session, statement, args)
+            return self._evaluate(session, statements[-1], args)
+
+        if _isParenthesized(expr):
+            return self._evaluate(session, expr[1 : -1], args)
+
+        match = _INTEGER_LITERAL.fullmatch(expr)
+        if match is not None:
+            suffix = match[2].upper() if match[2] else None
+            return _INTEGER_TYPES[suffix](int(match[1]))
+
+        match = _FLOAT_LITERAL.fullmatch(expr)
+        if match is not None:
+            if 'D' in expr.upper():
+                return Float64(float(expr.upper().replace('D', 'E')))
+            return Float32(float(expr))
+
+        match = _STRING_LITERAL.fullmatch(expr)
+        if match is not None:
+            return String(match[1] if match[1] is not None else match[2])
+
+        match = _ARGUMENT.fullmatch(expr)
+        if match is not None:
+            index = int(match[1]) - 1 if match[1] else 0
+            if index < 0 or index >= len(args):
+                raise TdiSYNTAX()
+            return args[index]
+
+        match = _ASSIGNMENT.fullmatch(expr)
+        if match is not None:
+            value = self._evaluate(session, match[2], args)
+            session.variables[match[1].upper()] = value
+            return value
+
+        if _VARIABLE.fullmatch(expr):
+            if expr.upper() not in session.variables:
+                raise TdiUNKNOWN_VAR()
+            return session.variables[expr.upper()]
+
+        if _NODE_PATH.fullmatch(expr):
+            return self._getNode(session, expr)
+
+        raise TdiSYNTAX()
+
+    def _resolvePath(self, session: _Session, path: str):
+        if path.startswith('.') or path.startswith(':'):
+            if session.default_path:
+                return _normalizePath(session.default_path + path)
+        return _normalizePath(path)
+
+    def _getNode(self, session: _Session, path: str):
+        tree = session.current_tree
+        if tree is None:
+            raise TreeNOT_OPEN()
+
+        with self._lock:
+            key = self._resolvePath(session, path)
+            if key not in tree.nodes:
+                raise TreeNNF()
+
+            value = tree.nodes[key]
+
+        if value is None:
+            raise TreeNODATA()
+
+        return value
+
+    def _putNode(self, session: _Session, path: str, value):
+        tree = session.current_tree
+        if tree is None:
+            raise TreeNOT_OPEN()
+
+        if tree.readonly:
+            raise TreeREADONLY()
+
+        with self._lock:
+            key = self._resolvePath(session, path)
+            if key not in tree.nodes:
+                raise TreeNNF()
+
+            tree.nodes[key] = value
+
+    def _treeOpen(self, session: _Session, match, args, readonly=False):
+        name = args[0].data().upper()
+        shot = int(args[1].data())
+
+        if name not in self.trees:
+            return Int32(TreeFILE_NOT_FOUND.status)
+
+        session.open_trees.append(_OpenTree(name, shot, self.trees[name], readonly))
+        session.default_path = ''
+        return Int32(1)
+
+    def _treeOpenReadonly(self, session: _Session, match, args):
+        return self._treeOpen(session, match, args, readonly=True)
+
+    def _treeClose(self, session: _Session, match, args):
+        name = args[0].data().upper()
+        shot = int(args[1].data())
+
+        for tree in reversed(session.open_trees):
+            if tree.name == name and tree.shot == shot:
+                session.open_trees.remove(tree)
+                return Int32(1)
+
+        return Int32(TreeNOT_OPEN.status)
+
+    def _treeCloseAll(self, session: _Session, match, args):
+        count = len(session.open_trees)
+        session.open_trees.clear()
+        return Int32(count)
+
+    def _treeSetDefault(self, session: _Session, match, args):
+        path = args[0].data()
+
+        try:
+            self._getNode(session, path)
+        except TreeNODATA:
+            pass
+        except MdsException as e:
+            return Int32(e.status)
+
+        session.default_path = self._resolvePath(session, path)
+        return Int32(1)
+
+    def _treePut(self, session: _Session, match, args):
+        # Each `$` takes the next argument, while other arguments are evaluated, such as variables
+        values = []
+        remaining = iter(args)
+        for part in _splitTopLevel(match[1], ','):
+            if part == '$':
+                values.append(next(remaining, None))
+            else:
+                values.append(self._evaluate(session, part, args))
+
+        if len(values) < 2 or None in values:
+            raise TdiSYNTAX()
+
+        try:
+            self._putNode(session, values[0].data(), self._evaluate(session, values[1].data(), values[2 : ]))
+        except MdsException as e:
+            return Int32(getattr(e, 'status', TdiABORT.status))
+
+        return Int32(1)
+
+    def _data(self, session: _Session, match, args):
+        value = self._evaluate(session, match[1], args)
+        if isinstance(value, (DescriptorS, DescriptorA)):
+            return value
+        return Descriptor.from_data(value.data())
+
+    def _dimOf(self, session: _Session, match, args):
+        value = self._evaluate(session, match[1], args)
+        if not isinstance(value, Signal):
+            raise TdiINVCLADSC()
+        return value.dim_of(int(match[2] or 0))
+
+    def _size(self, session: _Session, match, args):
+        return Int32(numpy.size(self._evaluate(session, match[1], args).data()))
+
+    def _shape(self, session: _Session, match, args):
+        # TDI lists the dimensions fastest first
+        shape = numpy.shape(self._evaluate(session, match[1], args).data())
+        return Descriptor.from_data(numpy.array(shape[ : : -1 ], dtype=numpy.int32))
+
+    def _setRange(self, session: _Session, match, args):
+        *dims, value = [ self._evaluate(session, part, args) for part in _splitTopLevel(match[1], ',') ]
+        shape = tuple(int(dim.data()) for dim in reversed(dims))
+        return Descriptor.from_data(numpy.reshape(value.data(), shape))
+
+    def _subscript(self, session: _Session, match, args):
+        value = numpy.atleast_1d(self._evaluate(session, match[1], args).data())
+        bounds = [ int(self._evaluate(session, part, args).data()) for part in _splitTopLevel(match[2], ':') ]
+        if len(bounds) == 1:
+            return Descriptor.from_data(value[bounds[0]])
+
+        # Ranges include their upper bound
+        return Descriptor.from_data(value[bounds[0] : bounds[1] + 1])
+
+    def _concatenate(self, session: _Session, match, args):
+        values = [ numpy.atleast_1d(self._evaluate(session, part, args).data()) for part in _splitTopLevel(match[1], ',') ]
+        return Descriptor.from_data(numpy.concatenate(values))
+
+    def _deallocate(self, session: _Session, match, args):
+        session.variables.pop(match[1].upper(), None)
+        return Int32(1)
+
+    def _serializeOut(self, session: _Session, match, args):
+        return self._evaluate(session, match[1], args).serialize()
+
+    def _serializeIn(self, session: _Session, match, args):
+        return args[0].deserialize()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _privateVariables(session: _Session):
+        # Like any TDI function, GetManyExecute() and PutManyExecute() have their own private variables
+        variables, session.variables = session.variables, {}
+        try:
+            yield
+        finally:
+            session.variables = variables
+
+    def _getManyExecute(self, session: _Session, match, args):
+        result = Dictionary()
+        with self._privateVariables(session):
+            for query in args[0].deserialize():
+                query_args = list(query['args']) if 'args' in query else []
+                try:
+                    value = self._evaluate(session, query['exp'].data(), query_args)
+                    result[query['name']] = Dictionary({ 'value': value })
+                except MdsException as e:
+                    result[query['name']] = Dictionary({ 'error': str(e) })
+
+        return result.serialize()
+
+    def _putManyExecute(self, session: _Session, match, args):
+        result = Dictionary()
+        with self._privateVariables(session):
+            for query in args[0].deserialize():
+                query_args = list(query['args']) if 'args' in query else []
+                try:
+                    self._putNode(session, query['node'].data(), self._evaluate(session, query['exp'].data(), query_args))
+                    result[query['node']] = 'Success'
+                except MdsException as e:
+                    result[query['node']] = str(e)
+
+        return result.serialize()
+
+    def _tcl(self, session: _Session, match, args):
+        command = args[0].data().strip().lower()
+        if command == 'show version':
+            return String('MDSplus version: {}.{}.{}\n'.format(*TESTING_SERVER_VERSION))
+
+        raise TdiSYNTAX()
+
+    def _whoami(self, session: _Session, match, args):
+        return String(session.username)
+
+    def _getenv(self, session: _Session, match, args):
+        return String(session.environment.get(match[1], ''))
+
+    def _setenv(self, session: _Session, match, args):
+        session.environment[match[1]] = match[2]
+        return Int32(0)
+
+    _BUILTINS = [
+        (re.compile(r'TreeOpen\(\$,\$\)', re.IGNORECASE), _treeOpen),
+        (re.compile(r'TreeOpenEdit\(\$,\$\)', re.IGNORECASE), _treeOpen),
+        (re.compile(r'TreeOpen\(\$,\$,1\)', re.IGNORECASE), _treeOpenReadonly),
+        (re.compile(r'TreeClose\(\$,\$\)', re.IGNORECASE), _treeClose),
+        (re.compile(r'_i=0;WHILE\(IAND\(TreeClose\(\),1\)\) _i\+\+;_i', re.IGNORECASE), _treeCloseAll),
+        (re.compile(r'TreeSetDefault\(\$\)', re.IGNORECASE), _treeSetDefault),
+        (re.compile(r'TreePut\((\$,\$(?:,.+)?)\)', re.IGNORECASE | re.DOTALL), _treePut),
+        (re.compile(r'SerializeOut\(`\((.*);\)\)', re.IGNORECASE | re.DOTALL), _serializeOut),
+        (re.compile(r'SerializeIn\(\$\)', re.IGNORECASE), _serializeIn),
+        (re.compile(r'GetManyExecute\(\$\)', re.IGNORECASE), _getManyExecute),
+        (re.compile(r'PutManyExecute\(\$\)', re.IGNORECASE), _putManyExecute),
+        (re.compile(r'Tcl\(\$,_res\);_res', re.IGNORECASE), _tcl),
+        (re.compile(r'whoami\(\)', re.IGNORECASE), _whoami),
+        (re.compile(r'getenv\("([^"=]*)"\)', re.IGNORECASE), _getenv),
+        (re.compile(r'setenv\("([^"=]*)=([^"]*)"\)', re.IGNORECASE), _setenv),
+        (re.compile(r'data\((.*)\)', re.IGNORECASE | re.DOTALL), _data),
+        (re.compile(r'dim_of\((.*?)(?:,\s*(\d+))?\)', re.IGNORECASE | re.DOTALL), _dimOf),
+        (re.compile(r'size\((.*)\)', re.IGNORECASE | re.DOTALL), _size),
+        (re.compile(r'shape\((.*)\)', re.IGNORECASE | re.DOTALL), _shape),
+        (re.compile(r'set_range\((.*)\)', re.IGNORECASE | re.DOTALL), _setRange),
+        (re.compile(r'(_\w+)\[([^\[\]]+)\]', re.IGNORECASE), _subscript),
+        (re.compile(r'\[(.*)\]', re.DOTALL), _concatenate),
+        (re.compile(r'deallocate\("(_\w+)"\)', re.IGNORECASE), _deallocate),
+    ]